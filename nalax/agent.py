@@ -1,65 +1,148 @@
 # Copyright Amethyst Reese
 # Licensed under the MIT license
 
+import json
+import pkgutil
 import re
 import sys
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, NamedTuple, Sequence
 
-from rich import print
-
+from . import metrics, profiling
 from .types import Agent
 
 AGENT_RE = re.compile(r"mozilla/\d.\d \(([^)]*)\)(.*)")
 
+FIELDS = ("agent", "system", "client")
+SECTIONS = {
+    # section: default field to search
+    "agents": "agent",
+    "platforms": "system",
+    "browsers": "client",
+    "fallbacks": "agent",
+}
+
+
+class Rule(NamedTuple):
+    field: str
+    needles: tuple[str, ...]
+    device: str
+    os: str
+    browser: str
+
+
+class Rules(NamedTuple):
+    """
+    Ordered user agent rules; within each section, the first matching rule wins.
+
+    - agents: checked first against the whole agent string, for bots, etc
+    - platforms: device and os, checked against the mozilla "(system)" section
+    - browsers: browser, checked against the client section after "(system)"
+    - fallbacks: checked against the whole string if it isn't mozilla-like
+    """
+
+    agents: tuple[Rule, ...]
+    platforms: tuple[Rule, ...]
+    browsers: tuple[Rule, ...]
+    fallbacks: tuple[Rule, ...]
+
+
+def compile_rules(data: dict[str, Any]) -> Rules:
+    sections: dict[str, tuple[Rule, ...]] = {}
+    for section, default in SECTIONS.items():
+        rules: list[Rule] = []
+        for value in data.get(section, ()):
+            field = value.get("field", default)
+            if field not in FIELDS:
+                raise ValueError(f"unknown field {field!r} in {section} rule {value}")
+            needles = tuple(needle.lower() for needle in value["match"])
+            if not needles:
+                raise ValueError(f"empty match in {section} rule {value}")
+            rules.append(
+                Rule(
+                    field,
+                    needles,
+                    value.get("device", "other"),
+                    value.get("os", "other"),
+                    value.get("browser", "other"),
+                )
+            )
+        sections[section] = tuple(rules)
+    return Rules(**sections)
+
+
+def load_rules(path: Path | None = None) -> None:
+    """
+    Load user agent rules from a JSON file, or the packaged defaults.
+    """
+    global RULES
+
+    if path is None:
+        content = pkgutil.get_data("nalax", "agents.json")
+        assert content is not None
+    else:
+        content = path.read_bytes()
+
+    RULES = compile_rules(json.loads(content))
+    user_agent.cache_clear()
 
+
+def first(rules: Sequence[Rule], fields: dict[str, str]) -> Rule | None:
+    for rule in rules:
+        haystack = fields[rule.field]
+        for needle in rule.needles:
+            if needle in haystack:
+                return rule
+    return None
+
+
+@lru_cache(maxsize=8192)
 def user_agent(agent: str) -> Agent:
-    agent = agent.lower()
-    if match := AGENT_RE.match(agent):
-        system, client = match.groups()
-
-        if "android" in system:
-            device = "mobile"
-            os = "android"
-        elif "ipad" in system or "iphone" in system:
-            device = "mobile"
-            os = "ios"
-        elif "mac os" in system:
-            device = "desktop"
-            os = "macos"
-        elif "windows" in system:
-            device = "desktop"
-            os = "windows"
-        elif "linux" in system:
-            device = "desktop"
-            os = "linux"
-        else:
-            device = "other"
-            os = "other"
-
-        if any(c in client for c in ("firefox/", "fxios/")):
-            browser = "firefox"
-        elif any(c in client for c in ("edg/", "edge/", "edga/", "edgios/")):
-            browser = "edge"
-        elif "brave/" in client:
-            browser = "brave"
-        elif any(c in client for c in ("chrome/", "crios/")):
-            browser = "chrome"
-        elif "safari/" in client:
-            browser = "safari"
-        elif "trident" in system or "msie" in system:
-            browser = "ie"
+    with profiling.span("agent.user_agent"):
+        agent = agent.lower()
+        fields = {"agent": agent, "system": "", "client": ""}
+
+        if rule := first(RULES.agents, fields):
+            return Agent(rule.device, rule.os, rule.browser)
+
+        if match := AGENT_RE.match(agent):
+            fields["system"], fields["client"] = match.groups()
+
+            device = os = browser = "other"
+            if rule := first(RULES.platforms, fields):
+                device, os = rule.device, rule.os
+            if rule := first(RULES.browsers, fields):
+                browser = rule.browser
+
+            return Agent(device, os, browser)
+
+        elif rule := first(RULES.fallbacks, fields):
+            return Agent(rule.device, rule.os, rule.browser)
+
         else:
-            browser = "other"
+            return Agent("unknown", "unknown", "unknown")
 
-        return Agent(device, os, browser)
 
-    elif "safari/" in agent:
-        return Agent("other", "other", "safari")
+def cache_stats() -> dict[tuple[str, ...], float]:
+    info = user_agent.cache_info()
+    return {("hit",): info.hits, ("miss",): info.misses}
 
-    else:
-        return Agent("unknown", "unknown", "unknown")
+
+metrics.Counter(
+    "nalax_agent_cache_lookups_total",
+    "User agent classifications, by cache result",
+    ("result",),
+    collect=cache_stats,
+)
+
+RULES = Rules((), (), (), ())
+load_rules()
 
 
 if __name__ == "__main__":
+    from rich import print
+
     for s in sys.argv[1:]:
         print(s)
         print(user_agent(s))
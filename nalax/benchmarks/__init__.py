@@ -0,0 +1,8 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+"""
+Microbenchmarks for the ingest hot path.
+
+Run with `python -m nalax.benchmarks --help`.
+"""
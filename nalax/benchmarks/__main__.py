@@ -0,0 +1,92 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+import json
+import logging
+import sys
+from pathlib import Path
+
+import click
+
+from .bench import BENCHMARKS, compare, dump, REPEAT, run_benchmarks, SIZES, THRESHOLD
+
+
+@click.command()
+@click.option(
+    "--size",
+    "sizes",
+    type=int,
+    multiple=True,
+    default=SIZES,
+    show_default=True,
+    help="number of log records per run, may be given multiple times",
+)
+@click.option(
+    "--only",
+    "names",
+    type=click.Choice(list(BENCHMARKS)),
+    multiple=True,
+    help="run only these benchmarks",
+)
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option("--repeat", type=int, default=REPEAT, show_default=True)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="save results as JSON",
+)
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=None,
+    help="compare against results saved with --output",
+)
+@click.option(
+    "--threshold",
+    type=float,
+    default=THRESHOLD,
+    show_default=True,
+    help="fail if throughput drops by more than this fraction of the baseline",
+)
+def main(
+    sizes: tuple[int, ...],
+    names: tuple[str, ...],
+    seed: int,
+    repeat: int,
+    output: Path | None,
+    baseline: Path | None,
+    threshold: float,
+) -> None:
+    """
+    Benchmark the nalax ingest hot path
+    """
+    logging.basicConfig(level=logging.WARNING)
+
+    results = []
+    click.echo(f"{'benchmark':<28} {'size':>8} {'ops/sec':>12} {'peak KiB':>10}")
+    for result in run_benchmarks(sizes, names or tuple(BENCHMARKS), seed, repeat):
+        click.echo(
+            f"{result.name:<28} {result.size:>8} "
+            f"{result.ops_per_sec:>12.0f} {result.peak_kb:>10.0f}"
+        )
+        results.append(result)
+
+    if output:
+        output.write_text(json.dumps(dump(results), indent=2) + "\n")
+
+    if baseline:
+        regressions = compare(json.loads(baseline.read_text()), results, threshold)
+        for regression in regressions:
+            click.echo(
+                f"REGRESSION {regression.name}[{regression.size}]: "
+                f"{regression.current:.0f} ops/sec vs {regression.baseline:.0f} "
+                f"baseline ({regression.change:+.0%})"
+            )
+        if regressions:
+            sys.exit(1)
+        click.echo(f"no regressions beyond {threshold:.0%} of baseline")
+
+
+if __name__ == "__main__":
+    main()
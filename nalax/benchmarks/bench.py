@@ -0,0 +1,265 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+import gc
+import json
+import logging
+import platform
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Callable, Iterator
+
+import arrow
+
+from .. import db, formats, iplookup
+from ..__version__ import __version__
+from ..agent import user_agent
+from ..tail import convert
+from ..types import Event
+from .generate import LogGenerator
+
+LOG = logging.getLogger(__name__)
+
+SIZES = (1_000, 10_000, 50_000)
+REPEAT = 3
+THRESHOLD = 0.2
+BATCH_SIZE = 1000
+
+# setup(records, workdir, runs) -> run(); setup time is not measured
+Benchmark = Callable[[list[dict[str, str]], Path, int], Callable[[], object]]
+
+
+@dataclass
+class Result:
+    name: str
+    size: int
+    seconds: float
+    ops_per_sec: float
+    peak_kb: float
+
+
+@dataclass
+class Regression:
+    name: str
+    size: int
+    baseline: float
+    current: float
+
+    @property
+    def change(self) -> float:
+        return self.current / self.baseline - 1
+
+
+def bench_convert(
+    records: list[dict[str, str]], workdir: Path, runs: int
+) -> Callable[[], object]:
+    def run() -> object:
+        iplookup.lookup.cache_clear()
+        user_agent.cache_clear()
+        return [convert(record) for record in records]
+
+    return run
+
+
+def bench_parse_json(
+    records: list[dict[str, str]], workdir: Path, runs: int
+) -> Callable[[], object]:
+    lines = [json.dumps(record).encode() for record in records]
+    log_format = formats.JSONFormat()
+
+    def run() -> object:
+        return log_format.parse(lines)
+
+    return run
+
+
+def bench_parse_combined(
+    records: list[dict[str, str]], workdir: Path, runs: int
+) -> Callable[[], object]:
+    lines = [
+        (
+            f'{record["remote"]} - - '
+            f'[{arrow.get(record["time"]).format("DD/MMM/YYYY:HH:mm:ss Z")}] '
+            f'"{record["method"]} {record["uri"]} HTTP/1.1" {record["status"]} 0 '
+            f'"-" "{record["agent"]}"'
+        ).encode()
+        for record in records
+    ]
+    log_format = formats.get_format("combined")
+
+    def run() -> object:
+        return log_format.parse(lines)
+
+    return run
+
+
+def bench_lookup(
+    records: list[dict[str, str]], workdir: Path, runs: int
+) -> Callable[[], object]:
+    addresses = [record["remote"] for record in records]
+
+    def run() -> object:
+        iplookup.lookup.cache_clear()
+        return [iplookup.lookup(address) for address in addresses]
+
+    return run
+
+
+def bench_user_agent(
+    records: list[dict[str, str]], workdir: Path, runs: int
+) -> Callable[[], object]:
+    agents = [record["agent"] for record in records]
+
+    def run() -> object:
+        user_agent.cache_clear()
+        return [user_agent(agent) for agent in agents]
+
+    return run
+
+
+def events(records: list[dict[str, str]]) -> list[Event]:
+    converted = (convert(record) for record in records)
+    return [event for event in converted if event is not None]
+
+
+def fresh_database(workdir: Path) -> Path:
+    database = workdir / f"bench-{time.monotonic_ns()}.db"
+    db.update_schema(database)
+    return database
+
+
+def bench_insert_events(
+    records: list[dict[str, str]], workdir: Path, runs: int
+) -> Callable[[], object]:
+    batch = events(records)
+
+    def run() -> object:
+        with db.Writer(fresh_database(workdir)) as writer:
+            for start in range(0, len(batch), BATCH_SIZE):
+                writer.insert_events(batch[start : start + BATCH_SIZE])
+        return None
+
+    return run
+
+
+def bench_aggregate(
+    records: list[dict[str, str]], workdir: Path, runs: int
+) -> Callable[[], object]:
+    batch = events(records)
+    before = arrow.get(max(event.timestamp for event in batch) + 1)
+    databases: list[Path] = []
+
+    # each run needs its own populated database, so build them all up front
+    for _ in range(runs):
+        database = fresh_database(workdir)
+        with db.Writer(database) as writer:
+            writer.insert_events(batch)
+        databases.append(database)
+    remaining = iter(databases)
+
+    def run() -> object:
+        return db.aggregate_daily_events(next(remaining), before)
+
+    return run
+
+
+BENCHMARKS: dict[str, Benchmark] = {
+    "formats.json": bench_parse_json,
+    "formats.combined": bench_parse_combined,
+    "tail.convert": bench_convert,
+    "iplookup.lookup": bench_lookup,
+    "agent.user_agent": bench_user_agent,
+    "db.insert_events": bench_insert_events,
+    "db.aggregate_daily_events": bench_aggregate,
+}
+
+
+def measure(
+    name: str,
+    benchmark: Benchmark,
+    records: list[dict[str, str]],
+    workdir: Path,
+    repeat: int = REPEAT,
+) -> Result:
+    """
+    Time the best of `repeat` runs, then measure peak memory in one more run;
+    tracing allocations is far too slow to do while timing.
+    """
+    run = benchmark(records, workdir, repeat + 1)
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        before = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - before)
+
+    gc.collect()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return Result(name, len(records), best, len(records) / best, peak / 1024)
+
+
+def run_benchmarks(
+    sizes: tuple[int, ...] = SIZES,
+    names: tuple[str, ...] = tuple(BENCHMARKS),
+    seed: int = 0,
+    repeat: int = REPEAT,
+) -> Iterator[Result]:
+    iplookup.load()
+    with TemporaryDirectory(prefix="nalax-bench-") as td:
+        for size in sizes:
+            records = LogGenerator(seed).records(size)
+            for name in names:
+                result = measure(name, BENCHMARKS[name], records, Path(td), repeat)
+                LOG.info(
+                    "%s[%d]: %.0f ops/sec, %.0f KiB peak",
+                    name,
+                    size,
+                    result.ops_per_sec,
+                    result.peak_kb,
+                )
+                yield result
+
+
+def metadata() -> dict[str, Any]:
+    return {
+        "nalax": __version__,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "timestamp": int(time.time()),
+    }
+
+
+def dump(results: list[Result]) -> dict[str, Any]:
+    return {
+        "metadata": metadata(),
+        "results": [asdict(result) for result in results],
+    }
+
+
+def compare(
+    baseline: dict[str, Any], results: list[Result], threshold: float = THRESHOLD
+) -> list[Regression]:
+    """
+    Benchmarks whose throughput dropped more than `threshold` below the baseline.
+    Benchmarks missing from the baseline are ignored.
+    """
+    previous = {
+        (result["name"], result["size"]): result["ops_per_sec"]
+        for result in baseline["results"]
+    }
+    regressions: list[Regression] = []
+    for result in results:
+        expected = previous.get((result.name, result.size))
+        if expected and result.ops_per_sec < expected * (1 - threshold):
+            regressions.append(
+                Regression(result.name, result.size, expected, result.ops_per_sec)
+            )
+    return regressions
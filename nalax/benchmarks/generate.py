@@ -0,0 +1,151 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+import json
+import random
+import sys
+import time
+from itertools import accumulate
+from typing import Generator
+
+START = 1683417600  # 2023-05-07 00:00 UTC
+
+HOSTS = ("example.com", "blog.example.com", "static.example.com")
+
+# rough browser/bot mix seen on small public sites
+AGENTS = (
+    (
+        30,
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/113.0.0.0 Safari/537.36",
+    ),
+    (
+        15,
+        "Mozilla/5.0 (iPhone; CPU iPhone OS 16_4_1 like Mac OS X) "
+        "AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.4 Mobile/15E148 "
+        "Safari/604.1",
+    ),
+    (
+        10,
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 "
+        "(KHTML, like Gecko) Version/16.4 Safari/605.1.15",
+    ),
+    (
+        8,
+        "Mozilla/5.0 (Linux; Android 13; Pixel 7) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/113.0.0.0 Mobile Safari/537.36",
+    ),
+    (
+        7,
+        "Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/112.0",
+    ),
+    (
+        5,
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/113.0.0.0 Safari/537.36 Edg/113.0.1774.35",
+    ),
+    (
+        10,
+        "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+    ),
+    (
+        5,
+        "Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)",
+    ),
+    (4, "curl/8.0.1"),
+    (3, "python-requests/2.30.0"),
+    (3, "Feedly/1.0 (+http://www.feedly.com/fetcher.html; 12 subscribers)"),
+)
+
+STATUSES = ((88, "200"), (5, "304"), (4, "404"), (2, "301"), (1, "500"))
+
+
+class LogGenerator:
+    """
+    Deterministic synthetic nginx JSON access logs.
+
+    Paths and clients follow Zipf-like popularity, so a few pages and visitors
+    account for most requests, like real traffic: this keeps cache hit rates in
+    benchmarks close to what production sees.
+    """
+
+    def __init__(
+        self,
+        seed: int = 0,
+        *,
+        paths: int = 2000,
+        clients: int = 5000,
+        rate: float = 10.0,
+        start: int = START,
+    ) -> None:
+        self.rng = random.Random(seed)
+        self.rate = rate
+        self.timestamp = float(start)
+
+        rng = self.rng
+        self.paths = [self.path(idx) for idx in range(paths)]
+        self.clients = [(self.address(), self.pick(AGENTS)) for _ in range(clients)]
+        self.path_weights = zipf_weights(paths)
+        self.client_weights = zipf_weights(clients)
+        self.path_indexes = range(paths)
+        self.hosts = [rng.choice(HOSTS) for _ in range(paths)]
+
+    def pick(self, weighted: tuple[tuple[int, str], ...]) -> str:
+        weights = [weight for weight, _ in weighted]
+        values = [value for _, value in weighted]
+        return self.rng.choices(values, weights)[0]
+
+    def path(self, idx: int) -> str:
+        rng = self.rng
+        kind = rng.random()
+        if kind < 0.5:
+            return f"/{rng.randint(2015, 2023)}/{rng.randint(1, 12):02}/post-{idx}/"
+        if kind < 0.8:
+            return f"/static/{idx}.{rng.choice(('css', 'js', 'png', 'jpg'))}"
+        if kind < 0.9:
+            return f"/tag/{idx}/?page={rng.randint(1, 5)}"
+        return f"/feed/{idx}.xml"
+
+    def address(self) -> str:
+        rng = self.rng
+        if rng.random() < 0.2:
+            groups = (rng.randint(0, 0xFFFF) for _ in range(4))
+            return "2001:db8:" + ":".join(f"{group:x}" for group in groups) + "::1"
+        return ".".join(str(rng.randint(1, 254)) for _ in range(4))
+
+    def record(self) -> dict[str, str]:
+        rng = self.rng
+        self.timestamp += rng.expovariate(self.rate)
+        idx = rng.choices(self.path_indexes, cum_weights=self.path_weights)[0]
+        remote, agent = rng.choices(self.clients, cum_weights=self.client_weights)[0]
+        moment = time.gmtime(self.timestamp)
+        return {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S+00:00", moment),
+            "host": self.hosts[idx],
+            "method": "GET" if rng.random() < 0.97 else "POST",
+            "uri": self.paths[idx],
+            "status": self.pick(STATUSES),
+            "remote": remote,
+            "agent": agent,
+        }
+
+    def records(self, count: int) -> list[dict[str, str]]:
+        return [self.record() for _ in range(count)]
+
+    def lines(self, count: int) -> Generator[bytes, None, None]:
+        for _ in range(count):
+            yield json.dumps(self.record()).encode() + b"\n"
+
+
+def zipf_weights(count: int, exponent: float = 1.1) -> list[float]:
+    """
+    Cumulative Zipf weights, for cheap repeated `Random.choices()`.
+    """
+    return list(accumulate(1 / (rank**exponent) for rank in range(1, count + 1)))
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    for line in LogGenerator(seed).lines(count):
+        sys.stdout.buffer.write(line)
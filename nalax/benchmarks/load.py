@@ -0,0 +1,442 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+import json
+import logging
+import os
+import signal
+import sqlite3 as sqlite
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass, replace
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Sequence
+
+import click
+
+from .. import db
+from ..main import Duration
+from .generate import LogGenerator
+
+LOG = logging.getLogger(__name__)
+
+TICK = 0.01
+POLL = 0.02
+STARTUP_TIMEOUT = 30.0
+TEMPLATES = 1000
+
+
+@dataclass
+class LoadConfig:
+    rate: float
+    duration: float = 10.0
+    buffer_size: int = 0
+    buffer_time: float = 0.0
+    burst_factor: float = 1.0
+    burst_every: float = 0.0
+    burst_length: float = 1.0
+    rotate_every: float = 0.0
+    drain: float = 10.0
+    seed: int = 0
+
+    def rate_at(self, elapsed: float) -> float:
+        """
+        Offered lines/sec at a point in the run, including periodic bursts.
+        """
+        if self.burst_every and elapsed % self.burst_every < self.burst_length:
+            return self.rate * self.burst_factor
+        return self.rate
+
+
+@dataclass
+class LoadResult:
+    config: LoadConfig
+    offered: float
+    sent: int
+    received: int
+    dropped: int
+    duplicated: int
+    throughput: float
+    lag_p50: float
+    lag_p90: float
+    lag_p99: float
+    lag_max: float
+
+    @property
+    def keeping_up(self) -> bool:
+        """
+        Whether the harness itself managed to write lines at the requested rate.
+        """
+        return self.offered >= self.config.rate * 0.95
+
+    def sustained(self, max_lag: float) -> bool:
+        if self.dropped or self.duplicated or not self.keeping_up:
+            return False
+        return self.lag_p99 <= max_lag
+
+    def as_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class LoadTest:
+    """
+    Run the real `nalax tail` command against a log file being appended to at a
+    controlled rate, and measure how far behind the database falls.
+
+    Every line carries a sequence number in its path. Lag is the time from a line
+    being written until its event is visible in the events table, as seen by
+    polling the database. Lines never seen are dropped, and lines seen more than
+    once are duplicated. Raw events are required, so `--aggregate-inline` can't
+    be measured this way.
+    """
+
+    def __init__(self, config: LoadConfig, workdir: Path) -> None:
+        self.config = config
+        self.workdir = workdir
+        self.log_path = workdir / "access.log"
+        self.database = workdir / "nalax.db"
+        self.generator = LogGenerator(config.seed)
+        self.sent: dict[int, float] = {}
+        self.seen: dict[int, float] = {}
+        self.duplicated = 0
+        self.last_rowids: dict[str, int] = {}
+        self.writing = False
+        self.written = 0.0
+
+    def line(self, path: str) -> bytes:
+        record = self.generator.record()
+        record["time"] = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime())
+        record["uri"] = path
+        return json.dumps(record).encode() + b"\n"
+
+    def templates(self) -> list[tuple[str, str, str]]:
+        """
+        Pre-rendered lines split around their time and path, so that the writer
+        can produce lines far faster than tail can consume them.
+        """
+        templates = []
+        for _ in range(TEMPLATES):
+            record = self.generator.record()
+            record["time"] = "\0"
+            record["uri"] = "\0"
+            head, middle, tail = json.dumps(record).split("\\u0000")
+            templates.append((head, middle, tail + "\n"))
+        return templates
+
+    def write(self) -> None:
+        config = self.config
+        templates = self.templates()
+        f = open(self.log_path, "ab")
+        try:
+            start = last_rotate = time.monotonic()
+            budget = 0.0
+            seq = 0
+            now = start
+            while now - start < config.duration:
+                budget += config.rate_at(now - start) * TICK
+                stamp = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime())
+                first = seq
+                lines = []
+                while budget >= 1:
+                    head, middle, tail = templates[seq % TEMPLATES]
+                    lines.append(f"{head}{stamp}{middle}/load/{seq}{tail}")
+                    seq += 1
+                    budget -= 1
+                f.write("".join(lines).encode())
+                f.flush()
+                written = time.monotonic()
+                for idx in range(first, seq):
+                    self.sent[idx] = written
+
+                if config.rotate_every and now - last_rotate >= config.rotate_every:
+                    f.close()
+                    os.replace(self.log_path, self.log_path.with_suffix(".log.1"))
+                    f = open(self.log_path, "ab")
+                    last_rotate = now
+
+                time.sleep(max(0.0, TICK - (time.monotonic() - now)))
+                now = time.monotonic()
+        finally:
+            f.close()
+            self.written = now - start
+            self.writing = False
+
+    def poll(self, conn: sqlite.Connection) -> None:
+        now = time.monotonic()
+        query = """
+            select e.rowid, p.`value` from `{table}` e
+            join `nalax_dimensions` p on p.`kind` = 'path' and p.`id` = e.`path`
+            where e.rowid > ? order by e.rowid
+        """
+        for _, table in db.partitions(conn):
+            last_rowid = self.last_rowids.get(table, 0)
+            for rowid, path in conn.execute(query.format(table=table), (last_rowid,)):
+                self.last_rowids[table] = rowid
+                _, _, value = path.rpartition("/")
+                if not value.isdigit():
+                    continue  # warmup line
+                seq = int(value)
+                if seq in self.seen:
+                    self.duplicated += 1
+                else:
+                    self.seen[seq] = now
+
+    def run(self) -> LoadResult:
+        config = self.config
+        self.log_path.write_bytes(b"")
+        command = [
+            sys.executable,
+            "-m",
+            "nalax",
+            "--database",
+            str(self.database),
+            "tail",
+            "--buffer-size",
+            str(config.buffer_size),
+            "--buffer-time",
+            f"{config.buffer_time}s",
+            str(self.log_path),
+        ]
+        LOG.debug("running %s", command)
+        tail = subprocess.Popen(
+            command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            conn = self.wait_for_tail(tail)
+
+            self.writing = True
+            writer = threading.Thread(target=self.write, name="nalax-load-writer")
+            writer.start()
+
+            start = time.monotonic()
+            drain_until = None
+            while True:
+                time.sleep(POLL)
+                self.poll(conn)
+                if self.writing:
+                    continue
+                if drain_until is None:
+                    drain_until = time.monotonic() + config.drain
+                if len(self.seen) >= len(self.sent):
+                    break
+                if time.monotonic() > drain_until:
+                    break
+            elapsed = time.monotonic() - start
+            writer.join()
+
+        finally:
+            tail.send_signal(signal.SIGINT)
+            try:
+                tail.wait(10)
+            except subprocess.TimeoutExpired:
+                tail.kill()
+
+        # anything flushed on shutdown still counts towards duplicates and drops
+        self.poll(conn)
+        conn.close()
+
+        lags = [
+            self.seen[seq] - sent for seq, sent in self.sent.items() if seq in self.seen
+        ]
+        return LoadResult(
+            config=config,
+            offered=len(self.sent) / self.written if self.written else 0.0,
+            sent=len(self.sent),
+            received=len(self.seen),
+            dropped=len(self.sent) - len(self.seen),
+            duplicated=self.duplicated,
+            throughput=len(self.seen) / elapsed if elapsed else 0.0,
+            lag_p50=percentile(lags, 0.5),
+            lag_p90=percentile(lags, 0.9),
+            lag_p99=percentile(lags, 0.99),
+            lag_max=max(lags, default=0.0),
+        )
+
+    def wait_for_tail(self, tail: subprocess.Popen[bytes]) -> sqlite.Connection:
+        """
+        Append a warmup line until `tail` records it, so the measured run doesn't
+        include process startup.
+        """
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        conn: sqlite.Connection | None = None
+        while time.monotonic() < deadline:
+            if tail.poll() is not None:
+                raise RuntimeError(f"nalax tail exited with code {tail.returncode}")
+            if conn is None and self.database.exists():
+                conn = sqlite.connect(self.database.as_posix())
+            if conn is not None:
+                try:
+                    if db.count_events(conn):
+                        self.poll(conn)
+                        return conn
+                except sqlite.OperationalError:
+                    pass  # schema not created yet
+
+            with open(self.log_path, "ab") as f:
+                f.write(self.line("/load/warmup"))
+            time.sleep(0.2)
+
+        raise RuntimeError("timed out waiting for nalax tail to start")
+
+
+def run_load(config: LoadConfig) -> LoadResult:
+    with TemporaryDirectory(prefix="nalax-load-") as td:
+        return LoadTest(config, Path(td)).run()
+
+
+def find_max_rate(
+    config: LoadConfig, max_lag: float, steps: int = 4
+) -> tuple[float, list[LoadResult]]:
+    """
+    Double the offered rate until it can't be sustained, then bisect between the
+    last good and first bad rates. Returns the best sustained rate and all trials.
+    """
+    results: list[LoadResult] = []
+
+    def trial(rate: float) -> bool:
+        result = run_load(replace(config, rate=rate))
+        results.append(result)
+        ok = result.sustained(max_lag)
+        LOG.info(
+            "%.0f lines/sec: %s (p99 lag %.3fs, %d dropped, %d duplicated)",
+            rate,
+            "sustained" if ok else "failed",
+            result.lag_p99,
+            result.dropped,
+            result.duplicated,
+        )
+        return ok
+
+    good = 0.0
+    rate = config.rate
+    while trial(rate):
+        good = rate
+        rate *= 2
+    bad = rate
+
+    for _ in range(steps):
+        rate = (good + bad) / 2
+        if trial(rate):
+            good = rate
+        else:
+            bad = rate
+
+    return good, results
+
+
+def summary(result: LoadResult) -> str:
+    text = (
+        f"{result.offered:>8.0f} offered/s {result.throughput:>8.0f} recorded/s  "
+        f"lag p50 {result.lag_p50:.3f}s p90 {result.lag_p90:.3f}s "
+        f"p99 {result.lag_p99:.3f}s max {result.lag_max:.3f}s  "
+        f"{result.dropped} dropped, {result.duplicated} duplicated"
+    )
+    if not result.keeping_up:
+        text += f"  (harness fell short of {result.config.rate:.0f}/s)"
+    return text
+
+
+@click.command()
+@click.option("--rate", type=float, default=1000, show_default=True, help="lines/sec")
+@click.option("--duration", type=Duration(), default="10s", show_default=True)
+@click.option("--buffer-size", "-b", type=int, default=0, show_default=True)
+@click.option("--buffer-time", "-t", type=Duration(), default="0s", show_default=True)
+@click.option(
+    "--burst-factor",
+    type=float,
+    default=1.0,
+    show_default=True,
+    help="rate multiplier during bursts",
+)
+@click.option(
+    "--burst-every", type=Duration(), default="0s", help="time between bursts"
+)
+@click.option("--burst-length", type=Duration(), default="1s", show_default=True)
+@click.option(
+    "--rotate-every", type=Duration(), default="0s", help="time between log rotations"
+)
+@click.option(
+    "--drain",
+    type=Duration(),
+    default="10s",
+    show_default=True,
+    help="max time to wait for tail to catch up after writing stops",
+)
+@click.option(
+    "--find-max",
+    is_flag=True,
+    help="search for the highest rate these buffer settings can sustain",
+)
+@click.option(
+    "--max-lag",
+    type=Duration(),
+    default=None,
+    help="p99 lag allowed when searching, default buffer time + 1s",
+)
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="save results as JSON",
+)
+def main(
+    rate: float,
+    duration: float,
+    buffer_size: int,
+    buffer_time: float,
+    burst_factor: float,
+    burst_every: float,
+    burst_length: float,
+    rotate_every: float,
+    drain: float,
+    find_max: bool,
+    max_lag: float | None,
+    seed: int,
+    output: Path | None,
+) -> None:
+    """
+    Load test `nalax tail` with synthetic traffic and measure lag
+    """
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    config = LoadConfig(
+        rate=rate,
+        duration=duration,
+        buffer_size=buffer_size,
+        buffer_time=buffer_time,
+        burst_factor=burst_factor,
+        burst_every=burst_every,
+        burst_length=burst_length,
+        rotate_every=rotate_every,
+        drain=drain,
+        seed=seed,
+    )
+
+    if find_max:
+        max_lag = buffer_time + 1.0 if max_lag is None else max_lag
+        best, results = find_max_rate(config, max_lag)
+        for result in results:
+            click.echo(summary(result))
+        click.echo(f"max sustained rate: {best:.0f} lines/sec (p99 lag <= {max_lag}s)")
+        data: Any = {"max_rate": best, "trials": [r.as_dict() for r in results]}
+    else:
+        result = run_load(config)
+        click.echo(summary(result))
+        data = result.as_dict()
+
+    if output:
+        output.write_text(json.dumps(data, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
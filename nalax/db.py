@@ -1,19 +1,43 @@
 # Copyright Amethyst Reese
 # Licensed under the MIT license
 
+import datetime
 import logging
+import re
 import sqlite3 as sqlite
+import time
+from calendar import timegm
 from collections import defaultdict
+from functools import lru_cache
 from pathlib import Path
+from typing import Any, Iterable, NamedTuple, Sequence, TYPE_CHECKING
 
-import arrow
-from rich import print
-
+from . import profiling
 from .schema import SCHEMA, SCHEMA_INSERT, SCHEMA_SELECT
-from .types import Event
+from .types import Checkpoint, Event, EventRow, Retention
+
+if TYPE_CHECKING:
+    import arrow
 
 LOG = logging.getLogger(__name__)
 
+BUSY_TIMEOUT_MS = 30_000
+CACHE_SIZE_KB = -64_000  # negative values are KiB rather than pages
+SLICE_SIZE = 10_000
+DAY_SECONDS = 86400
+
+HostDay = tuple[str, int, int, int]  # host, year, month, day
+# an EventRow with its text columns interned as dimension ids
+EncodedRow = tuple[int, int, int, int, int, int, int, int, int, int]
+# year, month, day, host, path, method
+PageKey = tuple[int, int, int, str, str, str]
+# year, month, day, host, region, network, device, os, browser
+UserKey = tuple[int, int, int, str, str, str, str, str, str]
+
+# raw events are stored in a table per UTC day, named by date
+PARTITION_PREFIX = "nalax_events_"
+PARTITION_RE = re.compile(rf"{PARTITION_PREFIX}(\d{{8}})")
+
 
 def connect(location: Path) -> sqlite.Connection:
     conn = sqlite.connect(location.as_posix())
@@ -22,150 +46,801 @@ def connect(location: Path) -> sqlite.Connection:
 
 
 def update_schema(database: Path) -> int:
+    """
+    Apply any pending schema upgrades, returning the current schema version.
+
+    The number of applied upgrades is mirrored in `pragma user_version`, so an
+    up to date database is recognized without reading `nalax_schema`.
+    """
+    latest = len(SCHEMA)
     with connect(database) as conn:
+        (applied,) = conn.execute("pragma user_version").fetchone()
+        if applied >= latest:
+            return applied - 1
+
+        # databases from before user_version was tracked start at zero, so find
+        # where they really are from the schema table
         cursor = conn.cursor()
+        cursor.execute(SCHEMA[0])
+        if row := cursor.execute(SCHEMA_SELECT).fetchone():
+            applied = max(applied, row[0] + 1)
 
-        version = 0
-        latest = len(SCHEMA)
-        while version < latest:
-            now = arrow.utcnow().int_timestamp
+        for version in range(applied, latest):
             LOG.debug("Upgrade DB SCHEMA[%d]:\n%s", version, SCHEMA[version])
             cursor.execute(SCHEMA[version])
-            cursor.execute(SCHEMA_INSERT, (version, now))
+            cursor.execute(SCHEMA_INSERT, (version, int(time.time())))
+            cursor.execute(f"pragma user_version = {version + 1}")
             conn.commit()
 
-            # look for the *next* schema to apply
-            result = cursor.execute(SCHEMA_SELECT)
-            last_version, _timestamp = result.fetchone()
-            LOG.debug(
-                "DB on schema version %d as of %s", last_version, arrow.get(_timestamp)
-            )
-            version = last_version + 1
-
-        conn.commit()
-        return last_version
+        LOG.debug("DB on schema version %d", latest - 1)
+        return latest - 1
 
 
-def insert_events(database: Path, batch: list[Event]) -> None:
+def get_checkpoint(database: Path, path: Path) -> Checkpoint | None:
     with connect(database) as conn:
-        cursor = conn.cursor()
         query = """
-            insert into `nalax_events` (
-                `timestamp`, `host`, `path`, `method`, `status`,
-                `region`, `network`, `device`, `os`, `browser`
-            ) values
-        """ + ", ".join(
-            ["(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"] * len(batch)
+            select `path`, `device`, `inode`, `offset` from `nalax_checkpoints`
+            where `path` = ?
+        """
+        params = (path.as_posix(),)
+        row = conn.execute(query, params).fetchone()
+        return Checkpoint(*row) if row else None
+
+
+# event columns stored as ids into `nalax_dimensions`
+DIMENSIONS = ("host", "path", "method", "region", "network", "device", "os", "browser")
+
+
+class Dimensions:
+    """
+    Cache of the ids that repeated event text is interned as in `nalax_dimensions`.
+
+    Ids are numbered separately for each kind, so common values stay small.
+    Known ids are loaded up front, so only values never seen before cost a
+    query. New ids are added in the caller's transaction. Ids are never reused,
+    so cached ids stay valid when other writers add their own, but ids that no
+    event uses any more are swept after aggregation; see `refresh`.
+    """
+
+    INSERT = """
+        insert or ignore into `nalax_dimensions` (`kind`, `id`, `value`)
+        select ?1, coalesce(max(`id`), 0) + 1, ?2
+        from `nalax_dimensions` where `kind` = ?1
+    """
+
+    SELECT = """
+        select `id` from `nalax_dimensions` where `kind` = ? and `value` = ?
+    """
+
+    SWEEP = "select coalesce(max(`sweep`), 0) from `nalax_dimension_sweeps`"
+
+    def __init__(self, conn: sqlite.Connection) -> None:
+        self.conn = conn
+        self.ids: dict[str, dict[str, int]] = {}
+        self.sweep = 0
+        self.load()
+
+    def load(self) -> None:
+        (self.sweep,) = self.conn.execute(self.SWEEP).fetchone()
+        self.ids = {kind: {} for kind in DIMENSIONS}
+        query = "select `kind`, `id`, `value` from `nalax_dimensions`"
+        for kind, id, value in self.conn.execute(query):
+            self.ids.setdefault(kind, {})[value] = id
+
+    def refresh(self) -> None:
+        """
+        Reload the cache if ids were swept since it was loaded. Must be called
+        in the write transaction that uses the ids, so none are swept after.
+        """
+        (sweep,) = self.conn.execute(self.SWEEP).fetchone()
+        if sweep != self.sweep:
+            LOG.debug("reloading dimensions after sweep %d", sweep)
+            self.load()
+
+    def intern(self, kind: str, value: str) -> int:
+        cache = self.ids[kind]
+        id = cache.get(value)
+        if id is None:
+            self.conn.execute(self.INSERT, (kind, value))
+            (id,) = self.conn.execute(self.SELECT, (kind, value)).fetchone()
+            cache[value] = id
+        return id
+
+    def encode(self, rows: Iterable[EventRow]) -> list[EncodedRow]:
+        hosts, paths, methods, regions, networks, devices, oses, browsers = (
+            self.ids[kind] for kind in DIMENSIONS
         )
-        params = []
-        for event in batch:
-            params += event.as_row()
+        intern = self.intern
+        encoded: list[EncodedRow] = []
+        for row in rows:
+            try:
+                encoded.append(
+                    (
+                        row.timestamp,
+                        hosts[row.host],
+                        paths[row.path],
+                        methods[row.method],
+                        row.status,
+                        regions[row.region],
+                        networks[row.network],
+                        devices[row.device],
+                        oses[row.os],
+                        browsers[row.browser],
+                    )
+                )
+            except KeyError:
+                encoded.append(
+                    (
+                        row.timestamp,
+                        intern("host", row.host),
+                        intern("path", row.path),
+                        intern("method", row.method),
+                        row.status,
+                        intern("region", row.region),
+                        intern("network", row.network),
+                        intern("device", row.device),
+                        intern("os", row.os),
+                        intern("browser", row.browser),
+                    )
+                )
+        return encoded
 
-        cursor.execute(query, params)
-        conn.commit()
 
+CREATE_PARTITION = """
+    create table if not exists `{table}` (
+        `timestamp` int,
+        `host` int,
+        `path` int,
+        `method` int,
+        `status` int,
+        `region` int,
+        `network` int,
+        `device` int,
+        `os` int,
+        `browser` int
+    )
+"""
 
-def aggregate_daily_events(database: Path, before: arrow.Arrow) -> int:
-    threshold = before.int_timestamp
 
-    daily_pages: dict[tuple, int] = defaultdict(int)
-    daily_users: dict[tuple, int] = defaultdict(int)
+@lru_cache(maxsize=1024)
+def partition_name(day: int) -> str:
+    """
+    Table holding raw events from the UTC day `day`, counted from the epoch.
+    """
+    return PARTITION_PREFIX + time.strftime("%Y%m%d", time.gmtime(day * DAY_SECONDS))
 
-    with connect(database) as conn:
-        cursor = conn.cursor()
-        cursor.row_factory = Event.row_factory
 
-        query = """
-            select * from `nalax_events` where `timestamp` < ?
+def partitions(conn: sqlite.Connection) -> list[tuple[int, str]]:
+    """
+    Existing event partitions as (day, table), oldest first.
+    """
+    query = """
+        select `name` from `sqlite_master`
+        where `type` = 'table' and `name` glob 'nalax_events_[0-9]*'
+    """
+    found = []
+    for (name,) in conn.execute(query):
+        if match := PARTITION_RE.fullmatch(name):
+            day = timegm(time.strptime(match.group(1), "%Y%m%d")) // DAY_SECONDS
+            found.append((day, name))
+    return sorted(found)
+
+
+def count_events(conn: sqlite.Connection) -> int:
+    """
+    Raw events waiting to be aggregated, across all partitions.
+    """
+    tables = ["nalax_events"] + [table for _, table in partitions(conn)]
+    return sum(
+        conn.execute(f"select count(*) from `{table}`").fetchone()[0]
+        for table in tables
+    )
+
+
+class Writer:
+    """
+    Long-lived, tuned connection for writing batches of events.
+
+    Statements are kept as constant strings so that sqlite3's statement cache
+    reuses the prepared statements across batches. Each batch is routed to the
+    partitions for the days its events fall on.
+    """
+
+    INSERT_EVENT = """
+        insert into `{table}` (
+            `timestamp`, `host`, `path`, `method`, `status`,
+            `region`, `network`, `device`, `os`, `browser`
+        ) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+
+    UPSERT_CHECKPOINT = """
+        insert into `nalax_checkpoints`
+            (`path`, `device`, `inode`, `offset`, `timestamp`)
+            values (?, ?, ?, ?, ?)
+            on conflict(`path`) do update set
+                `device` = excluded.device,
+                `inode` = excluded.inode,
+                `offset` = excluded.offset,
+                `timestamp` = excluded.timestamp
+    """
+
+    def __init__(self, database: Path, slice_size: int = SLICE_SIZE) -> None:
+        self.database = database
+        self.slice_size = slice_size
+        self.conn = connect(database)
+        self.conn.execute("pragma journal_mode = wal")
+        self.conn.execute("pragma synchronous = normal")
+        self.conn.execute(f"pragma busy_timeout = {BUSY_TIMEOUT_MS}")
+        self.conn.execute(f"pragma cache_size = {CACHE_SIZE_KB}")
+        self.dimensions = Dimensions(self.conn)
+
+    def __enter__(self) -> "Writer":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def insert_rows(
+        self, rows: Sequence[EventRow], checkpoints: Iterable[Checkpoint] = ()
+    ) -> None:
+        """
+        Insert rows and update the checkpoints in a single transaction.
+
+        Large batches are encoded and fed to executemany in slices, so memory use
+        stays bounded no matter how many rows are written at once.
+        """
+        try:
+            with profiling.span("db.insert"), self.conn:
+                # take the write lock before checking for swept ids
+                self.conn.execute("begin immediate")
+                self.dimensions.refresh()
+                for start in range(0, len(rows), self.slice_size):
+                    encoded = self.dimensions.encode(
+                        rows[start : start + self.slice_size]
+                    )
+                    by_day: dict[int, list[EncodedRow]] = defaultdict(list)
+                    for row in encoded:
+                        by_day[row[0] // DAY_SECONDS].append(row)
+
+                    for day, day_rows in by_day.items():
+                        # cheap when the table exists, and recreates partitions
+                        # that were aggregated while late events were in flight
+                        table = partition_name(day)
+                        self.conn.execute(CREATE_PARTITION.format(table=table))
+                        self.conn.executemany(
+                            self.INSERT_EVENT.format(table=table), day_rows
+                        )
+
+                now = int(time.time())
+                self.conn.executemany(
+                    self.UPSERT_CHECKPOINT,
+                    [(*checkpoint, now) for checkpoint in checkpoints],
+                )
+        except BaseException:
+            # ids interned by this transaction were rolled back with it
+            self.dimensions.load()
+            raise
+
+    def insert_events(
+        self, batch: Sequence[Event], checkpoints: Iterable[Checkpoint] = ()
+    ) -> None:
+        self.insert_rows([event.as_row() for event in batch], checkpoints)
+
+    def merge_counts(
+        self, counts: "DailyCounts", checkpoints: Iterable[Checkpoint] = ()
+    ) -> None:
+        """
+        Add counts to the daily tables and update the checkpoints in a single
+        transaction, so resuming from a checkpoint never counts an event twice.
         """
-        params = (threshold,)
-        result = cursor.execute(query, params)
-
-        event_count = 0
-        while events := result.fetchmany():
-            for event in events:
-                event: Event
-                event_count += 1
-                t = event.timestamp
-
-                # daily pages
-                bucket = (t.year, t.month, t.day, event.host, event.path, event.method)
-                daily_pages[bucket] += 1
-
-                # daily users
-                bucket = (
-                    t.year,
-                    t.month,
-                    t.day,
+        with self.conn:
+            touched = upsert_counts(
+                self.conn,
+                PAGES,
+                [bucket + (count,) for bucket, count in counts.pages.items()],
+            )
+            upsert_counts(
+                self.conn,
+                USERS,
+                [bucket + (count,) for bucket, count in counts.users.items()],
+            )
+            bump_generation(self.conn, touched)
+
+            now = int(time.time())
+            self.conn.executemany(
+                self.UPSERT_CHECKPOINT,
+                [(*checkpoint, now) for checkpoint in checkpoints],
+            )
+
+    def merge_events(
+        self, batch: Sequence[Event], checkpoints: Iterable[Checkpoint] = ()
+    ) -> None:
+        counts = DailyCounts()
+        counts.add(batch)
+        self.merge_counts(counts, checkpoints)
+
+
+UPSERT_DAILY_PAGES = """
+    insert into `nalax_daily_pages`
+        (`year`, `month`, `day`, `host`, `path`, `method`, `count`)
+        values (?, ?, ?, ?, ?, ?, ?)
+        on conflict(`year`, `month`, `day`, `host`, `path`, `method`)
+            do update set `count` = `count` + excluded.count
+"""
+
+UPSERT_DAILY_USERS = """
+    insert into `nalax_daily_users`
+        (
+            `year`, `month`, `day`, `host`, `region`,
+            `network`, `device`, `os`, `browser`, `count`
+        )
+        values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        on conflict(
+            `year`, `month`, `day`, `host`, `region`,
+            `network`, `device`, `os`, `browser`
+        )
+            do update set `count` = `count` + excluded.count
+"""
+
+UPSERT_WEEKLY_PAGES = """
+    insert into `nalax_weekly_pages`
+        (`year`, `month`, `day`, `host`, `path`, `method`, `count`)
+        values (?, ?, ?, ?, ?, ?, ?)
+        on conflict(`year`, `month`, `day`, `host`, `path`, `method`)
+            do update set `count` = `count` + excluded.count
+"""
+
+UPSERT_WEEKLY_USERS = """
+    insert into `nalax_weekly_users`
+        (
+            `year`, `month`, `day`, `host`, `region`,
+            `network`, `device`, `os`, `browser`, `count`
+        )
+        values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        on conflict(
+            `year`, `month`, `day`, `host`, `region`,
+            `network`, `device`, `os`, `browser`
+        )
+            do update set `count` = `count` + excluded.count
+"""
+
+UPSERT_MONTHLY_PAGES = """
+    insert into `nalax_monthly_pages`
+        (`year`, `month`, `host`, `path`, `method`, `count`)
+        values (?, ?, ?, ?, ?, ?)
+        on conflict(`year`, `month`, `host`, `path`, `method`)
+            do update set `count` = `count` + excluded.count
+"""
+
+UPSERT_MONTHLY_USERS = """
+    insert into `nalax_monthly_users`
+        (
+            `year`, `month`, `host`, `region`,
+            `network`, `device`, `os`, `browser`, `count`
+        )
+        values (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        on conflict(
+            `year`, `month`, `host`, `region`,
+            `network`, `device`, `os`, `browser`
+        )
+            do update set `count` = `count` + excluded.count
+"""
+
+
+class Rollup(NamedTuple):
+    daily: str
+    weekly: str
+    monthly: str
+
+
+PAGES = Rollup(UPSERT_DAILY_PAGES, UPSERT_WEEKLY_PAGES, UPSERT_MONTHLY_PAGES)
+USERS = Rollup(UPSERT_DAILY_USERS, UPSERT_WEEKLY_USERS, UPSERT_MONTHLY_USERS)
+
+
+@lru_cache(maxsize=1024)
+def week_start(year: int, month: int, day: int) -> tuple[int, int, int]:
+    """
+    The monday starting the week that contains the given date.
+    """
+    date = datetime.date(year, month, day)
+    monday = date - datetime.timedelta(days=date.weekday())
+    return monday.year, monday.month, monday.day
+
+
+def upsert_counts(
+    conn: sqlite.Connection, rollup: Rollup, rows: Sequence[Sequence[Any]]
+) -> set[HostDay]:
+    """
+    Add daily counts, as (year, month, day, host, *dimensions, count) rows, to the
+    daily tables and to the weekly and monthly tables that contain those days.
+    Returns the set of host/days touched.
+    """
+    with profiling.span("db.upsert"):
+        conn.executemany(rollup.daily, rows)
+        weekly = [(*week_start(*row[:3]), *row[3:]) for row in rows]
+        conn.executemany(rollup.weekly, weekly)
+        conn.executemany(rollup.monthly, [(*row[:2], *row[3:]) for row in rows])
+    return {(row[3], row[0], row[1], row[2]) for row in rows}
+
+
+def bump_generation(conn: sqlite.Connection, touched: Iterable[HostDay]) -> int:
+    """
+    Stamp host/days whose stats changed with a new aggregation generation, so
+    that cached reports covering them are no longer served.
+
+    Must be called within the write transaction that changed the stats.
+    """
+    query = "select coalesce(max(`generation`), 0) + 1 from `nalax_generations`"
+    (generation,) = conn.execute(query).fetchone()
+    conn.executemany(
+        """
+        insert into `nalax_generations`
+            (`host`, `year`, `month`, `day`, `generation`)
+            values (?, ?, ?, ?, ?)
+            on conflict(`host`, `year`, `month`, `day`)
+                do update set `generation` = excluded.generation
+        """,
+        [(*key, generation) for key in touched],
+    )
+    return int(generation)
+
+
+class DailyCounts:
+    """
+    In-memory event counts, keyed the same as the daily tables.
+    """
+
+    def __init__(self) -> None:
+        self.pages: dict[PageKey, int] = defaultdict(int)
+        self.users: dict[UserKey, int] = defaultdict(int)
+
+    def __len__(self) -> int:
+        return len(self.pages) + len(self.users)
+
+    def add(self, events: Iterable[Event]) -> None:
+        pages = self.pages
+        users = self.users
+        for event in events:
+            year, month, day = event.day
+            agent = event.agent
+            pages[(year, month, day, event.host, event.path, event.method)] += 1
+            users[
+                (
+                    year,
+                    month,
+                    day,
                     event.host,
                     event.region,
                     event.network,
-                    event.agent.device,
-                    event.agent.os,
-                    event.agent.browser,
+                    agent.device,
+                    agent.os,
+                    agent.browser,
                 )
-                daily_users[bucket] += 1
+            ] += 1
 
-        print("daily_pages:", daily_pages)
-        print("daily_users:", daily_users)
 
-        # daily pages
-        query = """
-            insert into `nalax_daily_pages`
-                (`year`, `month`, `day`, `host`, `path`, `method`, `count`)
-                values (?, ?, ?, ?, ?, ?, ?)
-                on conflict(`year`, `month`, `day`, `host`, `path`, `method`)
-                    do update set `count` = `count` + excluded.count
-        """
-        for (year, month, day, host, path, method), count in daily_pages.items():
-            params = (year, month, day, host, path, method, count)
-            cursor.execute(query, params)
+# group events in the unpartitioned table, from before partitions existed, by
+# UTC day and dimension ids, reporting each day as (year, month, day) and
+# decoding ids to text only for the grouped rows
+SELECT_DAILY_PAGES = """
+    select
+        cast(strftime('%Y', e.`epoch_day` * 86400, 'unixepoch') as int),
+        cast(strftime('%m', e.`epoch_day` * 86400, 'unixepoch') as int),
+        cast(strftime('%d', e.`epoch_day` * 86400, 'unixepoch') as int),
+        h.`value`, p.`value`, m.`value`, e.`count`
+    from (
+        select
+            `timestamp` / 86400 as `epoch_day`, `host`, `path`, `method`,
+            count(*) as `count`
+        from `nalax_events` where `timestamp` >= ? and `timestamp` < ?
+        group by `epoch_day`, `host`, `path`, `method`
+    ) e
+    join `nalax_dimensions` h on h.`kind` = 'host' and h.`id` = e.`host`
+    join `nalax_dimensions` p on p.`kind` = 'path' and p.`id` = e.`path`
+    join `nalax_dimensions` m on m.`kind` = 'method' and m.`id` = e.`method`
+"""
 
-        # daily users
-        query = """
-            insert into `nalax_daily_users`
-                (
-                    `year`, `month`, `day`, `host`, `region`,
-                    `network`, `device`, `os`, `browser`, `count`
+SELECT_DAILY_USERS = """
+    select
+        cast(strftime('%Y', e.`epoch_day` * 86400, 'unixepoch') as int),
+        cast(strftime('%m', e.`epoch_day` * 86400, 'unixepoch') as int),
+        cast(strftime('%d', e.`epoch_day` * 86400, 'unixepoch') as int),
+        h.`value`, r.`value`, n.`value`, d.`value`, o.`value`, b.`value`,
+        e.`count`
+    from (
+        select
+            `timestamp` / 86400 as `epoch_day`, `host`, `region`,
+            `network`, `device`, `os`, `browser`, count(*) as `count`
+        from `nalax_events` where `timestamp` >= ? and `timestamp` < ?
+        group by
+            `epoch_day`, `host`, `region`, `network`, `device`, `os`, `browser`
+    ) e
+    join `nalax_dimensions` h on h.`kind` = 'host' and h.`id` = e.`host`
+    join `nalax_dimensions` r on r.`kind` = 'region' and r.`id` = e.`region`
+    join `nalax_dimensions` n on n.`kind` = 'network' and n.`id` = e.`network`
+    join `nalax_dimensions` d on d.`kind` = 'device' and d.`id` = e.`device`
+    join `nalax_dimensions` o on o.`kind` = 'os' and o.`id` = e.`os`
+    join `nalax_dimensions` b on b.`kind` = 'browser' and b.`id` = e.`browser`
+"""
+
+# the same for a single day's partition, which is read in one sequential scan
+SELECT_PARTITION_PAGES = """
+    select
+        :year, :month, :day, h.`value`, p.`value`, m.`value`, e.`count`
+    from (
+        select `host`, `path`, `method`, count(*) as `count`
+        from `{table}` where `timestamp` < :before
+        group by `host`, `path`, `method`
+    ) e
+    join `nalax_dimensions` h on h.`kind` = 'host' and h.`id` = e.`host`
+    join `nalax_dimensions` p on p.`kind` = 'path' and p.`id` = e.`path`
+    join `nalax_dimensions` m on m.`kind` = 'method' and m.`id` = e.`method`
+"""
+
+SELECT_PARTITION_USERS = """
+    select
+        :year, :month, :day, h.`value`, r.`value`, n.`value`, d.`value`,
+        o.`value`, b.`value`, e.`count`
+    from (
+        select
+            `host`, `region`, `network`, `device`, `os`, `browser`,
+            count(*) as `count`
+        from `{table}` where `timestamp` < :before
+        group by `host`, `region`, `network`, `device`, `os`, `browser`
+    ) e
+    join `nalax_dimensions` h on h.`kind` = 'host' and h.`id` = e.`host`
+    join `nalax_dimensions` r on r.`kind` = 'region' and r.`id` = e.`region`
+    join `nalax_dimensions` n on n.`kind` = 'network' and n.`id` = e.`network`
+    join `nalax_dimensions` d on d.`kind` = 'device' and d.`id` = e.`device`
+    join `nalax_dimensions` o on o.`kind` = 'os' and o.`id` = e.`os`
+    join `nalax_dimensions` b on b.`kind` = 'browser' and b.`id` = e.`browser`
+"""
+
+
+def aggregate_unpartitioned(conn: sqlite.Connection, threshold: int, days: int) -> int:
+    """
+    Roll up events left in `nalax_events` by versions before partitioning,
+    `days` UTC days at a time.
+    """
+    event_count = 0
+    query = """
+        select min(`timestamp`) from `nalax_events` where `timestamp` < ?
+    """
+    while (oldest := conn.execute(query, (threshold,)).fetchone()[0]) is not None:
+        start = oldest - oldest % DAY_SECONDS
+        end = min(start + DAY_SECONDS * days, threshold)
+        params = (start, end)
+
+        with profiling.span("db.aggregate"):
+            conn.execute("begin immediate")
+            try:
+                touched: set[HostDay] = set()
+                for select, rollup in (
+                    (SELECT_DAILY_PAGES, PAGES),
+                    (SELECT_DAILY_USERS, USERS),
+                ):
+                    cursor = conn.execute(select, params)
+                    while rows := cursor.fetchmany(SLICE_SIZE):
+                        touched |= upsert_counts(conn, rollup, rows)
+                bump_generation(conn, touched)
+
+                # remove aggregated events
+                cursor = conn.execute(
+                    """
+                    delete from `nalax_events`
+                    where `timestamp` >= ? and `timestamp` < ?
+                    """,
+                    params,
+                )
+                conn.execute("commit")
+            except BaseException:
+                conn.execute("rollback")
+                raise
+
+        LOG.info(
+            "aggregated %d events from %s",
+            cursor.rowcount,
+            time.strftime("%Y-%m-%d", time.gmtime(start)),
+        )
+        event_count += cursor.rowcount
+
+    return event_count
+
+
+def aggregate_partition(
+    conn: sqlite.Connection, day: int, table: str, threshold: int
+) -> int:
+    """
+    Roll up events older than `threshold` from one day's partition. A partition
+    that is entirely older is dropped as a whole, rather than deleting its rows.
+    """
+    date = time.gmtime(day * DAY_SECONDS)
+    params = {
+        "year": date.tm_year,
+        "month": date.tm_mon,
+        "day": date.tm_mday,
+        "before": threshold,
+    }
+    event_count = 0
+
+    with profiling.span("db.aggregate"):
+        conn.execute("begin immediate")
+        try:
+            touched: set[HostDay] = set()
+            for select, rollup in (
+                (SELECT_PARTITION_PAGES, PAGES),
+                (SELECT_PARTITION_USERS, USERS),
+            ):
+                cursor = conn.execute(select.format(table=table), params)
+                while rows := cursor.fetchmany(SLICE_SIZE):
+                    touched |= upsert_counts(conn, rollup, rows)
+                    if rollup is PAGES:
+                        event_count += sum(row[-1] for row in rows)
+            bump_generation(conn, touched)
+
+            if (day + 1) * DAY_SECONDS <= threshold:
+                conn.execute(f"drop table `{table}`")
+            else:
+                conn.execute(
+                    f"delete from `{table}` where `timestamp` < ?", (threshold,)
                 )
-                values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                on conflict(
-                    `year`, `month`, `day`, `host`, `region`,
-                    `network`, `device`, `os`, `browser`
+            conn.execute("commit")
+        except BaseException:
+            conn.execute("rollback")
+            raise
+
+    LOG.info(
+        "aggregated %d events from %s", event_count, time.strftime("%Y-%m-%d", date)
+    )
+    return event_count
+
+
+def sweep_dimensions(conn: sqlite.Connection) -> int:
+    """
+    Delete dimension ids that no remaining event uses, now that the events
+    aggregated so far are stored as text in the rollup tables. The highest id
+    of each kind is kept, so ids are never reused. Returns the number deleted.
+    """
+    tables = ["nalax_events"] + [table for _, table in partitions(conn)]
+    deleted = 0
+
+    with profiling.span("db.sweep"):
+        conn.execute("begin immediate")
+        try:
+            for kind in DIMENSIONS:
+                used = " union ".join(f"select `{kind}` from `{t}`" for t in tables)
+                query = f"""
+                    delete from `nalax_dimensions`
+                    where `kind` = ?1 and `id` not in ({used}) and `id` < (
+                        select max(`id`) from `nalax_dimensions` where `kind` = ?1
+                    )
+                """
+                deleted += conn.execute(query, (kind,)).rowcount
+            if deleted:
+                conn.execute(
+                    """
+                    insert into `nalax_dimension_sweeps` (`timestamp`, `deleted`)
+                    values (?, ?)
+                    """,
+                    (int(time.time()), deleted),
                 )
-                    do update set `count` = `count` + excluded.count
-        """
-        for (
-            year,
-            month,
-            day,
-            host,
-            region,
-            network,
-            device,
-            dos,
-            browser,
-        ), count in daily_users.items():
-            params = (
-                year,
-                month,
-                day,
-                host,
-                region,
-                network,
-                device,
-                dos,
-                browser,
-                count,
-            )
-            cursor.execute(query, params)
+            conn.execute("commit")
+        except BaseException:
+            conn.execute("rollback")
+            raise
+
+    if deleted:
+        LOG.info("swept %d unused dimension ids", deleted)
+    return deleted
+
+
+def aggregate_daily_events(database: Path, before: "arrow.Arrow", days: int = 1) -> int:
+    """
+    Roll up raw events older than `before` into the daily, weekly, and monthly
+    tables, and remove them.
+
+    Each day's partition is grouped by SQLite and dropped in its own short
+    transaction, so memory use stays flat and concurrent writers are only
+    blocked briefly. Dimension ids left unused are swept, and freed pages are
+    then returned to the filesystem.
+    """
+    threshold = before.int_timestamp
+
+    conn = connect(database)
+    conn.isolation_level = None  # explicit transactions below
+    conn.row_factory = None
+    conn.execute(f"pragma busy_timeout = {BUSY_TIMEOUT_MS}")
+    try:
+        event_count = aggregate_unpartitioned(conn, threshold, days)
+        for day, table in partitions(conn):
+            if day * DAY_SECONDS >= threshold:
+                break
+            event_count += aggregate_partition(conn, day, table, threshold)
+        sweep_dimensions(conn)
+
+        # refresh planner stats for the report indexes now that tables changed
+        conn.execute("pragma optimize")
+        # frees a page per step, and execute() would only step it once
+        conn.executescript("pragma incremental_vacuum")
+    finally:
+        conn.close()
+
+    return event_count
+
+
+UPSERT_RETENTION = """
+    insert into `nalax_retention` (`period`, `year`, `month`, `day`)
+        values (?, ?, ?, ?)
+        on conflict(`period`) do update set
+            (`year`, `month`, `day`) = (excluded.year, excluded.month, excluded.day)
+            where (excluded.year, excluded.month, excluded.day)
+                > (`year`, `month`, `day`)
+"""
+
+
+def get_retention(conn: sqlite.Connection) -> Retention:
+    query = "select `period`, `year`, `month`, `day` from `nalax_retention`"
+    dates = {
+        period: datetime.date(year, month, day)
+        for period, year, month, day in conn.execute(query)
+    }
+    return Retention(dates.get("daily"), dates.get("weekly"))
 
-        # remove aggregated events
-        query = """
-            delete from `nalax_events` where `timestamp` < ?
-        """
-        params = (threshold,)
-        cursor.execute(query, params)
+
+def prune_rollups(
+    database: Path,
+    keep_daily: int | None = None,
+    keep_weekly: int | None = None,
+    today: datetime.date | None = None,
+) -> int:
+    """
+    Delete daily stats older than `keep_daily` days, and weekly stats older than
+    `keep_weekly` weeks. Returns the number of rows deleted.
+
+    Every count is also added to the coarser tables when it is aggregated, so
+    pruning downsamples old stats without losing them: months are kept forever.
+    How far back each table still goes is recorded, so reports know to read
+    older days from coarser tables.
+    """
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    deleted = 0
+
+    with connect(database) as conn:
+        conn.execute(f"pragma busy_timeout = {BUSY_TIMEOUT_MS}")
+
+        moved = 0
+        if keep_daily is not None:
+            date = today - datetime.timedelta(days=keep_daily)
+            cutoff = date.year * 10000 + date.month * 100 + date.day
+            for table in ("nalax_daily_pages", "nalax_daily_users"):
+                query = f"""
+                    delete from `{table}`
+                    where `year` * 10000 + `month` * 100 + `day` < ?
+                """
+                deleted += conn.execute(query, (cutoff,)).rowcount
+            params = ("daily", date.year, date.month, date.day)
+            moved += conn.execute(UPSERT_RETENTION, params).rowcount
+
+        if keep_weekly is not None:
+            date = today - datetime.timedelta(weeks=keep_weekly)
+            year, month, day = week_start(date.year, date.month, date.day)
+            cutoff = year * 10000 + month * 100 + day
+            for table in ("nalax_weekly_pages", "nalax_weekly_users"):
+                query = f"""
+                    delete from `{table}`
+                    where `year` * 10000 + `month` * 100 + `day` < ?
+                """
+                deleted += conn.execute(query, (cutoff,)).rowcount
+            params = ("weekly", year, month, day)
+            moved += conn.execute(UPSERT_RETENTION, params).rowcount
+
+        # reports over pruned ranges now read different tables
+        if deleted or moved:
+            conn.execute("delete from `nalax_report_cache`")
 
         conn.commit()
-        return event_count
+
+    return deleted
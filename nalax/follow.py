@@ -0,0 +1,431 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import BinaryIO, Generator, NamedTuple
+
+from .types import Position
+
+LOG = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 20
+INTERVAL = 1.0
+GRACE = 5.0
+
+IN_MODIFY = 0x00000002
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_MASK = IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# struct inotify_event: wd, mask, cookie, len, followed by a padded name
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class Chunk(NamedTuple):
+    device: int
+    inode: int
+    offset: int
+    size: int
+    lines: list[bytes]
+    received: float = 0.0
+    # lines read late from a rotated file, which all end at `offset` in the new one
+    late: bool = False
+
+    def ends(self) -> list[int]:
+        """
+        Offset just past each line, where reading would resume after it.
+        """
+        if self.late:
+            return [self.offset] * len(self.lines)
+        ends = []
+        offset = self.offset
+        for line in self.lines:
+            offset += len(line) + 1
+            ends.append(offset)
+        return ends
+
+    @property
+    def end(self) -> int:
+        if self.late:
+            return self.offset
+        return self.offset + sum(len(line) + 1 for line in self.lines)
+
+
+class Watcher:
+    """
+    Wait for changes to a file by polling at a fixed interval.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def wait(self, timeout: float) -> None:
+        time.sleep(timeout)
+
+    def close(self) -> None:
+        pass
+
+
+def inotify_init() -> tuple[ctypes.CDLL, int]:
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return libc, fd
+
+
+def inotify_add_watch(libc: ctypes.CDLL, fd: int, directory: Path) -> int:
+    wd: int = libc.inotify_add_watch(fd, os.fsencode(directory), IN_MASK)
+    if wd < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno), str(directory))
+    return wd
+
+
+class InotifyWatcher(Watcher):
+    """
+    Wait for changes to a file using inotify on its parent directory, so that
+    renames and new files are noticed as well as writes.
+
+    Timeouts still apply, so filesystems that don't deliver events degrade to
+    polling rather than hanging.
+    """
+
+    def __init__(self, path: Path) -> None:
+        super().__init__(path)
+        libc, self.fd = inotify_init()
+        try:
+            inotify_add_watch(libc, self.fd, path.parent)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def wait(self, timeout: float) -> None:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if readable:
+            try:
+                while os.read(self.fd, 1 << 16):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class SharedWatcher(Watcher):
+    """
+    Wait for changes to a file, or its first rotation, as dispatched by an
+    `Inotify` instance shared with other followers.
+    """
+
+    def __init__(self, path: Path, inotify: "Inotify") -> None:
+        super().__init__(path)
+        self.inotify = inotify
+        self.changed = threading.Event()
+
+    def notify(self) -> None:
+        self.changed.set()
+
+    def wait(self, timeout: float) -> None:
+        # anything that changes after this wakes up is seen by the next read
+        self.changed.wait(timeout)
+        self.changed.clear()
+
+    def close(self) -> None:
+        self.inotify.unwatch(self)
+
+
+class Inotify:
+    """
+    One inotify instance for many followers, with one watch per directory.
+
+    Events are read on a single thread and dispatched by file name, so a write
+    to one log only wakes the follower of that log, however many logs share its
+    directory, and following dozens of files needs just one inotify instance.
+    """
+
+    def __init__(self) -> None:
+        self.libc, self.fd = inotify_init()
+        self.lock = threading.Lock()
+        self.directories: dict[int, Path] = {}
+        self.descriptors: dict[Path, int] = {}
+        self.watchers: dict[tuple[Path, str], set[SharedWatcher]] = defaultdict(set)
+        self.closed = threading.Event()
+        self.wakeups = 0
+        self.thread = threading.Thread(
+            target=self.run, name="nalax-inotify", daemon=True
+        )
+        self.thread.start()
+
+    def watch(self, path: Path) -> SharedWatcher:
+        directory = path.parent
+        watcher = SharedWatcher(path, self)
+        with self.lock:
+            if directory not in self.descriptors:
+                wd = inotify_add_watch(self.libc, self.fd, directory)
+                self.descriptors[directory] = wd
+                self.directories[wd] = directory
+            for name in (path.name, rotated_path(path).name):
+                self.watchers[(directory, name)].add(watcher)
+        return watcher
+
+    def unwatch(self, watcher: SharedWatcher) -> None:
+        directory = watcher.path.parent
+        with self.lock:
+            for name in (watcher.path.name, rotated_path(watcher.path).name):
+                key = (directory, name)
+                self.watchers[key].discard(watcher)
+                if not self.watchers[key]:
+                    del self.watchers[key]
+
+    def run(self) -> None:
+        while not self.closed.is_set():
+            readable, _, _ = select.select([self.fd], [], [], INTERVAL)
+            if not readable:
+                continue
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                continue
+            self.dispatch(data)
+
+    def dispatch(self, data: bytes) -> None:
+        woken: set[SharedWatcher] = set()
+        with self.lock:
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    # events were lost, so anything could have changed
+                    for watchers in self.watchers.values():
+                        woken.update(watchers)
+                elif directory := self.directories.get(wd):
+                    woken.update(self.watchers.get((directory, name), ()))
+
+        self.wakeups += len(woken)
+        for watcher in woken:
+            watcher.notify()
+
+    def close(self) -> None:
+        self.closed.set()
+        self.thread.join()
+        os.close(self.fd)
+
+
+def watch(path: Path, inotify: Inotify | None = None) -> Watcher:
+    if inotify is not None:
+        try:
+            return inotify.watch(path)
+        except OSError as exc:
+            LOG.warning("can't watch %s, polling instead: %s", path.parent, exc)
+            return Watcher(path)
+
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(path)
+        except (AttributeError, OSError) as exc:
+            LOG.warning("inotify unavailable, polling instead: %s", exc)
+    return Watcher(path)
+
+
+def rotated_path(path: Path) -> Path:
+    return path.with_name(f"{path.name}.1")
+
+
+def resume(path: Path, position: Position) -> tuple[BinaryIO, int] | None:
+    """
+    Find and open the file matching a previous position, either still at `path`
+    or already rotated to `path.1`, and seek to the previous offset.
+    """
+    for candidate in (path, rotated_path(path)):
+        try:
+            f = open(candidate, "rb", buffering=0)
+        except FileNotFoundError:
+            continue
+
+        stat = os.fstat(f.fileno())
+        if (stat.st_dev, stat.st_ino) != (position.device, position.inode):
+            f.close()
+            continue
+
+        if position.offset < 0:
+            LOG.warning("invalid offset %d for %s", position.offset, candidate)
+            f.close()
+            return None
+
+        if stat.st_size < position.offset:
+            LOG.warning("%s truncated since last checkpoint", candidate)
+            return f, 0
+
+        LOG.info("resuming %s at offset %d", candidate, position.offset)
+        return f, f.seek(position.offset)
+
+    return None
+
+
+def follow(
+    path: Path,
+    position: Position | None = None,
+    *,
+    chunk_size: int = CHUNK_SIZE,
+    interval: float = INTERVAL,
+    grace: float = GRACE,
+    stop: threading.Event | None = None,
+    inotify: Inotify | None = None,
+) -> Generator[Chunk, None, None]:
+    """
+    Follow a growing file, yielding complete lines in large chunks.
+
+    Starts at the given position if the matching file can be found at `path` or
+    its first rotation, or at the current end of the file otherwise, similar to
+    `tail -Fn0`. If the previous file can't be found, reading starts from the
+    beginning of the current file.
+
+    Rotation is detected by a change of device/inode at `path`: the old file is
+    read to the end and the new one followed straight away, while the old file
+    stays open for `grace` seconds to pick up lines its writer hasn't moved on
+    from yet. Those late lines are reported as ending at the current position in
+    the new file, so checkpoints never move back to the old one. Truncation is
+    detected when the file shrinks below the current offset, and restarts from
+    the beginning.
+
+    If given, the `stop` event is checked between reads and waits, ending the
+    generator within `interval` seconds of being set. Processes following many
+    files should share an `Inotify` instance between them.
+    """
+    stop = stop or threading.Event()
+    watcher = watch(path, inotify)
+    f: BinaryIO | None = None
+    offset = 0
+    old: BinaryIO | None = None
+    old_remainder = b""
+    old_until = 0.0
+
+    try:
+        if position is not None:
+            if resumed := resume(path, position):
+                f, offset = resumed
+            else:
+                LOG.warning("previous log file not found, reading %s from start", path)
+
+        while f is None:
+            if stop.is_set():
+                return
+            try:
+                f = open(path, "rb", buffering=0)
+                if position is None:
+                    offset = f.seek(0, os.SEEK_END)
+            except FileNotFoundError:
+                watcher.wait(interval)
+
+        stat = os.fstat(f.fileno())
+        device, inode = stat.st_dev, stat.st_ino
+        remainder = b""
+
+        while not stop.is_set():
+            if old is not None:
+                data = old.read(chunk_size)
+                if data:
+                    lines = (old_remainder + data).split(b"\n")
+                    old_remainder = lines.pop()
+                    if lines:
+                        size = max(offset, os.fstat(f.fileno()).st_size)
+                        yield Chunk(
+                            device,
+                            inode,
+                            offset - len(remainder),
+                            size - len(remainder),
+                            lines,
+                            time.monotonic(),
+                            late=True,
+                        )
+                    continue
+
+                if time.monotonic() >= old_until:
+                    if old_remainder:
+                        LOG.warning("discarding partial line from rotated file")
+                    old.close()
+                    old = None
+
+            data = f.read(chunk_size)
+            if data:
+                start = offset - len(remainder)
+                offset += len(data)
+                lines = (remainder + data if remainder else data).split(b"\n")
+                remainder = lines.pop()
+                if lines:
+                    # don't count a trailing partial line as unread data
+                    size = max(offset, os.fstat(f.fileno()).st_size)
+                    yield Chunk(
+                        device,
+                        inode,
+                        start,
+                        size - len(remainder),
+                        lines,
+                        time.monotonic(),
+                    )
+                continue
+
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                watcher.wait(interval)
+                continue
+
+            if (stat.st_dev, stat.st_ino) != (device, inode):
+                try:
+                    new = open(path, "rb", buffering=0)
+                except FileNotFoundError:
+                    continue
+
+                LOG.info("%s rotated, following new file", path)
+                if old is not None:
+                    # rotated again within the grace period
+                    if old_remainder:
+                        LOG.warning("discarding partial line from rotated file")
+                    old.close()
+                # already read to the end, but its writer may not be done yet
+                old, old_remainder = f, remainder
+                old_until = time.monotonic() + grace
+                f = new
+                stat = os.fstat(f.fileno())
+                device, inode = stat.st_dev, stat.st_ino
+                offset = 0
+                remainder = b""
+
+            elif stat.st_size < offset:
+                LOG.info("%s truncated, restarting from beginning", path)
+                f.seek(0)
+                offset = 0
+                remainder = b""
+
+            else:
+                watcher.wait(interval)
+
+    finally:
+        watcher.close()
+        if f is not None:
+            f.close()
+        if old is not None:
+            old.close()
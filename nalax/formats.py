@@ -0,0 +1,211 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+import json
+import logging
+import re
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Iterable
+
+from . import metrics
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore[assignment]
+
+LOG = logging.getLogger(__name__)
+
+Record = dict[str, str]
+
+# nginx's predefined formats
+COMBINED = (
+    '$remote_addr - $remote_user [$time_local] "$request" '
+    '$status $body_bytes_sent "$http_referer" "$http_user_agent"'
+)
+COMMON = '$remote_addr - $remote_user [$time_local] "$request" $status $body_bytes_sent'
+
+# nginx variables that provide each field nalax needs; the first one to appear
+# in a format wins, and everything else in the line is skipped over
+VARIABLES = {
+    "time_iso8601": "time",
+    "time_local": "time",
+    "msec": "time",
+    "host": "host",
+    "http_host": "host",
+    "server_name": "host",
+    "request_method": "method",
+    "request_uri": "uri",
+    "uri": "uri",
+    "request": "request",
+    "status": "status",
+    "remote_addr": "remote",
+    "http_user_agent": "agent",
+}
+REQUIRED = ("time", "method", "uri", "status")
+OPTIONAL = ("host", "remote", "agent")
+
+VARIABLE_RE = re.compile(r"\$(?:\{(\w+)\}|(\w+))")
+
+
+def compile_format(log_format: str) -> tuple["re.Pattern[str]", Record]:
+    """
+    Compile an nginx `log_format` string into a single regex with a named group
+    for each field nalax needs, and default values for optional fields that the
+    format doesn't include.
+
+    Each variable matches everything up to the first character of the literal
+    text following it, which is how nginx's escaping keeps fields separable.
+    """
+    variables = list(VARIABLE_RE.finditer(log_format))
+    parts: list[str] = []
+    seen: set[str] = set()
+    start = 0
+    for idx, variable in enumerate(variables):
+        parts.append(re.escape(log_format[start : variable.start()]))
+        start = variable.end()
+        end = variables[idx + 1].start() if idx + 1 < len(variables) else None
+        following = log_format[start:end]
+        if following:
+            value = f"[^{re.escape(following[0])}]*"
+        elif end is not None:
+            value = r"\S*"
+        else:
+            value = ".*"
+
+        field = VARIABLES.get(variable.group(1) or variable.group(2))
+        if field and field not in seen:
+            seen.add(field)
+            value = f"(?P<{field}>{value})"
+        parts.append(value)
+    parts.append(re.escape(log_format[start:]))
+
+    if "request" in seen:
+        seen.update(("method", "uri"))
+    if missing := [field for field in REQUIRED if field not in seen]:
+        raise ValueError(f"log format has no variable for {', '.join(missing)}")
+
+    defaults = {field: "" for field in OPTIONAL if field not in seen}
+    return re.compile("".join(parts)), defaults
+
+
+class LogFormat(ABC):
+    """
+    Parses batches of log lines into records of the fields nalax needs, with
+    None in place of blank or unparseable lines.
+    """
+
+    name = ""
+
+    @abstractmethod
+    def parse(self, lines: Iterable[bytes]) -> list[Record | None]:
+        ...
+
+
+class JSONFormat(LogFormat):
+    """
+    One JSON object per line, as produced by the `log_format` in the README.
+    Uses orjson when installed.
+    """
+
+    name = "json"
+
+    def __init__(self) -> None:
+        self.loads: Callable[[bytes], Any] = orjson.loads if orjson else json.loads
+
+    def parse(self, lines: Iterable[bytes]) -> list[Record | None]:
+        loads = self.loads
+        records: list[Record | None] = []
+        for line in lines:
+            if not line.strip():
+                records.append(None)
+                continue
+            try:
+                data = loads(line)
+            except ValueError:
+                metrics.PARSE_FAILURES.inc(cause="invalid_json")
+                LOG.warning("failed to parse line, check logging format")
+                data = None
+            else:
+                if not isinstance(data, dict):
+                    metrics.PARSE_FAILURES.inc(cause="not_object")
+                    LOG.warning("failed to parse line, check logging format")
+                    data = None
+            records.append(data)
+        return records
+
+
+class RegexFormat(LogFormat):
+    """
+    Plain text lines in an nginx `log_format`, matched with a compiled regex.
+    A `$request` line like "GET /path HTTP/1.1" is split into method and uri.
+    """
+
+    def __init__(self, name: str, log_format: str) -> None:
+        self.name = name
+        self.log_format = log_format
+        self.pattern, self.defaults = compile_format(log_format)
+        self.fields = tuple(self.pattern.groupindex)
+
+    def parse(self, lines: Iterable[bytes]) -> list[Record | None]:
+        match = self.pattern.fullmatch
+        fields = self.fields
+        defaults = self.defaults
+        split = "request" in fields
+        records: list[Record | None] = []
+        for line in lines:
+            if not line.strip():
+                records.append(None)
+                continue
+            result = match(line.decode("utf-8", "replace"))
+            if result is None:
+                metrics.PARSE_FAILURES.inc(cause="no_match")
+                LOG.warning("failed to parse line, check logging format")
+                records.append(None)
+                continue
+
+            data = dict(zip(fields, result.groups()))
+            if split:
+                method, _, rest = data.pop("request").partition(" ")
+                data.setdefault("method", method)
+                data.setdefault("uri", rest.rpartition(" ")[0] or rest)
+            if defaults:
+                data.update(defaults)
+            records.append(data)
+        return records
+
+
+FORMATS: dict[str, Callable[[], LogFormat]] = {
+    "json": JSONFormat,
+    "combined": lambda: RegexFormat("combined", COMBINED),
+    "common": lambda: RegexFormat("common", COMMON),
+}
+
+FORMAT: LogFormat = JSONFormat()
+
+
+def get_format(spec: str) -> LogFormat:
+    """
+    A log format by name, or compiled from an nginx `log_format` string.
+    """
+    if factory := FORMATS.get(spec):
+        return factory()
+    if "$" in spec:
+        return RegexFormat("custom", spec)
+    raise ValueError(
+        f"unknown log format {spec!r}, expected one of {', '.join(FORMATS)} "
+        "or an nginx log_format string"
+    )
+
+
+def load_format(spec: str | None = None) -> None:
+    """
+    Set the log format used to parse lines, or reset to the default JSON format.
+    """
+    global FORMAT
+
+    FORMAT = get_format(spec) if spec else JSONFormat()
+
+
+def parse(lines: Iterable[bytes]) -> list[Record | None]:
+    return FORMAT.parse(lines)
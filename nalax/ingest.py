@@ -0,0 +1,139 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+import gzip
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Generator, Sequence
+
+from . import agent, db, formats, iplookup
+from .tail import convert_many
+from .types import EventRow, IngestStats
+
+LOG = logging.getLogger(__name__)
+
+BLOCK_SIZE = 4 << 20
+BATCH_SIZE = 50000
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def open_log(path: Path) -> BinaryIO:
+    """
+    Open a plain, gzip, or zstd compressed log file for binary streaming.
+    """
+    with open(path, "rb") as f:
+        magic = f.read(4)
+
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.open(path, "rb")  # type: ignore[return-value]
+
+    if magic.startswith(ZSTD_MAGIC):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError(
+                f"{path} is zstd compressed, install nalax[zstd] to ingest it"
+            )
+        return zstandard.open(path, "rb")  # type: ignore[no-any-return]
+
+    return open(path, "rb")
+
+
+def blocks(path: Path, block_size: int = BLOCK_SIZE) -> Generator[bytes, None, None]:
+    """
+    Stream a log file in large blocks, each ending on a line boundary.
+    """
+    with open_log(path) as f:
+        remainder = b""
+        while data := f.read(block_size):
+            end = data.rfind(b"\n")
+            if end < 0:
+                remainder += data
+                continue
+            yield remainder + data[: end + 1]
+            remainder = data[end + 1 :]
+        if remainder:
+            yield remainder
+
+
+def init_worker(
+    cache_dir: Path, agent_rules: Path | None, log_format: str | None
+) -> None:
+    iplookup.load(cache_dir)
+    if agent_rules:
+        agent.load_rules(agent_rules)
+    if log_format:
+        formats.load_format(log_format)
+
+
+def convert_block(block: bytes) -> tuple[int, list[EventRow]]:
+    """
+    Parse and convert a block of log lines, returning the number of non-empty
+    lines seen and the resulting event rows.
+    """
+    lines = [line for line in block.split(b"\n") if line.strip()]
+    events = convert_many(formats.parse(lines))
+    return len(lines), [event.as_row() for event in events if event is not None]
+
+
+def ingest(
+    database: Path,
+    paths: Sequence[Path],
+    jobs: int | None = None,
+    batch_size: int = BATCH_SIZE,
+    agent_rules: Path | None = None,
+    log_format: str | None = None,
+) -> IngestStats:
+    """
+    Bulk load existing log files into the database.
+
+    Blocks of lines are converted across a pool of worker processes, while
+    the results are written by this process in large batches.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    stats = IngestStats()
+    rows: list[EventRow] = []
+    pending: deque[Future[tuple[int, list[EventRow]]]] = deque()
+    start = time.monotonic()
+
+    def collect() -> None:
+        lines, converted = pending.popleft().result()
+        stats.lines += lines
+        stats.events += len(converted)
+        rows.extend(converted)
+        if len(rows) >= batch_size:
+            flush()
+
+    def flush() -> None:
+        writer.insert_rows(rows)
+        LOG.info("recorded %d events", len(rows))
+        rows.clear()
+
+    with db.Writer(database) as writer, ProcessPoolExecutor(
+        jobs,
+        initializer=init_worker,
+        initargs=(database.parent, agent_rules, log_format),
+    ) as pool:
+        for path in paths:
+            LOG.info("ingesting %s", path)
+            stats.files += 1
+            for block in blocks(path):
+                pending.append(pool.submit(convert_block, block))
+                # bound the amount of work in flight
+                while len(pending) > jobs * 2:
+                    collect()
+
+        while pending:
+            collect()
+
+        if rows:
+            flush()
+
+    stats.seconds = time.monotonic() - start
+    return stats
@@ -1,14 +1,50 @@
 # Copyright Amethyst Reese
 # Licensed under the MIT license
 
-import pkgutil
+import logging
+import mmap
+import os
+import struct
+import threading
+from array import array
 from bisect import bisect
 from functools import lru_cache
-from io import StringIO
 from ipaddress import ip_address, IPv6Address
-from typing import Generator, NamedTuple
+from pathlib import Path
+from socket import AF_INET, inet_pton
+from typing import Any, Generator, Iterable, NamedTuple, Sequence
 
-from rich import print
+from . import metrics, profiling
+
+LOG = logging.getLogger(__name__)
+
+VENDOR_DIR = Path(__file__).parent / "vendor" / "ip2asn"
+SOURCE_NAME = "ip2country-v4-u32.tsv"
+INDEX_NAME = "ip2country-v4-u32.idx"
+
+# magic, range count, region count, source size, source mtime
+INDEX_MAGIC = b"NLXIP4\x00\x01"
+INDEX_HEADER = struct.Struct("<8sIIQQ")
+REGION_WIDTH = 8
+
+assert array("I").itemsize == 4, "array('I') must be 32 bits wide"
+
+# numpy is optional and slow to import, so wait until a batch lookup needs it
+UNLOADED: Any = object()
+numpy: Any = UNLOADED
+
+
+def load_numpy() -> Any:
+    global numpy
+
+    if numpy is UNLOADED:
+        try:
+            import numpy as module
+        except ImportError:  # pragma: no cover
+            numpy = None
+        else:
+            numpy = module
+    return numpy
 
 
 class IPv4Range(NamedTuple):
@@ -17,19 +53,78 @@ class IPv4Range(NamedTuple):
     region: str
 
 
-IP2COUNTRY_V4: list[IPv4Range] = []
+class IPv4Index:
+    """
+    Sorted IPv4 ranges stored as parallel uint32 columns.
 
+    Columns are plain sequences of integers; either arrays built in memory or
+    memoryviews over an mmap'ed index file.
+    """
 
-def load() -> None:
-    global IP2COUNTRY_V4
+    def __init__(
+        self,
+        starts: Sequence[int],
+        ends: Sequence[int],
+        regions: Sequence[int],
+        codes: Sequence[str],
+        buffer: mmap.mmap | None = None,
+    ) -> None:
+        self.starts = starts
+        self.ends = ends
+        self.regions = regions
+        self.codes = codes
+        self.buffer = buffer
+        self._arrays: tuple[Any, Any, Any] | None = None
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, idx: int) -> IPv4Range:
+        return IPv4Range(
+            self.starts[idx], self.ends[idx], self.codes[self.regions[idx]]
+        )
+
+    def region(self, ip32: int) -> str:
+        idx = bisect(self.starts, ip32) - 1
+        if idx < 0 or ip32 > self.ends[idx]:
+            return "Unknown"
+        return self.codes[self.regions[idx]]
+
+    def region_many(self, ip32s: Sequence[int]) -> list[str]:
+        numpy = load_numpy()
+        if numpy is None or not len(self):
+            return [self.region(ip32) for ip32 in ip32s]
+
+        if self._arrays is None:
+            self._arrays = (
+                numpy.frombuffer(self.starts, dtype=numpy.uint32),
+                numpy.frombuffer(self.ends, dtype=numpy.uint32),
+                numpy.frombuffer(self.regions, dtype=numpy.uint16),
+            )
+        starts, ends, regions = self._arrays
 
-    data = pkgutil.get_data(
-        "nalax",
-        "vendor/ip2asn/ip2country-v4-u32.tsv",
-    ).decode("utf-8")
+        ips = numpy.asarray(ip32s, dtype=numpy.uint32)
+        idxs = numpy.searchsorted(starts, ips, side="right") - 1
+        found = idxs >= 0
+        idxs[~found] = 0
+        found &= ips <= ends[idxs]
 
-    def ingest(content: StringIO) -> Generator[IPv4Range, None, None]:
-        for line in content:
+        codes = self.codes
+        return [
+            codes[region] if ok else "Unknown"
+            for region, ok in zip(regions[idxs].tolist(), found.tolist())
+        ]
+
+
+# loaded on first lookup, see `index()`
+IP2COUNTRY_V4: IPv4Index | None = None
+CACHE_DIR: Path | None = None
+LOAD_LOCK = threading.Lock()
+
+
+def read_source(source: Path) -> IPv4Index:
+    def ingest(content: bytes) -> Generator[IPv4Range, None, None]:
+        for line in content.decode("utf-8").splitlines():
             values = line.strip().split()
             match values:
                 case [a, b, c]:
@@ -39,33 +134,203 @@ def load() -> None:
                 case _:
                     continue
 
-    IP2COUNTRY_V4 = sorted(ingest(StringIO(data)))
+    starts = array("I")
+    ends = array("I")
+    regions = array("H")
+    codes: dict[str, int] = {}
+    for start, end, region in sorted(ingest(source.read_bytes())):
+        starts.append(start)
+        ends.append(end)
+        regions.append(codes.setdefault(region, len(codes)))
+
+    return IPv4Index(starts, ends, regions, tuple(codes))
+
+
+def write_index(target: Path, index: IPv4Index, source: os.stat_result) -> None:
+    assert isinstance(index.starts, array)
+    assert isinstance(index.ends, array)
+    assert isinstance(index.regions, array)
+
+    header = INDEX_HEADER.pack(
+        INDEX_MAGIC,
+        len(index),
+        len(index.codes),
+        source.st_size,
+        source.st_mtime_ns,
+    )
+    codes = b"".join(
+        code.encode("ascii").ljust(REGION_WIDTH, b"\0") for code in index.codes
+    )
+
+    temp = target.with_name(f".{target.name}.{os.getpid()}")
+    try:
+        with open(temp, "wb") as f:
+            f.write(header)
+            f.write(codes)
+            index.starts.tofile(f)
+            index.ends.tofile(f)
+            index.regions.tofile(f)
+        os.replace(temp, target)
+    finally:
+        temp.unlink(missing_ok=True)
+
+
+def open_index(target: Path, source: os.stat_result) -> IPv4Index | None:
+    try:
+        with open(target, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    if len(buffer) < INDEX_HEADER.size:
+        return None
+
+    magic, count, region_count, size, mtime = INDEX_HEADER.unpack_from(buffer)
+    if magic != INDEX_MAGIC or size != source.st_size or mtime != source.st_mtime_ns:
+        LOG.debug("stale ip index %s", target)
+        return None
+
+    offset = INDEX_HEADER.size
+    expected = offset + region_count * REGION_WIDTH + count * 10
+    if len(buffer) != expected:
+        LOG.warning("corrupt ip index %s", target)
+        return None
+
+    codes = tuple(
+        buffer[o : o + REGION_WIDTH].rstrip(b"\0").decode("ascii")
+        for o in range(offset, offset + region_count * REGION_WIDTH, REGION_WIDTH)
+    )
+    offset += region_count * REGION_WIDTH
+
+    view = memoryview(buffer)
+    starts = view[offset : offset + count * 4].cast("I")
+    offset += count * 4
+    ends = view[offset : offset + count * 4].cast("I")
+    offset += count * 4
+    regions = view[offset : offset + count * 2].cast("H")
+
+    return IPv4Index(starts, ends, regions, codes, buffer)
+
+
+def load(cache_dir: Path | None = None) -> None:
+    """
+    Open the prebuilt ip2country index, generating it from the TSV if needed.
+
+    The index is cached next to the vendored TSV when the package is writable,
+    or in `cache_dir` otherwise.
+    """
+    global IP2COUNTRY_V4
+
+    source = VENDOR_DIR / SOURCE_NAME
+    stat = source.stat()
+
+    candidates = [VENDOR_DIR / INDEX_NAME]
+    if cache_dir is not None:
+        candidates.append(cache_dir / INDEX_NAME)
+
+    for target in candidates:
+        if index := open_index(target, stat):
+            IP2COUNTRY_V4 = index
+            lookup.cache_clear()
+            return
+
+    built = read_source(source)
+    for target in candidates:
+        try:
+            write_index(target, built, stat)
+        except OSError as exc:
+            LOG.debug("failed to write ip index %s: %s", target, exc)
+            continue
+        if index := open_index(target, stat):
+            LOG.info("generated ip index %s", target)
+            IP2COUNTRY_V4 = index
+            lookup.cache_clear()
+            return
+
+    LOG.warning("unable to cache ip index, using in-memory table")
+    IP2COUNTRY_V4 = built
+    lookup.cache_clear()
+
+
+def configure(cache_dir: Path | None) -> None:
+    """
+    Set the fallback directory for caching the index when it's first loaded.
+    """
+    global CACHE_DIR
+    CACHE_DIR = cache_dir
+
+
+def index() -> IPv4Index:
+    """
+    The ip2country index, loaded on first use so commands that never look up
+    an address don't pay to open or build it.
+    """
+    if IP2COUNTRY_V4 is None:
+        with LOAD_LOCK:
+            if IP2COUNTRY_V4 is None:
+                load(CACHE_DIR)
+    assert IP2COUNTRY_V4 is not None
+    return IP2COUNTRY_V4
 
 
 @lru_cache(maxsize=1024)
 def lookup(ips: str) -> tuple[str, str]:
-    try:
-        ip = ip_address(ips)
-    except ValueError:
-        return "None", "none"
-    if isinstance(ip, IPv6Address):
-        return "None", "ipv6"
-    else:
-        ip32 = int(ip)
-        idx = bisect(IP2COUNTRY_V4, (ip32,))
-        if idx >= len(IP2COUNTRY_V4):
-            idx -= 1
-        ipr = IP2COUNTRY_V4[idx]
-        if ip32 < ipr.start:
-            ipr = IP2COUNTRY_V4[idx - 1]
-        if ip32 > ipr.end:
-            return "Unknown"
-        return ipr.region, "ipv4"
+    with profiling.span("iplookup.lookup"):
+        try:
+            ip = ip_address(ips)
+        except ValueError:
+            return "None", "none"
+        if isinstance(ip, IPv6Address):
+            return "None", "ipv6"
+        else:
+            return index().region(int(ip)), "ipv4"
+
+
+def lookup_many(addresses: Iterable[str]) -> list[tuple[str, str]]:
+    """
+    Resolve a batch of addresses at once, parsing each distinct address once.
+    """
+    with profiling.span("iplookup.lookup_many"):
+        addresses = list(addresses)
+        results: dict[str, tuple[str, str]] = {}
+        ipv4: list[str] = []
+        ip32s = array("I")
+
+        for ips in dict.fromkeys(addresses):
+            try:
+                ip32s.append(int.from_bytes(inet_pton(AF_INET, ips), "big"))
+                ipv4.append(ips)
+                continue
+            except (OSError, ValueError, TypeError):
+                pass
+            results[ips] = lookup(ips)
+
+        for ips, region in zip(ipv4, index().region_many(ip32s)):
+            results[ips] = (region, "ipv4")
+
+        metrics.IP_BATCH_LOOKUPS.inc(len(addresses) - len(results), result="hit")
+        metrics.IP_BATCH_LOOKUPS.inc(len(results), result="miss")
+        return [results[ips] for ips in addresses]
+
+
+def cache_stats() -> dict[tuple[str, ...], float]:
+    info = lookup.cache_info()
+    return {("hit",): info.hits, ("miss",): info.misses}
+
+
+metrics.Counter(
+    "nalax_ip_cache_lookups_total",
+    "Single address lookups, by cache result",
+    ("result",),
+    collect=cache_stats,
+)
 
 
 if __name__ == "__main__":
     import sys
 
+    from rich import print
+
     addrs = sys.argv[1:]
 
     load()
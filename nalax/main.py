@@ -1,24 +1,98 @@
 # Copyright Amethyst Reese
 # Licensed under the MIT license
 
+import datetime
 import logging
 import sys
 from pathlib import Path
-from time import time_ns
+from typing import TYPE_CHECKING
 
-import arrow
 import click
 from rich import print
 
-from . import db, iplookup
+from . import db, profiling, report, units
 from .__version__ import __version__
-from .tail import tail
-from .types import Event, Options
+from .types import Options
 
 LOG = logging.getLogger(__name__)
 
+if TYPE_CHECKING:
+    # only generic in newer versions of click, with differing type parameters
+    DurationType = click.ParamType[float, str | float]
+    SizeType = click.ParamType[int, str | int]
+else:
+    DurationType = SizeType = click.ParamType
 
-@click.group()
+
+class Duration(DurationType):
+    """
+    A duration with units, in seconds. Options that used to take bare integer
+    nanoseconds set `bare_nanoseconds`, so old command lines keep their meaning
+    with a deprecation warning.
+    """
+
+    name = "duration"
+
+    def __init__(self, bare_nanoseconds: bool = False) -> None:
+        self.bare_nanoseconds = bare_nanoseconds
+
+    def convert(
+        self,
+        value: str | float,
+        param: click.Parameter | None,
+        ctx: click.Context | None,
+    ) -> float:
+        if isinstance(value, (int, float)):
+            return float(value)
+        if not (self.bare_nanoseconds and units.is_bare(value)):
+            try:
+                return units.parse_duration(value)
+            except ValueError as exc:
+                self.fail(str(exc), param, ctx)
+
+        option = param.opts[0] if param else "duration"
+        if not value.strip().isdigit():
+            self.fail(f"{value!r} needs a unit, eg 500ms or 2s", param, ctx)
+        seconds = units.parse_duration(value, bare_unit="ns")
+        LOG.warning(
+            "%s %s is read as nanoseconds (%gs), which is deprecated; "
+            "give a unit instead, eg 500ms or 2s",
+            option,
+            value.strip(),
+            seconds,
+        )
+        return seconds
+
+
+class Size(SizeType):
+    name = "size"
+
+    def convert(
+        self, value: str | int, param: click.Parameter | None, ctx: click.Context | None
+    ) -> int:
+        if isinstance(value, int):
+            return value
+        try:
+            return units.parse_size(value)
+        except ValueError as exc:
+            self.fail(str(exc), param, ctx)
+
+
+class Main(click.Group):
+    def parse_args(self, ctx: click.Context, args: list[str]) -> list[str]:
+        # click would take the command name as the value of a bare --profile
+        args = list(args)
+        for index, arg in enumerate(args):
+            if arg in self.commands:
+                break
+            if arg == "--profile" and args[index + 1 : index + 2] not in (
+                [mode] for mode in profiling.MODES
+            ):
+                args[index] = "--profile=cprofile"
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=Main)
 @click.pass_context
 @click.version_option(__version__, "--version", "-V")
 @click.option("--verbose / --quiet", "-v / -q", default=None)
@@ -28,9 +102,45 @@ LOG = logging.getLogger(__name__)
     type=click.Path(dir_okay=False, writable=True, resolve_path=True, path_type=Path),
     default=Path("nalax.db"),
 )
-def main(ctx: click.Context, database: Path, verbose: bool | None) -> None:
+@click.option(
+    "--agent-rules",
+    type=click.Path(exists=True, dir_okay=False, resolve_path=True, path_type=Path),
+    default=None,
+    help="JSON file of user agent rules to use instead of the defaults",
+)
+@click.option(
+    "--log-format",
+    "-f",
+    default=None,
+    help="json (default), combined, common, or an nginx log_format string",
+)
+@click.option(
+    "--profile",
+    type=click.Choice(profiling.MODES),
+    is_flag=False,
+    flag_value="cprofile",
+    default=None,
+    help="profile the command, saving pstats or a tracemalloc snapshot",
+)
+@click.option(
+    "--profile-output",
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    default=None,
+    help="where to save the profile [default: nalax-COMMAND.pstats|.tracemalloc]",
+)
+def main(
+    ctx: click.Context,
+    database: Path,
+    agent_rules: Path | None,
+    log_format: str | None,
+    verbose: bool | None,
+    profile: str | None,
+    profile_output: Path | None,
+) -> None:
     options = Options(
         database=database,
+        agent_rules=agent_rules,
+        log_format=log_format,
     )
     level = (
         logging.DEBUG
@@ -38,8 +148,34 @@ def main(ctx: click.Context, database: Path, verbose: bool | None) -> None:
         else (logging.WARNING if verbose is None else logging.ERROR)
     )
     logging.basicConfig(level=level, stream=sys.stderr)
+
+    if profile:
+        if profile_output is None:
+            name = f"nalax-{ctx.invoked_subcommand}{profiling.SUFFIXES[profile]}"
+            profile_output = Path(name)
+        profiler = profiling.Profiler(profile, profile_output)
+
+        def finish() -> None:
+            profiler.stop()
+            click.echo(profiling.summary(), err=True)
+            click.echo(f"saved {profile} profile to {profile_output}", err=True)
+
+        profiler.start()
+        ctx.call_on_close(finish)
+
+    # commands import what they need, so that short commands start quickly
     db.update_schema(options.database)
-    iplookup.load()
+    if options.agent_rules:
+        from . import agent
+
+        agent.load_rules(options.agent_rules)
+    if options.log_format:
+        from . import formats
+
+        try:
+            formats.load_format(options.log_format)
+        except ValueError as exc:
+            raise click.BadParameter(str(exc), param_hint="--log-format")
     ctx.obj = options
 
 
@@ -55,56 +191,170 @@ def main(ctx: click.Context, database: Path, verbose: bool | None) -> None:
 @click.option(
     "--buffer-time",
     "-t",
-    type=int,
+    type=Duration(bare_nanoseconds=True),
     default=0,
-    help="nanoseconds to wait before flushing batch",
+    help="max time an event waits before flushing batch, eg 500ms or 2s "
+    "(bare numbers are nanoseconds, deprecated)",
 )
-@click.argument(
-    "log-path",
-    type=click.Path(exists=True, dir_okay=False, resolve_path=True, path_type=Path),
+@click.option(
+    "--buffer-bytes",
+    type=Size(),
+    default="8MB",
+    show_default=True,
+    help="max raw log data to buffer before flushing batch, eg 512KB or 16MB",
+)
+@click.option(
+    "--aggregate-inline",
+    is_flag=True,
+    help="count events straight into daily stats, without storing raw events",
+)
+@click.option(
+    "--metrics-port",
+    type=int,
+    default=None,
+    help="serve Prometheus metrics at http://127.0.0.1:PORT/metrics",
 )
+@click.option(
+    "--stats-file",
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    default=None,
+    help="periodically write Prometheus metrics to this file",
+)
+@click.option(
+    "--stats-interval",
+    type=Duration(),
+    default="10s",
+    show_default=True,
+    help="how often to rewrite --stats-file",
+)
+@click.option(
+    "--rescan-interval",
+    type=Duration(),
+    default="10s",
+    show_default=True,
+    help="how often to check glob patterns for new log files",
+)
+@click.argument("log-paths", nargs=-1, required=True)
 def tail_logs(
-    ctx: click.Context, log_path: Path, buffer_size: int, buffer_time: int
+    ctx: click.Context,
+    log_paths: tuple[str, ...],
+    buffer_size: int,
+    buffer_time: float,
+    buffer_bytes: int,
+    aggregate_inline: bool,
+    metrics_port: int | None,
+    stats_file: Path | None,
+    stats_interval: float,
+    rescan_interval: float,
 ) -> None:
     """
     Tail access logs and add to database
+
+    Takes any number of log paths or quoted glob patterns, like
+    '/var/log/nginx/*.json', and follows every matching file, including new
+    files that match later.
     """
-    options: Options = ctx.obj
+    import asyncio
 
-    batch: list[Event] = []
+    from . import iplookup
+    from .pipeline import Pipeline
 
-    def buffered() -> None:
-        target = time_ns() + buffer_time
-        for event in tail(log_path):
-            now = time_ns()
-            if now > target and not batch:
-                target = now + buffer_time
+    options: Options = ctx.obj
+    # the ip index is loaded on first lookup, and cached here if the package
+    # directory isn't writable
+    iplookup.configure(options.database.parent)
 
-            batch.append(event)
+    pipeline = Pipeline(
+        options.database,
+        log_paths,
+        buffer_size=buffer_size,
+        buffer_time=buffer_time,
+        buffer_bytes=buffer_bytes,
+        aggregate_inline=aggregate_inline,
+        metrics_port=metrics_port,
+        stats_file=stats_file,
+        stats_interval=stats_interval,
+        rescan_interval=rescan_interval,
+    )
+    asyncio.run(pipeline.run())
 
-            if len(batch) >= buffer_size or now > target:
-                db.insert_events(options.database, batch)
-                LOG.info("recorded %d events", len(batch))
-                batch.clear()
-                target = now + buffer_time
 
-    if buffer_size or buffer_time:
-        return buffered()
+@main.command("ingest")
+@click.pass_context
+@click.option(
+    "--jobs",
+    "-j",
+    type=int,
+    default=None,
+    help="number of worker processes (default: all cores)",
+)
+@click.option(
+    "--batch-size",
+    "-b",
+    type=int,
+    default=50000,
+    show_default=True,
+    help="number of events to write per transaction",
+)
+@click.argument(
+    "paths",
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True, dir_okay=False, resolve_path=True, path_type=Path),
+)
+def ingest_logs(
+    ctx: click.Context, paths: tuple[Path, ...], jobs: int | None, batch_size: int
+) -> None:
+    """
+    Bulk load existing access logs, plain or gzip/zstd compressed
+    """
+    from . import ingest
 
-    else:
-        for event in tail(log_path):
-            db.insert_events(options.database, [event])
-            sys.stdout.write(".")
-            sys.stdout.flush()
+    options: Options = ctx.obj
+
+    stats = ingest.ingest(
+        options.database,
+        paths,
+        jobs=jobs,
+        batch_size=batch_size,
+        agent_rules=options.agent_rules,
+        log_format=options.log_format,
+    )
+    rate = stats.lines / stats.seconds if stats.seconds else 0
+    print(
+        f"{stats.lines} lines from {stats.files} files in {stats.seconds:.1f}s "
+        f"({rate:.0f} lines/sec): {stats.events} events, {stats.bad} bad lines"
+    )
 
 
 @main.command("aggregate")
 @click.pass_context
+@click.option(
+    "--keep-daily",
+    type=int,
+    default=None,
+    metavar="DAYS",
+    help="delete daily stats older than DAYS, keeping weekly/monthly stats",
+)
+@click.option(
+    "--keep-weekly",
+    type=int,
+    default=None,
+    metavar="WEEKS",
+    help="delete weekly stats older than WEEKS, keeping monthly stats",
+)
 @click.argument("before", type=str, required=False)
-def aggregate(ctx: click.Context, before: str | None) -> None:
+def aggregate(
+    ctx: click.Context,
+    before: str | None,
+    keep_daily: int | None,
+    keep_weekly: int | None,
+) -> None:
     """
     Aggregate raw events into daily/weekly/monthly stats
     """
+    import arrow
+
     options: Options = ctx.obj
 
     if before is None:
@@ -119,23 +369,119 @@ def aggregate(ctx: click.Context, before: str | None) -> None:
     event_count = db.aggregate_daily_events(options.database, before)
     print(f"{event_count} events aggregated")
 
+    if keep_daily is not None or keep_weekly is not None:
+        deleted = db.prune_rollups(options.database, keep_daily, keep_weekly)
+        print(f"{deleted} old daily/weekly rows pruned")
+
+
+def parse_date(value: str) -> datetime.date:
+    """
+    Parse an absolute date, or a relative one like "30 days ago", in UTC.
+    """
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        pass
+
+    import arrow
+
+    try:
+        return arrow.utcnow().dehumanize(value).date()
+    except ValueError:
+        return arrow.get(value).to("utc").date()
+
 
 @main.command("report")
 @click.pass_context
-def report(ctx: click.Context) -> None:
+@click.option("--host", type=str, default=None, help="only report on this host")
+@click.option(
+    "--since", type=str, default=None, help="first day to include, eg 2023-05-01"
+)
+@click.option(
+    "--until", type=str, default=None, help="last day to include, default today"
+)
+@click.option(
+    "--by",
+    type=click.Choice(list(report.DIMENSIONS)),
+    default="path",
+    show_default=True,
+    help="dimension to group counts by",
+)
+@click.option(
+    "--top", type=int, default=report.TOP, show_default=True, help="rows to show"
+)
+@click.option(
+    "--format",
+    "fmt",
+    type=click.Choice(report.FORMATS),
+    default="table",
+    show_default=True,
+    help="output format",
+)
+@click.option("--explain", is_flag=True, help="show the query plan instead")
+@click.option("--no-cache", is_flag=True, help="ignore and skip the report cache")
+def report_stats(
+    ctx: click.Context,
+    host: str | None,
+    since: str | None,
+    until: str | None,
+    by: str,
+    top: int,
+    fmt: str,
+    explain: bool,
+    no_cache: bool,
+) -> None:
     """
     Generate reports
     """
     options: Options = ctx.obj
-    with db.connect(options.database) as conn:
-        result = conn.execute(
-            "select * from nalax_daily_pages order by count desc limit 20"
-        )
-        for row in result.fetchall():
-            print(*row)
 
-        result = conn.execute(
-            "select * from nalax_daily_users order by count desc limit 20"
+    try:
+        since_date = parse_date(since) if since else None
+        until_date = parse_date(until) if until else None
+        if explain:
+            with db.connect(options.database) as conn:
+                retention = db.get_retention(conn)
+                query = report.build_query(
+                    by, host, since_date, until_date, top, retention=retention
+                )
+                click.echo("\n".join(report.explain(conn, query)))
+            return
+
+        rows = report.report(
+            options.database,
+            by,
+            host,
+            since_date,
+            until_date,
+            top,
+            cache=not no_cache,
         )
-        for row in result.fetchall():
-            print(*row)
+    except ValueError as exc:
+        raise click.UsageError(str(exc))
+
+    click.echo(report.render(rows, by, fmt))
+
+
+@main.command("serve")
+@click.pass_context
+@click.option("--host", type=str, default="127.0.0.1", show_default=True)
+@click.option("--port", type=int, default=8080, show_default=True)
+@click.option(
+    "--workers",
+    type=int,
+    default=4,
+    show_default=True,
+    help="query threads, each with its own read-only connection",
+)
+def serve_reports(ctx: click.Context, host: str, port: int, workers: int) -> None:
+    """
+    Serve reports as JSON over HTTP
+    """
+    import asyncio
+
+    from . import serve
+
+    options: Options = ctx.obj
+    server = serve.Server(options.database, host, port, workers=workers)
+    asyncio.run(server.run())
@@ -0,0 +1,278 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+import logging
+import os
+import threading
+from bisect import bisect_left
+from pathlib import Path
+from typing import Any, Callable, Iterable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import asyncio
+
+LOG = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = tuple[str, ...]
+Sample = tuple[str, dict[str, str], float]  # suffix, labels, value
+
+
+class Metric:
+    """
+    Base for metrics in the Prometheus text exposition format.
+
+    Metrics register themselves in `REGISTRY` when created. Instead of recording
+    values, a metric can be given a `collect` function that reports current
+    values, keyed by label values, whenever metrics are rendered.
+    """
+
+    kind = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Labels = (),
+        *,
+        collect: Callable[[], dict[Labels, float]] | None = None,
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.collect = collect
+        self.values: dict[Labels, float] = {}
+        self.lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def key(self, labels: dict[str, str]) -> Labels:
+        return tuple(labels[name] for name in self.labels)
+
+    def samples(self) -> Iterable[Sample]:
+        values = self.collect() if self.collect else dict(self.values)
+        for key, value in values.items():
+            yield "", dict(zip(self.labels, key)), value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...]) -> None:
+        super().__init__(name, help)
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self) -> Iterable[Sample]:
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+
+        cumulative = 0
+        for bound, count in zip((*self.buckets, float("inf")), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            yield "_bucket", {"le": le}, cumulative
+        yield "_sum", {}, total
+        yield "_count", {}, cumulative
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> None:
+        if metric.name in self.metrics:
+            raise ValueError(f"metric {metric.name} already registered")
+        self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                label_text = ",".join(
+                    f'{name}="{escape(label)}"' for name, label in labels.items()
+                )
+                if label_text:
+                    label_text = f"{{{label_text}}}"
+                lines.append(f"{metric.name}{suffix}{label_text} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def write_stats(path: Path) -> None:
+    """
+    Atomically replace a stats file with the current metrics, for collection by
+    node_exporter's textfile collector or similar.
+    """
+    temp = path.with_name(f".{path.name}.tmp")
+    temp.write_text(REGISTRY.render())
+    os.replace(temp, path)
+
+
+async def handle(
+    reader: "asyncio.StreamReader", writer: "asyncio.StreamWriter"
+) -> None:
+    import asyncio
+
+    try:
+        request = await reader.readuntil(b"\r\n\r\n")
+        method, target, *_ = request.split(b" ", 2)
+        if method == b"GET" and target.split(b"?")[0] == b"/metrics":
+            status = "200 OK"
+            body = REGISTRY.render().encode()
+        else:
+            status = "404 Not Found"
+            body = b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: {CONTENT_TYPE}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+        pass
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int) -> "asyncio.Server":
+    """
+    Start serving metrics over HTTP at `/metrics` on the running event loop.
+    """
+    # deferred, so importing metrics from the hot path doesn't pull in asyncio
+    import asyncio
+
+    server = await asyncio.start_server(handle, host, port)
+    LOG.info("serving metrics on http://%s:%d/metrics", host, port)
+    return server
+
+
+# ingest metrics shared by tail, the pipeline, and iplookup
+LINES_READ = Counter("nalax_lines_read_total", "Log lines read", ("path",))
+PARSE_FAILURES = Counter(
+    "nalax_parse_failures_total", "Log lines that failed to parse", ("cause",)
+)
+EVENTS_WRITTEN = Counter("nalax_events_written_total", "Events committed")
+BATCH_SIZE = Histogram(
+    "nalax_batch_size",
+    "Events per committed batch",
+    (1, 10, 100, 1000, 10_000, 100_000),
+)
+COMMIT_SECONDS = Histogram(
+    "nalax_commit_seconds",
+    "Time spent writing and committing each batch",
+    (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+LAG_BYTES = Gauge(
+    "nalax_lag_bytes",
+    "Bytes between the last committed line and the end of the log file",
+    ("path",),
+)
+LAG_SECONDS = Gauge(
+    "nalax_lag_seconds",
+    "Time between reading the oldest line of the last batch and its commit",
+)
+IP_BATCH_LOOKUPS = Counter(
+    "nalax_ip_batch_lookups_total",
+    "Addresses resolved in batches, where repeats in a batch are hits",
+    ("result",),
+)
+
+# stats of the running pipeline, see pipeline.Pipeline.stats
+PIPELINE: Callable[[], dict[str, Any]] | None = None
+
+
+def pipeline_stats(section: str, field: str = "") -> Callable[[], dict[Labels, float]]:
+    """
+    Collect one value for each queue, stage, or file in a section of the running
+    pipeline's stats, or nothing when no pipeline is running.
+    """
+
+    def collect() -> dict[Labels, float]:
+        if PIPELINE is None:
+            return {}
+        return {
+            (name,): value[field] if field else value
+            for name, value in PIPELINE()[section].items()
+        }
+
+    return collect
+
+
+QUEUE_DEPTH = Gauge(
+    "nalax_queue_depth",
+    "Items waiting in each pipeline queue",
+    ("queue",),
+    collect=pipeline_stats("queues"),
+)
+STAGE_ITEMS = Counter(
+    "nalax_stage_items_total",
+    "Items processed by each pipeline stage",
+    ("stage",),
+    collect=pipeline_stats("stages", "items"),
+)
+STAGE_BUSY_SECONDS = Counter(
+    "nalax_stage_busy_seconds_total",
+    "Time each pipeline stage spent processing items",
+    ("stage",),
+    collect=pipeline_stats("stages", "busy"),
+)
+STAGE_BLOCKED_SECONDS = Counter(
+    "nalax_stage_blocked_seconds_total",
+    "Time each pipeline stage spent waiting for room in the next queue",
+    ("stage",),
+    collect=pipeline_stats("stages", "blocked"),
+)
+STAGE_AVERAGE_SECONDS = Gauge(
+    "nalax_stage_average_seconds",
+    "Average time each pipeline stage spends on an item",
+    ("stage",),
+    collect=pipeline_stats("stages", "average"),
+)
+STAGE_SLOWEST_SECONDS = Gauge(
+    "nalax_stage_slowest_seconds",
+    "Longest time each pipeline stage has spent on an item",
+    ("stage",),
+    collect=pipeline_stats("stages", "slowest"),
+)
+FILE_BLOCKED_SECONDS = Counter(
+    "nalax_file_blocked_seconds_total",
+    "Time each log file's reader spent waiting to hand chunks to the parser",
+    ("path",),
+    collect=pipeline_stats("files", "blocked"),
+)
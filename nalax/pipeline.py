@@ -0,0 +1,591 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+import asyncio
+import glob
+import logging
+import os
+import signal
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from dataclasses import dataclass
+from pathlib import Path
+from time import monotonic
+from typing import Any, NamedTuple, Sequence
+
+from . import db, metrics
+from .follow import Chunk, follow, GRACE, Inotify, rotated_path
+from .tail import convert_chunk
+from .types import Checkpoint, Event, Position
+
+LOG = logging.getLogger(__name__)
+
+BUFFER_BYTES = 8 << 20
+CATCHUP_SIZE = 10000
+QUEUE_SIZE = 16
+SOURCE_QUEUE_SIZE = 2
+RESCAN_INTERVAL = 10.0
+STATS_INTERVAL = 60.0
+STATS_FILE_INTERVAL = 10.0
+METRICS_HOST = "127.0.0.1"
+
+
+class Parsed(NamedTuple):
+    path: str
+    received: float
+    size: int
+    events: list[Event]
+    # end of the chunk, past any lines that didn't parse
+    position: Position
+
+
+@dataclass
+class StageStats:
+    """
+    Work done by one pipeline stage: `busy` is time spent processing items,
+    `blocked` is time spent waiting for room in the downstream queue.
+    """
+
+    items: int = 0
+    busy: float = 0.0
+    blocked: float = 0.0
+    slowest: float = 0.0
+
+    def record(self, busy: float) -> None:
+        self.items += 1
+        self.busy += busy
+        self.slowest = max(self.slowest, busy)
+
+    @property
+    def average(self) -> float:
+        return self.busy / self.items if self.items else 0.0
+
+
+@dataclass
+class FileStats:
+    """
+    Work done for one log file: `blocked` is time its reader spent waiting for
+    its turn to hand chunks to the parser.
+    """
+
+    chunks: int = 0
+    lines: int = 0
+    bytes: int = 0
+    events: int = 0
+    lag_bytes: int = 0
+    blocked: float = 0.0
+
+
+class Source:
+    """
+    A log file being followed, with a small queue of chunks waiting for their
+    turn to be parsed.
+    """
+
+    def __init__(self, path: Path, position: Position | None) -> None:
+        self.path = path
+        self.name = path.as_posix()
+        self.position = position
+        self.chunks: asyncio.Queue[Chunk | None] = asyncio.Queue(SOURCE_QUEUE_SIZE)
+        self.stats = FileStats()
+        self.stopping = threading.Event()
+        self.missing: float | None = None
+        self.done = False
+
+
+def has_magic(pattern: str) -> bool:
+    return any(char in pattern for char in "*?[")
+
+
+class Pipeline:
+    """
+    Follow log files and write their events to the database, with reading,
+    parsing, and writing decoupled into separate stages.
+
+    `paths` may be file paths or glob patterns, and patterns are rescanned every
+    `rescan_interval` seconds for new files, which are read from the beginning.
+    Files matching a pattern stop being followed once they have been missing for
+    longer than the `grace` period followers give rotated files.
+    Each file is followed on its own thread, woken by a single shared inotify
+    instance only when its own file changes, and the parser takes one chunk from
+    each file with data waiting in turn, so a busy log can't starve quiet ones.
+    Files matching the first rotation of another file, like `access.log.1`, are
+    left to the follower of the original file.
+
+    Stages are connected by bounded queues, so a slow stage applies
+    backpressure to the ones before it rather than buffering without limit.
+    Batches are flushed when they reach `buffer_size` events or `buffer_bytes`
+    of raw log data, or `buffer_time` seconds after their oldest line was read,
+    whether or not more events arrive in the meantime.
+    Parsing runs in worker threads, and SQLite writes run on a dedicated thread
+    that owns the database connection; batches mix events from every file, and
+    commit the checkpoints for all of them with the events.
+
+    With `aggregate_inline`, batches are counted in memory and merged straight
+    into the daily tables, and raw events are never written to the database.
+
+    Ingest metrics are served in Prometheus format on `metrics_port` when given,
+    and written to `stats_file` every `stats_interval` seconds when given.
+    """
+
+    def __init__(
+        self,
+        database: Path,
+        paths: Sequence[Path | str],
+        *,
+        buffer_size: int = 0,
+        buffer_time: float = 0.0,
+        buffer_bytes: int = BUFFER_BYTES,
+        queue_size: int = QUEUE_SIZE,
+        aggregate_inline: bool = False,
+        metrics_host: str = METRICS_HOST,
+        metrics_port: int | None = None,
+        stats_file: Path | None = None,
+        stats_interval: float = STATS_FILE_INTERVAL,
+        rescan_interval: float = RESCAN_INTERVAL,
+        grace: float = GRACE,
+    ) -> None:
+        self.database = database
+        self.patterns = [str(path) for path in paths]
+        self.buffer_size = buffer_size
+        self.buffer_time = buffer_time
+        self.buffer_bytes = buffer_bytes
+        self.aggregate_inline = aggregate_inline
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        self.stats_file = stats_file
+        self.stats_interval = stats_interval
+        self.rescan_interval = rescan_interval
+        self.grace = grace
+
+        self.sources: dict[Path, Source] = {}
+        self.inotify: Inotify | None = None
+        self.chunks: asyncio.Queue[tuple[Source, Chunk] | None] = asyncio.Queue(
+            queue_size
+        )
+        self.events: asyncio.Queue[Parsed | None] = asyncio.Queue(queue_size)
+        self.readable = asyncio.Event()
+        self.stopped = asyncio.Event()
+        self.stopping = threading.Event()
+        self.stages = {
+            "read": StageStats(),
+            "parse": StageStats(),
+            "write": StageStats(),
+        }
+
+    @property
+    def buffered(self) -> bool:
+        return bool(self.buffer_size or self.buffer_time)
+
+    def stop(self) -> None:
+        if not self.stopping.is_set():
+            LOG.info("stopping, flushing pending events")
+            self.halt()
+            self.stopped.set()
+
+    def halt(self) -> None:
+        """
+        Stop every follower, ending their threads within a polling interval.
+        """
+        self.stopping.set()
+        for source in list(self.sources.values()):
+            source.stopping.set()
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Queue depths and work done by each stage and file, as exported by the
+        pipeline metrics while running.
+        """
+        return {
+            "queues": {
+                "chunks": self.chunks.qsize(),
+                "events": self.events.qsize(),
+            },
+            "stages": {
+                name: {
+                    "items": stage.items,
+                    "busy": stage.busy,
+                    "blocked": stage.blocked,
+                    "average": stage.average,
+                    "slowest": stage.slowest,
+                }
+                for name, stage in self.stages.items()
+            },
+            "files": {
+                source.name: {
+                    "chunks": source.stats.chunks,
+                    "lines": source.stats.lines,
+                    "bytes": source.stats.bytes,
+                    "events": source.stats.events,
+                    "lag_bytes": source.stats.lag_bytes,
+                    "blocked": source.stats.blocked,
+                }
+                # may be called from the stats file writer's thread
+                for source in list(self.sources.values())
+            },
+        }
+
+    def log_stats(self) -> None:
+        LOG.info(
+            "queues: chunks=%d events=%d; %s",
+            self.chunks.qsize(),
+            self.events.qsize(),
+            "; ".join(
+                f"{name}: {stage.items} items, {stage.average * 1000:.1f}ms avg, "
+                f"{stage.slowest * 1000:.1f}ms max, {stage.blocked:.1f}s blocked"
+                for name, stage in self.stages.items()
+            ),
+        )
+        for source in self.sources.values():
+            stats = source.stats
+            LOG.info(
+                "%s: %d lines, %d events, %d bytes behind, %.1fs blocked%s",
+                source.name,
+                stats.lines,
+                stats.events,
+                stats.lag_bytes,
+                stats.blocked,
+                " (done)" if source.done else "",
+            )
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+
+        metrics.PIPELINE = self.stats
+        reporters = [asyncio.create_task(self.report())]
+        if self.stats_file:
+            reporters.append(asyncio.create_task(self.write_stats(self.stats_file)))
+        server = None
+        if self.metrics_port is not None:
+            server = await metrics.serve(self.metrics_host, self.metrics_port)
+
+        tasks = [
+            asyncio.create_task(stage)
+            for stage in (self.discover(), self.parse(), self.write())
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # make sure follower threads exit if any stage failed
+            self.halt()
+            for task in (*reporters, *tasks):
+                task.cancel()
+            if server:
+                server.close()
+            if self.stats_file:
+                await asyncio.to_thread(metrics.write_stats, self.stats_file)
+            metrics.PIPELINE = None
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(sig)
+            self.log_stats()
+
+    async def put(self, queue: "asyncio.Queue[Any]", item: Any, stage: str) -> None:
+        before = monotonic()
+        await queue.put(item)
+        self.stages[stage].blocked += monotonic() - before
+
+    def scan(self) -> list[Path]:
+        """
+        Files currently matching the given paths and patterns. Plain paths are
+        included even if they don't exist yet, and will be read once they do.
+        """
+        found: set[Path] = set()
+        for pattern in self.patterns:
+            if has_magic(pattern):
+                found.update(
+                    Path(match).resolve()
+                    for match in glob.glob(pattern)
+                    if os.path.isfile(match)
+                )
+            else:
+                found.add(Path(pattern).resolve())
+        rotations = {rotated_path(path) for path in found}
+        return sorted(found - rotations)
+
+    async def discover(self) -> None:
+        """
+        Start following every matching file, and keep looking for new ones until
+        stopped. Then wait for the readers to finish, and feed the parser until
+        every file is drained.
+        """
+        if sys.platform.startswith("linux"):
+            try:
+                self.inotify = Inotify()
+            except (AttributeError, OSError) as exc:
+                LOG.warning("inotify unavailable, polling instead: %s", exc)
+
+        readers: list[asyncio.Task[None]] = []
+        scheduler = asyncio.create_task(self.schedule())
+        stopped = asyncio.create_task(self.stopped.wait())
+        initial = True
+        try:
+            while True:
+                paths = await asyncio.to_thread(self.scan)
+                for path in paths:
+                    if path not in self.sources:
+                        source = await asyncio.to_thread(self.source, path, initial)
+                        self.sources[path] = source
+                        readers.append(asyncio.create_task(self.read(source)))
+                await asyncio.to_thread(self.retire, set(paths))
+                if initial and not paths:
+                    LOG.warning("no log files match %s", " ".join(self.patterns))
+                initial = False
+
+                done, _ = await asyncio.wait(
+                    (stopped, *readers),
+                    timeout=self.rescan_interval,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if stopped in done:
+                    break
+                # readers only finish early if following their file failed
+                for task in done:
+                    task.result()
+                readers = [task for task in readers if not task.done()]
+
+            await asyncio.gather(*readers)
+            self.stopped.set()
+            self.readable.set()
+            await scheduler
+        finally:
+            self.halt()
+            for task in (*readers, scheduler, stopped):
+                task.cancel()
+            if self.inotify is not None:
+                await asyncio.to_thread(self.inotify.close)
+
+    def retire(self, paths: set[Path]) -> None:
+        """
+        Stop following files that no longer match, once they've been missing for
+        longer than the grace period, so a rotation in progress isn't mistaken
+        for a deleted file. Their sources are removed once drained.
+        """
+        now = monotonic()
+        for path, source in list(self.sources.items()):
+            if path in paths or path.exists():
+                source.missing = None
+            elif source.missing is None:
+                source.missing = now
+            elif now - source.missing > self.grace and not source.stopping.is_set():
+                LOG.info("%s is gone, no longer following it", path)
+                source.stopping.set()
+
+    def source(self, path: Path, initial: bool) -> Source:
+        position: Position | None = None
+        if checkpoint := db.get_checkpoint(self.database, path):
+            position = Position(
+                checkpoint.device,
+                checkpoint.inode,
+                checkpoint.offset,
+                checkpoint.offset,
+            )
+        elif not initial:
+            # appeared since startup, so everything in it is new
+            with suppress(FileNotFoundError):
+                stat = os.stat(path)
+                position = Position(stat.st_dev, stat.st_ino, 0, 0)
+        LOG.info("following %s", path)
+        return Source(path, position)
+
+    async def read(self, source: Source) -> None:
+        stage = self.stages["read"]
+        stats = source.stats
+        loop = asyncio.get_running_loop()
+        if self.stopping.is_set():
+            source.stopping.set()
+        chunks = follow(
+            source.path,
+            source.position,
+            grace=self.grace,
+            stop=source.stopping,
+            inotify=self.inotify,
+        )
+        # followers block between reads, so each gets its own thread rather
+        # than tying up the default executor
+        with ThreadPoolExecutor(1, thread_name_prefix="nalax-follow") as executor:
+            try:
+                while True:
+                    chunk = await loop.run_in_executor(executor, next, chunks, None)
+                    if chunk is None:
+                        break
+                    # time spent reading is dominated by waiting for new data
+                    stage.items += 1
+                    stats.chunks += 1
+                    stats.lines += len(chunk.lines)
+                    metrics.LINES_READ.inc(len(chunk.lines), path=source.name)
+
+                    before = monotonic()
+                    await source.chunks.put(chunk)
+                    stats.blocked += monotonic() - before
+                    self.readable.set()
+            finally:
+                # if cancelled mid-read, the generator is still running in its
+                # thread, and will end on its own now that stopping is set
+                with suppress(ValueError):
+                    await loop.run_in_executor(executor, chunks.close)
+                await source.chunks.put(None)
+                self.readable.set()
+
+    async def schedule(self) -> None:
+        """
+        Hand chunks to the parser round-robin, taking at most one chunk from each
+        file per round, until every file is done.
+        """
+        try:
+            while True:
+                self.readable.clear()
+                for source in list(self.sources.values()):
+                    if source.done or source.chunks.empty():
+                        continue
+                    chunk = source.chunks.get_nowait()
+                    if chunk is None:
+                        source.done = True
+                        if source.stopping.is_set() and not self.stopping.is_set():
+                            # retired, see retire()
+                            del self.sources[source.path]
+                    else:
+                        await self.put(self.chunks, (source, chunk), "read")
+
+                if self.stopped.is_set() and all(
+                    source.done for source in self.sources.values()
+                ):
+                    break
+                if not self.readable.is_set() and not any(
+                    source.chunks.qsize() for source in self.sources.values()
+                ):
+                    await self.readable.wait()
+        finally:
+            await self.chunks.put(None)
+
+    async def parse(self) -> None:
+        stage = self.stages["parse"]
+        while (item := await self.chunks.get()) is not None:
+            source, chunk = item
+            before = monotonic()
+            events = await asyncio.to_thread(convert_chunk, chunk)
+            stage.record(monotonic() - before)
+            size = sum(len(line) + 1 for line in chunk.lines)
+            source.stats.bytes += size
+            source.stats.events += len(events)
+            # passed on even without events, so the writer knows it's caught up
+            position = Position(chunk.device, chunk.inode, chunk.end, chunk.size)
+            parsed = Parsed(source.name, chunk.received, size, events, position)
+            await self.put(self.events, parsed, "parse")
+        await self.events.put(None)
+
+    def ready(
+        self,
+        batch: list[Event],
+        size: int,
+        deadline: float | None,
+        positions: dict[str, Position],
+    ) -> bool:
+        if size >= self.buffer_bytes:
+            return True
+        if deadline is not None and monotonic() >= deadline:
+            return True
+
+        # keep batching while there's unread data, regardless of buffer settings
+        if len(batch) < CATCHUP_SIZE and any(
+            pos.offset < pos.size for pos in positions.values()
+        ):
+            return False
+
+        if not self.buffered:
+            return True
+        return bool(self.buffer_size) and len(batch) >= self.buffer_size
+
+    async def write(self) -> None:
+        stage = self.stages["write"]
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(1, thread_name_prefix="nalax-writer") as executor:
+            writer = await loop.run_in_executor(executor, db.Writer, self.database)
+
+            async def flush(
+                batch: list[Event], received: float, positions: dict[str, Position]
+            ) -> None:
+                checkpoints = [
+                    Checkpoint(path, pos.device, pos.inode, pos.offset)
+                    for path, pos in positions.items()
+                ]
+                before = monotonic()
+                if self.aggregate_inline:
+                    write = writer.merge_events
+                else:
+                    write = writer.insert_events
+                await loop.run_in_executor(executor, write, batch, checkpoints)
+                after = monotonic()
+                stage.record(after - before)
+
+                metrics.EVENTS_WRITTEN.inc(len(batch))
+                metrics.BATCH_SIZE.observe(len(batch))
+                metrics.COMMIT_SECONDS.observe(after - before)
+                metrics.LAG_SECONDS.set(after - received)
+                for source in self.sources.values():
+                    if pos := positions.get(source.name):
+                        source.stats.lag_bytes = max(0, pos.size - pos.offset)
+                        metrics.LAG_BYTES.set(source.stats.lag_bytes, path=source.name)
+
+                if self.buffered:
+                    LOG.info("recorded %d events", len(batch))
+                else:
+                    sys.stdout.write("." * len(batch))
+                    sys.stdout.flush()
+
+            try:
+                batch: list[Event] = []
+                # latest position of each file in the batch, for its checkpoint
+                positions: dict[str, Position] = {}
+                size = 0
+                received = 0.0
+                deadline: float | None = None
+                getter: asyncio.Future[Parsed | None] | None = None
+                done = False
+
+                while not done:
+                    if getter is None:
+                        getter = asyncio.ensure_future(self.events.get())
+                    timeout = None
+                    if batch and deadline is not None:
+                        timeout = max(0.0, deadline - monotonic())
+                    await asyncio.wait((getter,), timeout=timeout)
+
+                    if getter.done():
+                        parsed = getter.result()
+                        getter = None
+                        if parsed is None:
+                            done = True
+                        else:
+                            # measured from when the oldest line was read, so
+                            # time spent queued counts against the buffer time
+                            if parsed.events and not batch:
+                                received = parsed.received
+                                if self.buffer_time:
+                                    deadline = received + self.buffer_time
+                            batch.extend(parsed.events)
+                            size += parsed.size
+                            positions[parsed.path] = parsed.position
+
+                    if batch and (done or self.ready(batch, size, deadline, positions)):
+                        await flush(batch, received, positions)
+                        batch = []
+                        positions = {}
+                        size = 0
+                        deadline = None
+
+            finally:
+                await loop.run_in_executor(executor, writer.close)
+
+    async def report(self) -> None:
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            self.log_stats()
+
+    async def write_stats(self, path: Path) -> None:
+        while True:
+            await asyncio.to_thread(metrics.write_stats, path)
+            await asyncio.sleep(self.stats_interval)
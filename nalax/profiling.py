@@ -0,0 +1,139 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+import logging
+import threading
+from contextlib import AbstractContextManager, nullcontext
+from dataclasses import dataclass
+from pathlib import Path
+from time import perf_counter
+from typing import Any, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import cProfile
+
+LOG = logging.getLogger(__name__)
+
+MODES = ("cprofile", "tracemalloc")
+SUFFIXES = {"cprofile": ".pstats", "tracemalloc": ".tracemalloc"}
+TRACEMALLOC_FRAMES = 16
+
+ENABLED = False
+LOCK = threading.Lock()
+
+
+@dataclass
+class SpanStats:
+    calls: int = 0
+    total: float = 0.0
+    slowest: float = 0.0
+
+    @property
+    def average(self) -> float:
+        return self.total / self.calls if self.calls else 0.0
+
+
+SPANS: dict[str, SpanStats] = {}
+
+
+class Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self) -> "Span":
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        elapsed = perf_counter() - self.start
+        with LOCK:
+            stats = SPANS.get(self.name)
+            if stats is None:
+                stats = SPANS[self.name] = SpanStats()
+            stats.calls += 1
+            stats.total += elapsed
+            stats.slowest = max(stats.slowest, elapsed)
+
+
+NULL_SPAN: AbstractContextManager[Any] = nullcontext()
+
+
+def span(name: str) -> AbstractContextManager[Any]:
+    """
+    Time a block of code under `name` while profiling is enabled.
+    Otherwise returns a shared no-op context manager, so spans can stay in hot
+    paths without measurable cost.
+    """
+    if ENABLED:
+        return Span(name)
+    return NULL_SPAN
+
+
+def summary() -> str:
+    """
+    Timing spans recorded so far, largest total first. Nested spans are
+    inclusive, so `tail.convert` includes the lookups it performs.
+    """
+    with LOCK:
+        spans = sorted(SPANS.items(), key=lambda item: item[1].total, reverse=True)
+    lines = [
+        f"{'span':<24} {'calls':>10} {'total s':>10} {'avg ms':>10} {'max ms':>10}"
+    ]
+    for name, stats in spans:
+        lines.append(
+            f"{name:<24} {stats.calls:>10} {stats.total:>10.3f} "
+            f"{stats.average * 1000:>10.3f} {stats.slowest * 1000:>10.3f}"
+        )
+    return "\n".join(lines)
+
+
+class Profiler:
+    """
+    Profile a command with cProfile, saving pstats, or with tracemalloc, saving
+    an allocation snapshot. Timing spans are recorded in either mode.
+
+    cProfile only sees the thread that started it, so for `tail` most of the
+    work shows up in the spans rather than the pstats. Neither sees the worker
+    processes that `ingest` converts logs in.
+    """
+
+    def __init__(self, mode: str, output: Path) -> None:
+        if mode not in MODES:
+            raise ValueError(f"unknown profile mode {mode!r}")
+        self.mode = mode
+        self.output = output
+        self.profile: "cProfile.Profile | None" = None
+
+    def start(self) -> None:
+        global ENABLED
+
+        # profilers are only imported when asked for, to keep startup fast
+        import cProfile
+        import tracemalloc
+
+        with LOCK:
+            SPANS.clear()
+        ENABLED = True
+        if self.mode == "cprofile":
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    def stop(self) -> None:
+        global ENABLED
+
+        import tracemalloc
+
+        ENABLED = False
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.output)
+            self.profile = None
+        elif tracemalloc.is_tracing():
+            tracemalloc.take_snapshot().dump(str(self.output))
+            tracemalloc.stop()
+        LOG.info("wrote %s profile to %s", self.mode, self.output)
@@ -0,0 +1,414 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+import csv
+import datetime
+import io
+import json
+import logging
+import sqlite3 as sqlite
+import time
+from calendar import monthrange
+from pathlib import Path
+from typing import Any, NamedTuple, Sequence
+
+from . import db
+from .types import Retention
+
+LOG = logging.getLogger(__name__)
+
+# dimension: rollup tables it is counted in
+DIMENSIONS = {
+    "path": "pages",
+    "region": "users",
+    "device": "users",
+    "os": "users",
+    "browser": "users",
+}
+FORMATS = ("table", "json", "csv")
+TOP = 20
+CACHE_TTL = 7 * db.DAY_SECONDS
+
+
+class Segment(NamedTuple):
+    """
+    Inclusive date range to read from one rollup period, as (year, month[, day])
+    bounds matching the leading date columns of that period's tables. Weekly
+    bounds are the days weeks start on.
+    """
+
+    period: str
+    lo: tuple[int, ...]
+    hi: tuple[int, ...]
+
+    def span(self) -> tuple[datetime.date | None, datetime.date]:
+        """
+        First and last day covered, with None for an open start.
+        """
+        if len(self.lo) == 2:
+            first = datetime.date(*self.lo, 1) if self.lo != (0, 0) else None
+            year, month = self.hi
+            return first, datetime.date(year, month, monthrange(year, month)[1])
+        first, last = datetime.date(*self.lo), datetime.date(*self.hi)
+        if self.period == "weekly":
+            last += datetime.timedelta(days=6)
+        return first, last
+
+
+class Query(NamedTuple):
+    sql: str
+    params: tuple[Any, ...]
+    # the range actually covered, wider than asked for when days are pruned
+    since: datetime.date | None
+    until: datetime.date
+
+
+def segments(
+    since: datetime.date | None,
+    until: datetime.date,
+    retention: Retention = Retention(),
+) -> list[Segment]:
+    """
+    Split a date range into whole months, read from the monthly tables, and
+    partial months at either end, read from the daily tables.
+
+    Where the partial months reach back past the days still kept in the daily
+    tables, those days come from whole weeks in the weekly tables instead, or
+    the whole month from the monthly tables, widening the range to match.
+    """
+    result: list[Segment] = []
+
+    if since is None:
+        start = None
+    elif since.day == 1:
+        start = since
+    else:
+        end = since.replace(day=monthrange(since.year, since.month)[1])
+        if end >= until:
+            result = [Segment("daily", date_key(since), date_key(until))]
+            return covered(result, since, until, retention)
+        result.append(Segment("daily", date_key(since), date_key(end)))
+        start = end + datetime.timedelta(days=1)
+
+    # last day covered by whole months
+    if until.day == monthrange(until.year, until.month)[1]:
+        last = until
+    else:
+        last = until.replace(day=1) - datetime.timedelta(days=1)
+
+    if start is None or start <= last:
+        lo = (start.year, start.month) if start else (0, 0)
+        result.append(Segment("monthly", lo, (last.year, last.month)))
+
+    if last < until:
+        first = last + datetime.timedelta(days=1)
+        if since is not None:
+            first = max(first, since)
+        result.append(Segment("daily", date_key(first), date_key(until)))
+
+    return covered(result, since, until, retention)
+
+
+def covered(
+    result: list[Segment],
+    since: datetime.date | None,
+    until: datetime.date,
+    retention: Retention,
+) -> list[Segment]:
+    if retention.daily is None:
+        return result
+    return [part for seg in result for part in cover(seg, since, until, retention)]
+
+
+def cover(
+    segment: Segment,
+    since: datetime.date | None,
+    until: datetime.date,
+    retention: Retention,
+) -> list[Segment]:
+    """
+    Replace the pruned days of a daily segment with coarser segments. Those may
+    only reach past the segment's ends at the ends of the whole range, where no
+    other segment reads the extra days.
+    """
+    assert retention.daily is not None
+    first, last = segment.span()
+    if segment.period != "daily" or first is None or first >= retention.daily:
+        return [segment]
+
+    pruned = min(last, retention.daily - datetime.timedelta(days=1))
+    monday = datetime.date(*db.week_start(*date_key(first)))
+    final = datetime.date(*db.week_start(*date_key(pruned)))
+    sunday = final + datetime.timedelta(days=6)
+    kept = retention.weekly is None or monday >= retention.weekly
+    lower = monday == first or first == since
+    upper = sunday <= last or last == until
+    if kept and lower and upper:
+        parts = [Segment("weekly", date_key(monday), date_key(final))]
+        if sunday < last:
+            after = sunday + datetime.timedelta(days=1)
+            parts.append(Segment("daily", date_key(after), date_key(last)))
+        return parts
+
+    # daily segments never span months, so this only widens at the range's ends
+    return [Segment("monthly", (first.year, first.month), (first.year, first.month))]
+
+
+def date_key(date: datetime.date) -> tuple[int, int, int]:
+    return date.year, date.month, date.day
+
+
+def build_query(
+    by: str,
+    host: str | None = None,
+    since: datetime.date | None = None,
+    until: datetime.date | None = None,
+    top: int = TOP,
+    retention: Retention = Retention(),
+) -> Query:
+    """
+    Top values of one dimension by count, summed across the rollup tables for
+    the given host and date range. Pass the database's `db.get_retention` to
+    read days pruned from the daily tables from coarser ones.
+
+    Each part of the query filters on host and a (year, month[, day]) range, and
+    reads only the dimension and count, so it is answered entirely from the
+    matching covering report index.
+    """
+    if by not in DIMENSIONS:
+        raise ValueError(f"unknown report dimension {by!r}")
+    if until is None:
+        until = datetime.datetime.now(datetime.timezone.utc).date()
+    if since is not None and since > until:
+        raise ValueError(f"since {since} is after until {until}")
+
+    parts: list[str] = []
+    params: list[Any] = []
+    chosen = segments(since, until, retention)
+    for segment in chosen:
+        columns = ", ".join(
+            f"`{name}`" for name in ("year", "month", "day")[: len(segment.lo)]
+        )
+        marks = ", ".join("?" for _ in segment.lo)
+        where = f"({columns}) between ({marks}) and ({marks})"
+        if host is not None:
+            where = f"`host` = ? and {where}"
+            params.append(host)
+        params.extend(segment.lo)
+        params.extend(segment.hi)
+        parts.append(
+            f"""
+            select `{by}` as `value`, `count`
+            from `nalax_{segment.period}_{DIMENSIONS[by]}`
+            where {where}
+            """
+        )
+
+    union = "union all".join(parts)
+    sql = f"""
+        select `value`, sum(`count`) as `total`
+        from ({union})
+        group by `value`
+        order by `total` desc, `value`
+        limit ?
+    """
+    params.append(top)
+
+    spans = [segment.span() for segment in chosen]
+    first = None if since is None else min(lo for lo, _ in spans if lo is not None)
+    last = max(hi for _, hi in spans)
+    if (first, last) != (since, until):
+        LOG.warning(
+            "daily stats before %s have been pruned, so this report covers %s to %s",
+            retention.daily,
+            first or "the beginning",
+            last,
+        )
+    return Query(sql, tuple(params), first, last)
+
+
+def explain(conn: sqlite.Connection, query: Query) -> list[str]:
+    """
+    The query plan for a report query, one indented line per step.
+    """
+    depth: dict[int, int] = {0: 0}
+    lines: list[str] = []
+    for node, parent, _, detail in conn.execute(
+        f"explain query plan {query.sql}", query.params
+    ):
+        depth[node] = depth.get(parent, 0) + 1
+        lines.append("  " * (depth[node] - 1) + detail)
+    return lines
+
+
+def run(database: Path, query: Query) -> list[tuple[str, int]]:
+    with db.connect(database) as conn:
+        return [
+            (value, total) for value, total in conn.execute(query.sql, query.params)
+        ]
+
+
+def cache_key(
+    by: str,
+    host: str | None,
+    since: datetime.date | None,
+    until: datetime.date,
+    top: int,
+) -> str:
+    return json.dumps(
+        [by, host, since.isoformat() if since else None, until.isoformat(), top]
+    )
+
+
+def cached_result(
+    conn: sqlite.Connection,
+    key: str,
+    host: str | None,
+    since: datetime.date | None,
+    until: datetime.date,
+) -> list[tuple[str, int]] | None:
+    """
+    A cached report, unless stats for any host/day it covers have been changed
+    by an aggregation generation newer than the one it was built from.
+    Only reads the small cache and generation tables.
+    """
+    query = """
+        select `generation`, `result` from `nalax_report_cache` where `key` = ?
+    """
+    row = conn.execute(query, (key,)).fetchone()
+    if row is None:
+        return None
+    generation, result = row
+
+    query = """
+        select 1 from `nalax_generations`
+        where `generation` > ?
+            and (`year`, `month`, `day`) between (?, ?, ?) and (?, ?, ?)
+    """
+    params: tuple[Any, ...] = (
+        generation,
+        *(date_key(since) if since else (0, 0, 0)),
+        *date_key(until),
+    )
+    if host is not None:
+        query += " and `host` = ?"
+        params += (host,)
+    if conn.execute(query + " limit 1", params).fetchone():
+        return None
+
+    return [(value, total) for value, total in json.loads(result)]
+
+
+def current_generation(conn: sqlite.Connection) -> int:
+    query = "select coalesce(max(`generation`), 0) from `nalax_generations`"
+    return int(conn.execute(query).fetchone()[0])
+
+
+def store_result(
+    conn: sqlite.Connection,
+    key: str,
+    generation: int,
+    rows: Sequence[tuple[str, int]],
+) -> None:
+    now = int(time.time())
+    with conn:
+        conn.execute(
+            """
+            insert into `nalax_report_cache`
+                (`key`, `generation`, `timestamp`, `result`)
+                values (?, ?, ?, ?)
+                on conflict(`key`) do update set
+                    `generation` = excluded.generation,
+                    `timestamp` = excluded.timestamp,
+                    `result` = excluded.result
+            """,
+            (key, generation, now, json.dumps(rows)),
+        )
+        conn.execute(
+            "delete from `nalax_report_cache` where `timestamp` < ?",
+            (now - CACHE_TTL,),
+        )
+
+
+def read(
+    conn: sqlite.Connection,
+    query: Query,
+    key: str | None,
+    host: str | None,
+    since: datetime.date | None,
+    until: datetime.date,
+) -> tuple[list[tuple[str, int]], int | None]:
+    """
+    Run a report query, serving it from the report cache when `key` is given and
+    the entry is still valid. Returns the rows, along with the generation to cache
+    them under if they were freshly built.
+    """
+    # read the generation and the stats from the same snapshot
+    conn.execute("begin")
+    try:
+        if key is not None:
+            rows = cached_result(conn, key, host, since, until)
+            if rows is not None:
+                LOG.debug("report cache hit for %s", key)
+                return rows, None
+
+        generation = current_generation(conn)
+        rows = [
+            (value, total) for value, total in conn.execute(query.sql, query.params)
+        ]
+        return rows, generation
+    finally:
+        conn.commit()
+
+
+def report(
+    database: Path,
+    by: str,
+    host: str | None = None,
+    since: datetime.date | None = None,
+    until: datetime.date | None = None,
+    top: int = TOP,
+    *,
+    cache: bool = True,
+) -> list[tuple[str, int]]:
+    """
+    Run a report, serving it from the report cache when still valid, and
+    caching fresh results along with the generation they were built from.
+    """
+    until = until or datetime.datetime.now(datetime.timezone.utc).date()
+    conn = db.connect(database)
+    conn.execute(f"pragma busy_timeout = {db.BUSY_TIMEOUT_MS}")
+    try:
+        retention = db.get_retention(conn)
+        query = build_query(by, host, since, until, top, retention=retention)
+        if not cache:
+            rows, _ = read(conn, query, None, host, since, until)
+            return rows
+
+        key = cache_key(by, host, since, until, top)
+        rows, generation = read(conn, query, key, host, query.since, query.until)
+        if generation is not None:
+            store_result(conn, key, generation, rows)
+        return rows
+    finally:
+        conn.close()
+
+
+def render(rows: Sequence[tuple[str, int]], by: str, fmt: str) -> str:
+    if fmt == "json":
+        return json.dumps([{by: value, "count": total} for value, total in rows])
+
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow((by, "count"))
+        writer.writerows(rows)
+        return buffer.getvalue().rstrip("\n")
+
+    if fmt == "table":
+        width = max([len("count"), *(len(str(total)) for _, total in rows)])
+        lines = [f"{'count':>{width}}  {by}"]
+        lines.extend(f"{total:>{width}}  {value}" for value, total in rows)
+        return "\n".join(lines)
+
+    raise ValueError(f"unknown report format {fmt!r}")
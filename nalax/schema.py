@@ -74,6 +74,336 @@ SCHEMA: dict[int, str] = {
                 `network`, `device`, `os`, `browser`
             )
     """,
+    7: """
+        create table if not exists `nalax_checkpoints` (
+            `path` text primary key,
+            `device` int,
+            `inode` int,
+            `offset` int,
+            `timestamp` int
+        )
+    """,
+    8: """
+        create index if not exists `idx_nalax_events_timestamp`
+            on `nalax_events` (`timestamp`)
+    """,
+    9: """
+        create table if not exists `nalax_weekly_pages` (
+            `year` int,
+            `month` int,
+            `day` int,
+            `host` text,
+            `path` text,
+            `method` text,
+            `count` int
+        )
+    """,
+    10: """
+        create unique index `idx_unique_nalax_weekly_pages`
+            on `nalax_weekly_pages` (`year`, `month`, `day`, `host`, `path`, `method`)
+    """,
+    11: """
+        create table if not exists `nalax_weekly_users` (
+            `year` int,
+            `month` int,
+            `day` int,
+            `host` text,
+            `region` text,
+            `network` text,
+            `device` text,
+            `os` text,
+            `browser` text,
+            `count` int
+        )
+    """,
+    12: """
+        create unique index `idx_unique_nalax_weekly_users`
+            on `nalax_weekly_users` (
+                `year`, `month`, `day`, `host`, `region`,
+                `network`, `device`, `os`, `browser`
+            )
+    """,
+    13: """
+        create table if not exists `nalax_monthly_pages` (
+            `year` int,
+            `month` int,
+            `host` text,
+            `path` text,
+            `method` text,
+            `count` int
+        )
+    """,
+    14: """
+        create unique index `idx_unique_nalax_monthly_pages`
+            on `nalax_monthly_pages` (`year`, `month`, `host`, `path`, `method`)
+    """,
+    15: """
+        create table if not exists `nalax_monthly_users` (
+            `year` int,
+            `month` int,
+            `host` text,
+            `region` text,
+            `network` text,
+            `device` text,
+            `os` text,
+            `browser` text,
+            `count` int
+        )
+    """,
+    16: """
+        create unique index `idx_unique_nalax_monthly_users`
+            on `nalax_monthly_users` (
+                `year`, `month`, `host`, `region`,
+                `network`, `device`, `os`, `browser`
+            )
+    """,
+    # backfill weekly and monthly rollups from existing daily stats;
+    # weeks are keyed by the date of their monday
+    17: """
+        insert into `nalax_weekly_pages`
+            (`year`, `month`, `day`, `host`, `path`, `method`, `count`)
+        select
+            cast(strftime('%Y', `week`) as int),
+            cast(strftime('%m', `week`) as int),
+            cast(strftime('%d', `week`) as int),
+            `host`, `path`, `method`, sum(`count`)
+        from (
+            select
+                date(
+                    printf('%04d-%02d-%02d', `year`, `month`, `day`),
+                    '-6 days',
+                    'weekday 1'
+                ) as `week`,
+                `host`, `path`, `method`, `count`
+            from `nalax_daily_pages`
+        )
+        group by `week`, `host`, `path`, `method`
+    """,
+    18: """
+        insert into `nalax_weekly_users`
+            (
+                `year`, `month`, `day`, `host`, `region`,
+                `network`, `device`, `os`, `browser`, `count`
+            )
+        select
+            cast(strftime('%Y', `week`) as int),
+            cast(strftime('%m', `week`) as int),
+            cast(strftime('%d', `week`) as int),
+            `host`, `region`, `network`, `device`, `os`, `browser`, sum(`count`)
+        from (
+            select
+                date(
+                    printf('%04d-%02d-%02d', `year`, `month`, `day`),
+                    '-6 days',
+                    'weekday 1'
+                ) as `week`,
+                `host`, `region`, `network`, `device`, `os`, `browser`, `count`
+            from `nalax_daily_users`
+        )
+        group by `week`, `host`, `region`, `network`, `device`, `os`, `browser`
+    """,
+    19: """
+        insert into `nalax_monthly_pages`
+            (`year`, `month`, `host`, `path`, `method`, `count`)
+        select `year`, `month`, `host`, `path`, `method`, sum(`count`)
+        from `nalax_daily_pages`
+        group by `year`, `month`, `host`, `path`, `method`
+    """,
+    20: """
+        insert into `nalax_monthly_users`
+            (
+                `year`, `month`, `host`, `region`,
+                `network`, `device`, `os`, `browser`, `count`
+            )
+        select
+            `year`, `month`, `host`, `region`,
+            `network`, `device`, `os`, `browser`, sum(`count`)
+        from `nalax_daily_users`
+        group by
+            `year`, `month`, `host`, `region`, `network`, `device`, `os`, `browser`
+    """,
+    # covering indexes for reports: filter on host and date range, group by one
+    # dimension, and sum counts without touching the table itself
+    21: """
+        create index if not exists `idx_nalax_daily_pages_report_path`
+            on `nalax_daily_pages` (`host`, `year`, `month`, `day`, `path`, `count`)
+    """,
+    22: """
+        create index if not exists `idx_nalax_daily_users_report_region`
+            on `nalax_daily_users` (`host`, `year`, `month`, `day`, `region`, `count`)
+    """,
+    23: """
+        create index if not exists `idx_nalax_daily_users_report_device`
+            on `nalax_daily_users` (`host`, `year`, `month`, `day`, `device`, `count`)
+    """,
+    24: """
+        create index if not exists `idx_nalax_daily_users_report_os`
+            on `nalax_daily_users` (`host`, `year`, `month`, `day`, `os`, `count`)
+    """,
+    25: """
+        create index if not exists `idx_nalax_daily_users_report_browser`
+            on `nalax_daily_users` (`host`, `year`, `month`, `day`, `browser`, `count`)
+    """,
+    26: """
+        create index if not exists `idx_nalax_monthly_pages_report_path`
+            on `nalax_monthly_pages` (`host`, `year`, `month`, `path`, `count`)
+    """,
+    27: """
+        create index if not exists `idx_nalax_monthly_users_report_region`
+            on `nalax_monthly_users` (`host`, `year`, `month`, `region`, `count`)
+    """,
+    28: """
+        create index if not exists `idx_nalax_monthly_users_report_device`
+            on `nalax_monthly_users` (`host`, `year`, `month`, `device`, `count`)
+    """,
+    29: """
+        create index if not exists `idx_nalax_monthly_users_report_os`
+            on `nalax_monthly_users` (`host`, `year`, `month`, `os`, `count`)
+    """,
+    30: """
+        create index if not exists `idx_nalax_monthly_users_report_browser`
+            on `nalax_monthly_users` (`host`, `year`, `month`, `browser`, `count`)
+    """,
+    31: """
+        create table if not exists `nalax_generations` (
+            `host` text,
+            `year` int,
+            `month` int,
+            `day` int,
+            `generation` int,
+            primary key (`host`, `year`, `month`, `day`)
+        )
+    """,
+    32: """
+        create index if not exists `idx_nalax_generations_generation`
+            on `nalax_generations` (`generation`)
+    """,
+    33: """
+        create table if not exists `nalax_report_cache` (
+            `key` text primary key,
+            `generation` int,
+            `timestamp` int,
+            `result` text
+        )
+    """,
+    # intern repeated event text as small per-kind ids, see db.Dimensions
+    34: """
+        create table if not exists `nalax_dimensions` (
+            `kind` text,
+            `id` int,
+            `value` text,
+            primary key (`kind`, `id`)
+        ) without rowid
+    """,
+    35: """
+        create unique index if not exists `idx_unique_nalax_dimensions_value`
+            on `nalax_dimensions` (`kind`, `value`)
+    """,
+    36: """
+        insert or ignore into `nalax_dimensions` (`kind`, `id`, `value`)
+        select
+            `kind`,
+            row_number() over (partition by `kind` order by `value`),
+            `value`
+        from (
+            select 'host' as `kind`, `host` as `value` from `nalax_events`
+            union select 'path', `path` from `nalax_events`
+            union select 'method', `method` from `nalax_events`
+            union select 'region', `region` from `nalax_events`
+            union select 'network', `network` from `nalax_events`
+            union select 'device', `device` from `nalax_events`
+            union select 'os', `os` from `nalax_events`
+            union select 'browser', `browser` from `nalax_events`
+        )
+    """,
+    37: """
+        create table if not exists `nalax_events_encoded` (
+            `timestamp` int,
+            `host` int,
+            `path` int,
+            `method` int,
+            `status` int,
+            `region` int,
+            `network` int,
+            `device` int,
+            `os` int,
+            `browser` int
+        )
+    """,
+    38: """
+        insert into `nalax_events_encoded`
+        select
+            e.`timestamp`, h.`id`, p.`id`, m.`id`, e.`status`,
+            r.`id`, n.`id`, d.`id`, o.`id`, b.`id`
+        from `nalax_events` e
+        join `nalax_dimensions` h on h.`kind` = 'host' and h.`value` = e.`host`
+        join `nalax_dimensions` p on p.`kind` = 'path' and p.`value` = e.`path`
+        join `nalax_dimensions` m on m.`kind` = 'method' and m.`value` = e.`method`
+        join `nalax_dimensions` r on r.`kind` = 'region' and r.`value` = e.`region`
+        join `nalax_dimensions` n
+            on n.`kind` = 'network' and n.`value` = e.`network`
+        join `nalax_dimensions` d on d.`kind` = 'device' and d.`value` = e.`device`
+        join `nalax_dimensions` o on o.`kind` = 'os' and o.`value` = e.`os`
+        join `nalax_dimensions` b
+            on b.`kind` = 'browser' and b.`value` = e.`browser`
+        order by e.rowid
+    """,
+    39: """
+        drop table `nalax_events`
+    """,
+    40: """
+        alter table `nalax_events_encoded` rename to `nalax_events`
+    """,
+    41: """
+        create index if not exists `idx_nalax_events_timestamp`
+            on `nalax_events` (`timestamp`)
+    """,
+    # new events go to per-day partitions, see db.partition_name; dropping an
+    # aggregated partition frees its pages, and this returns them to the disk
+    42: """
+        pragma auto_vacuum = incremental
+    """,
+    43: """
+        vacuum
+    """,
+    # how far back the daily and weekly tables still go, see db.prune_rollups
+    44: """
+        create table if not exists `nalax_retention` (
+            `period` text primary key,
+            `year` int,
+            `month` int,
+            `day` int
+        )
+    """,
+    # unused ids deleted from nalax_dimensions, see db.sweep_dimensions
+    45: """
+        create table if not exists `nalax_dimension_sweeps` (
+            `sweep` integer primary key,
+            `timestamp` int,
+            `deleted` int
+        )
+    """,
+    # covering indexes for the weeks reports read where daily stats were pruned
+    46: """
+        create index if not exists `idx_nalax_weekly_pages_report_path`
+            on `nalax_weekly_pages` (`host`, `year`, `month`, `day`, `path`, `count`)
+    """,
+    47: """
+        create index if not exists `idx_nalax_weekly_users_report_region`
+            on `nalax_weekly_users` (`host`, `year`, `month`, `day`, `region`, `count`)
+    """,
+    48: """
+        create index if not exists `idx_nalax_weekly_users_report_device`
+            on `nalax_weekly_users` (`host`, `year`, `month`, `day`, `device`, `count`)
+    """,
+    49: """
+        create index if not exists `idx_nalax_weekly_users_report_os`
+            on `nalax_weekly_users` (`host`, `year`, `month`, `day`, `os`, `count`)
+    """,
+    50: """
+        create index if not exists `idx_nalax_weekly_users_report_browser`
+            on `nalax_weekly_users` (`host`, `year`, `month`, `day`, `browser`, `count`)
+    """,
 }
 
 for key in SCHEMA:
@@ -0,0 +1,270 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+import asyncio
+import datetime
+import json
+import logging
+import queue
+import signal
+import sqlite3 as sqlite
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http import HTTPStatus
+from pathlib import Path
+from typing import Any, Generator
+from urllib.parse import parse_qs, urlsplit
+
+from . import db, report
+
+LOG = logging.getLogger(__name__)
+
+HOST = "127.0.0.1"
+PORT = 8080
+WORKERS = 4
+MAX_HEADER_BYTES = 16 << 10
+IDLE_TIMEOUT = 30.0
+
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: str = "") -> None:
+        super().__init__(message or status.phrase)
+        self.status = status
+
+
+class ConnectionPool:
+    """
+    Fixed pool of read-only SQLite connections, shared by worker threads.
+
+    The database is switched to WAL mode once up front, so readers never block,
+    and are never blocked by, a running tail or aggregate.
+    """
+
+    def __init__(self, database: Path, size: int = WORKERS) -> None:
+        with db.connect(database) as conn:
+            conn.execute("pragma journal_mode = wal")
+
+        self.connections: queue.SimpleQueue[sqlite.Connection] = queue.SimpleQueue()
+        for _ in range(size):
+            conn = sqlite.connect(
+                f"{database.resolve().as_uri()}?mode=ro",
+                uri=True,
+                check_same_thread=False,
+            )
+            conn.execute(f"pragma busy_timeout = {db.BUSY_TIMEOUT_MS}")
+            conn.execute(f"pragma cache_size = {db.CACHE_SIZE_KB}")
+            self.connections.put(conn)
+        self.size = size
+
+    @contextmanager
+    def connection(self) -> Generator[sqlite.Connection, None, None]:
+        conn = self.connections.get()
+        try:
+            yield conn
+        finally:
+            self.connections.put(conn)
+
+    def close(self) -> None:
+        for _ in range(self.size):
+            self.connections.get().close()
+
+
+def parse_date(params: dict[str, list[str]], name: str) -> datetime.date | None:
+    if name not in params:
+        return None
+    try:
+        return datetime.date.fromisoformat(params[name][-1])
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"invalid {name}, expected YYYY-MM-DD")
+
+
+class Server:
+    """
+    Local HTTP server answering report queries as JSON.
+
+    Requests are parsed on the event loop, while queries run on a thread pool
+    with one pooled read-only connection per worker. Endpoints:
+
+    - `GET /report?by=path&host=...&since=YYYY-MM-DD&until=YYYY-MM-DD&top=20`
+    - `GET /health`
+    """
+
+    def __init__(
+        self,
+        database: Path,
+        host: str = HOST,
+        port: int = PORT,
+        *,
+        workers: int = WORKERS,
+    ) -> None:
+        self.database = database
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.pool: ConnectionPool | None = None
+        self.executor: ThreadPoolExecutor | None = None
+        self.server: asyncio.Server | None = None
+
+    async def start(self) -> None:
+        self.pool = ConnectionPool(self.database, self.workers)
+        self.executor = ThreadPoolExecutor(
+            self.workers, thread_name_prefix="nalax-serve"
+        )
+        self.server = await asyncio.start_server(
+            self.handle, self.host, self.port, limit=MAX_HEADER_BYTES
+        )
+        # pick up the real port when asked to bind port 0
+        self.port = self.server.sockets[0].getsockname()[1]
+        LOG.info("serving reports on http://%s:%d", self.host, self.port)
+
+    async def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.executor is not None:
+            self.executor.shutdown()
+        if self.pool is not None:
+            self.pool.close()
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stopping.set)
+
+        await self.start()
+        try:
+            await stopping.wait()
+        finally:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(sig)
+            await self.close()
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(
+                        reader.readuntil(b"\r\n\r\n"), IDLE_TIMEOUT
+                    )
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self.respond(
+                        writer,
+                        HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE,
+                        {"error": "request headers too large"},
+                        keep_alive=False,
+                    )
+                    break
+
+                request, *header_lines = head.decode("latin-1").split("\r\n")
+                headers: dict[str, str] = {}
+                for line in header_lines:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip().lower()
+
+                try:
+                    method, target, version = request.split(" ")
+                except ValueError:
+                    method, target, version = "", "", "HTTP/1.0"
+
+                keep_alive = version == "HTTP/1.1"
+                if "connection" in headers:
+                    keep_alive = headers["connection"] == "keep-alive"
+
+                status = HTTPStatus.OK
+                try:
+                    body = await self.dispatch(method, target)
+                except HTTPError as exc:
+                    status = exc.status
+                    body = {"error": str(exc)}
+                except Exception:
+                    LOG.exception("failed to serve %s %s", method, target)
+                    status = HTTPStatus.INTERNAL_SERVER_ERROR
+                    body = {"error": status.phrase}
+
+                LOG.debug("%s %s -> %d", method, target, status)
+                await self.respond(writer, status, body, keep_alive=keep_alive)
+                if not keep_alive:
+                    break
+
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def respond(
+        self,
+        writer: asyncio.StreamWriter,
+        status: HTTPStatus,
+        body: Any,
+        *,
+        keep_alive: bool,
+    ) -> None:
+        content = json.dumps(body).encode()
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(content)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            "\r\n"
+        )
+        writer.write(head.encode("latin-1") + content)
+        await writer.drain()
+
+    async def dispatch(self, method: str, target: str) -> Any:
+        if method != "GET":
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+
+        if url.path == "/health":
+            return {"ok": True}
+
+        if url.path == "/report":
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, self.report, params)
+
+        raise HTTPError(HTTPStatus.NOT_FOUND)
+
+    def report(self, params: dict[str, list[str]]) -> Any:
+        """
+        Run a report query on a worker thread. Valid cached reports are served
+        from the report cache, but fresh results aren't stored, since the pool
+        is read-only.
+        """
+        assert self.pool is not None
+
+        by = params.get("by", ["path"])[-1]
+        host = params["host"][-1] if "host" in params else None
+        since = parse_date(params, "since")
+        until = parse_date(params, "until")
+        until = until or datetime.datetime.now(datetime.timezone.utc).date()
+        try:
+            top = int(params.get("top", [report.TOP])[-1])
+        except ValueError as exc:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(exc))
+
+        key = report.cache_key(by, host, since, until, top)
+        with self.pool.connection() as conn:
+            retention = db.get_retention(conn)
+            try:
+                query = report.build_query(
+                    by, host, since, until, top, retention=retention
+                )
+            except ValueError as exc:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, str(exc))
+            rows, _ = report.read(conn, query, key, host, query.since, query.until)
+
+        # the range actually covered, if pruning widened it
+        return {
+            "by": by,
+            "host": host,
+            "since": query.since.isoformat() if query.since else None,
+            "until": query.until.isoformat(),
+            "rows": [{by: value, "count": total} for value, total in rows],
+        }
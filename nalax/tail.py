@@ -1,37 +1,47 @@
 # Copyright Amethyst Reese
 # Licensed under the MIT license
 
-import json
 import logging
-import shlex
-import subprocess
 from pathlib import Path
-from typing import Generator
+from typing import Generator, Sequence
 from urllib.parse import urlparse
 
-import arrow
-from rich import print
-
-from . import iplookup
+from . import iplookup, metrics, profiling, timestamps
 from .agent import user_agent
-from .types import Event
+from .follow import Chunk, follow
+from .formats import parse
+from .types import Event, Position
 
 LOG = logging.getLogger(__name__)
 
 
-def convert(data: dict[str, str]) -> Event | None:
+def convert(
+    data: dict[str, str], location: tuple[str, str] | None = None
+) -> Event | None:
+    field = "time"
     try:
-        timestamp = arrow.get(data["time"]).to("utc")
-        uri = urlparse(data["uri"])
-        region, network = iplookup.lookup(data["remote"])
-        agent = user_agent(data["agent"])
+        timestamp = timestamps.parse(data[field])
+        field = "uri"
+        uri = urlparse(data[field])
+        field = "remote"
+        remote = data[field]
+        region, network = location or iplookup.lookup(remote)
+        field = "agent"
+        agent = user_agent(data[field])
+
+        field = "host"
+        host = data[field]
+        field = "method"
+        method = data[field]
+        field = "status"
+        status = int(data[field])
 
         event = Event(
             timestamp=timestamp,
-            host=data["host"],
+            host=host,
             path=uri.path,
-            method=data["method"],
-            status=int(data["status"]),
+            method=method,
+            status=status,
             region=region,
             network=network,
             agent=agent,
@@ -39,40 +49,64 @@ def convert(data: dict[str, str]) -> Event | None:
         return event
 
     except Exception as exc:
-        LOG.warning("unrecognized data contents: %s", type(exc))
+        cause = f"missing_{field}" if isinstance(exc, KeyError) else f"invalid_{field}"
+        metrics.PARSE_FAILURES.inc(cause=cause)
+        LOG.warning("unrecognized data contents, %s: %r", cause, exc)
         return None
 
 
-def tail(path: Path) -> Generator[Event, bool | None, None]:
-    cmd = ("tail", "-Fn0", path.as_posix())
-    print(f"$ {shlex.join(cmd)}")
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, encoding="utf-8")
+def convert_many(records: Sequence[dict[str, str] | None]) -> list[Event | None]:
+    # timed per batch, since a span per record would cost more than it measures
+    with profiling.span("tail.convert"):
+        locations = iter(
+            iplookup.lookup_many(
+                data.get("remote", "") for data in records if data is not None
+            )
+        )
+        events: list[Event | None] = []
+        for data in records:
+            if data is None:
+                events.append(None)
+            else:
+                events.append(convert(data, next(locations)))
+        return events
+
+
+def convert_chunk(chunk: Chunk) -> list[Event]:
+    """
+    Parse and convert a chunk of lines, tagging each event with its position.
+    """
+    result: list[Event] = []
+    events = convert_many(parse(chunk.lines))
+    for offset, event in zip(chunk.ends(), events):
+        if event is not None:
+            event.position = Position(chunk.device, chunk.inode, offset, chunk.size)
+            result.append(event)
+    return result
+
+
+def tail(
+    path: Path, position: Position | None = None
+) -> Generator[Event, bool | None, None]:
+    LOG.info("following %s", path)
+    chunks = follow(path, position)
     try:
-        for line in proc.stdout:
-            try:
-                data = json.loads(line)
-            except ValueError:
-                LOG.warning("failed to parse line, check logging format")
-
-            event = convert(data)
-            if event is None:
-                continue
-
-            stop = yield event
-            if stop:
-                break
+        for chunk in chunks:
+            for event in convert_chunk(chunk):
+                stop = yield event
+                if stop:
+                    return
 
     finally:
-        if not proc.poll():
-            proc.kill()
-            proc.wait(2)
+        chunks.close()
 
 
 if __name__ == "__main__":
     import sys
 
+    from rich import print
+
     path = Path(sys.argv[1])
     iplookup.load()
     for event in tail(path):
         print(event)
-        print(iplookup.lookup(event.remote))
@@ -2,4 +2,16 @@
 # Licensed under the MIT license
 
 from .agent import AgentTest
+from .benchmarks import BenchmarksTest
+from .db import DBTest
+from .follow import FollowTest
+from .formats import FormatsTest
+from .ingest import IngestTest
 from .iplookup import IPLookupTest
+from .metrics import MetricsTest
+from .pipeline import PipelineTest
+from .profiling import ProfilingTest
+from .report import ReportTest
+from .serve import ServeTest
+from .timestamps import TimestampsTest
+from .units import UnitsTest
@@ -1,14 +1,17 @@
 # Copyright Amethyst Reese
 # Licensed under the MIT license
 
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 
-from ..agent import user_agent
+from ..agent import load_rules, user_agent
 from ..types import Agent
 
 
 class AgentTest(TestCase):
-    def test_user_agent(self):
+    def test_user_agent(self) -> None:
         # https://www.whatismybrowser.com/guides/the-latest-user-agent/
         for name, value, expected in (
             ("empty", "", Agent("unknown", "unknown", "unknown")),
@@ -157,3 +160,51 @@ class AgentTest(TestCase):
             with self.subTest(name):
                 result = user_agent(value)
                 self.assertEqual(expected, result)
+
+    def test_user_agent_cache(self) -> None:
+        value = "Mozilla/5.0 (X11; Linux x86_64; rv:109) Gecko/20100101 Firefox/112.0"
+        user_agent.cache_clear()
+        user_agent(value)
+        user_agent(value)
+        info = user_agent.cache_info()
+        self.assertEqual((1, 1), (info.hits, info.misses))
+
+    def test_load_rules(self) -> None:
+        rules = {
+            "agents": [
+                {
+                    "match": ["Googlebot"],
+                    "device": "bot",
+                    "os": "bot",
+                    "browser": "google",
+                }
+            ],
+            "browsers": [
+                {"match": ["Firefox/"], "browser": "firefox"},
+            ],
+        }
+        try:
+            with TemporaryDirectory() as td:
+                path = Path(td) / "rules.json"
+                path.write_text(json.dumps(rules))
+                load_rules(path)
+
+            for value, expected in (
+                (
+                    "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+                    Agent("bot", "bot", "google"),
+                ),
+                (
+                    "Mozilla/5.0 (X11; Linux x86_64; rv:109) Gecko/20100101 Firefox/112.0",
+                    Agent("other", "other", "firefox"),
+                ),
+                (
+                    "MobileSafari/8615.1.26.10.24",
+                    Agent("unknown", "unknown", "unknown"),
+                ),
+            ):
+                with self.subTest(value):
+                    self.assertEqual(expected, user_agent(value))
+
+        finally:
+            load_rules()
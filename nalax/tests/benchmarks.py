@@ -0,0 +1,73 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+from unittest import TestCase
+
+from ..benchmarks.bench import compare, dump, Result, run_benchmarks
+from ..benchmarks.generate import LogGenerator
+from ..benchmarks.load import LoadConfig, percentile, run_load
+from ..tail import convert
+
+
+class BenchmarksTest(TestCase):
+    def test_generator(self) -> None:
+        records = LogGenerator(seed=7).records(500)
+        self.assertEqual(records, LogGenerator(seed=7).records(500))
+        self.assertNotEqual(records, LogGenerator(seed=8).records(500))
+
+        # popular pages dominate, like real traffic
+        paths = [record["uri"] for record in records]
+        top = max(set(paths), key=paths.count)
+        self.assertGreater(paths.count(top), len(paths) / 50)
+
+        timestamps = [record["time"] for record in records]
+        self.assertEqual(sorted(timestamps), timestamps)
+        self.assertTrue(all(convert(record) is not None for record in records))
+
+    def test_run_benchmarks(self) -> None:
+        names = ("tail.convert", "db.aggregate_daily_events")
+        results = list(run_benchmarks((50,), names, repeat=1))
+        self.assertEqual(list(names), [result.name for result in results])
+        for result in results:
+            self.assertEqual(50, result.size)
+            self.assertGreater(result.ops_per_sec, 0)
+            self.assertGreater(result.peak_kb, 0)
+
+    def test_compare(self) -> None:
+        baseline = dump(
+            [
+                Result("a", 10, 1.0, 1000.0, 1.0),
+                Result("b", 10, 1.0, 1000.0, 1.0),
+            ]
+        )
+        results = [
+            Result("a", 10, 1.0, 850.0, 1.0),
+            Result("b", 10, 1.0, 700.0, 1.0),
+            Result("c", 10, 1.0, 1.0, 1.0),
+        ]
+        regressions = compare(baseline, results, threshold=0.2)
+        self.assertEqual(["b"], [regression.name for regression in regressions])
+        self.assertAlmostEqual(-0.3, regressions[0].change)
+
+    def test_percentile(self) -> None:
+        values = [float(value) for value in range(1, 101)]
+        self.assertEqual(51.0, percentile(values, 0.5))
+        self.assertEqual(100.0, percentile(values, 0.99))
+        self.assertEqual(0.0, percentile([], 0.5))
+
+    def test_rate_at(self) -> None:
+        config = LoadConfig(rate=100, burst_factor=4, burst_every=10, burst_length=2)
+        self.assertEqual(400, config.rate_at(1))
+        self.assertEqual(100, config.rate_at(5))
+        self.assertEqual(400, config.rate_at(21))
+
+    def test_load(self) -> None:
+        config = LoadConfig(rate=200, duration=1.0, buffer_time=0.1, drain=5.0)
+        result = run_load(config)
+        self.assertGreater(result.sent, 150)
+        self.assertEqual(result.sent, result.received)
+        self.assertEqual(0, result.duplicated)
+        # the harness itself may fall slightly behind on a busy machine, so check
+        # that tail kept up with whatever was actually offered
+        self.assertEqual(0, result.dropped, result)
+        self.assertLessEqual(result.lag_p99, 2.0, result)
@@ -0,0 +1,325 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+import datetime
+import sqlite3
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import arrow
+
+from .. import db
+from ..schema import SCHEMA, SCHEMA_INSERT
+from ..types import Agent, Checkpoint, Event, Retention
+
+
+def event(timestamp: int, path: str = "/", host: str = "example.com") -> Event:
+    return Event(
+        timestamp=timestamp,
+        host=host,
+        path=path,
+        method="GET",
+        status=200,
+        region="US",
+        network="ipv4",
+        agent=Agent("desktop", "linux", "firefox"),
+    )
+
+
+class DBTest(TestCase):
+    def setUp(self) -> None:
+        self.td = TemporaryDirectory()
+        self.database = Path(self.td.name) / "nalax.db"
+        db.update_schema(self.database)
+
+    def tearDown(self) -> None:
+        self.td.cleanup()
+
+    def test_update_schema(self) -> None:
+        latest = len(SCHEMA) - 1
+        with db.connect(self.database) as conn:
+            (applied,) = conn.execute("pragma user_version").fetchone()
+            self.assertEqual(len(SCHEMA), applied)
+        self.assertEqual(latest, db.update_schema(self.database))
+
+        # databases from before user_version was tracked pick up where they left off
+        legacy = Path(self.td.name) / "legacy.db"
+        with db.connect(legacy) as conn:
+            for version in range(10):
+                conn.execute(SCHEMA[version])
+                conn.execute(SCHEMA_INSERT, (version, 0))
+        self.assertEqual(latest, db.update_schema(legacy))
+        with db.connect(legacy) as conn:
+            (applied,) = conn.execute("pragma user_version").fetchone()
+            self.assertEqual(len(SCHEMA), applied)
+            versions = [
+                row[0] for row in conn.execute("select version from nalax_schema")
+            ]
+            self.assertEqual(list(range(len(SCHEMA))), sorted(versions))
+
+    def test_writer(self) -> None:
+        checkpoint = Checkpoint("/var/log/access.log", 1, 2, 300)
+        with db.Writer(self.database, slice_size=7) as writer:
+            writer.insert_events([event(1683462896 + i) for i in range(20)])
+            writer.insert_events([event(1683462996)], [checkpoint])
+
+        with db.connect(self.database) as conn:
+            count = db.count_events(conn)
+            self.assertEqual(21, count)
+
+        path = Path(checkpoint.path)
+        self.assertEqual(checkpoint, db.get_checkpoint(self.database, path))
+
+    def test_dimensions(self) -> None:
+        with db.Writer(self.database) as writer, db.Writer(self.database) as other:
+            writer.insert_events([event(1683462896), event(1683462897, "/about")])
+            other.insert_events([event(1683462898, "/about", host="other.com")])
+            self.assertEqual({"/": 1, "/about": 2}, writer.dimensions.ids["path"])
+            # loaded before the first batch, so only knows the ids it needed
+            self.assertEqual({"other.com": 2}, other.dimensions.ids["host"])
+
+            # ids interned by a failed transaction are forgotten with it
+            with self.assertRaises(sqlite3.ProgrammingError):
+                writer.insert_rows(
+                    [event(1683462899, "/lost").as_row()],
+                    [("x", 1)],  # type: ignore[list-item]
+                )
+            self.assertNotIn("/lost", writer.dimensions.ids["path"])
+            writer.insert_events([event(1683462900, "/found")])
+            self.assertEqual(3, writer.dimensions.ids["path"]["/found"])
+
+        with db.connect(self.database) as conn:
+            query = """
+                select e.host, p.value from nalax_events_20230507 e
+                join nalax_dimensions p on p.kind = 'path' and p.id = e.path
+                order by e.timestamp
+            """
+            self.assertEqual(
+                [(1, "/"), (1, "/about"), (2, "/about"), (1, "/found")],
+                [tuple(row) for row in conn.execute(query)],
+            )
+
+    def test_encode_existing_events(self) -> None:
+        # databases with text events are converted when upgraded
+        legacy = Path(self.td.name) / "legacy.db"
+        events = [event(1683462896), event(1683462897, "/about", host="other.com")]
+        with db.connect(legacy) as conn:
+            for version in range(34):
+                conn.execute(SCHEMA[version])
+                conn.execute(SCHEMA_INSERT, (version, 0))
+            query = db.Writer.INSERT_EVENT.format(table="nalax_events")
+            conn.executemany(query, [e.as_row() for e in events])
+        db.update_schema(legacy)
+
+        with db.Writer(legacy) as writer:
+            self.assertEqual(
+                {"example.com": 1, "other.com": 2}, writer.dimensions.ids["host"]
+            )
+            writer.insert_events([event(1683462898, "/new")])
+
+        self.assertEqual(3, db.aggregate_daily_events(legacy, arrow.get(1683462899)))
+        with db.connect(legacy) as conn:
+            query = "select host, path, count from nalax_daily_pages order by path"
+            self.assertEqual(
+                [
+                    ("example.com", "/", 1),
+                    ("other.com", "/about", 1),
+                    ("example.com", "/new", 1),
+                ],
+                [tuple(row) for row in conn.execute(query)],
+            )
+
+    def test_partitions(self) -> None:
+        day = 1683417600  # 2023-05-07 00:00 UTC
+        with db.Writer(self.database) as writer:
+            writer.insert_events(
+                [event(day + 10), event(day + 86400 + 10), event(day + 86400 + 20)]
+            )
+
+        with db.connect(self.database) as conn:
+            self.assertEqual(
+                [(19484, "nalax_events_20230507"), (19485, "nalax_events_20230508")],
+                db.partitions(conn),
+            )
+
+        # whole days are dropped, and partial days are trimmed
+        before = arrow.get(day + 86400 + 15)
+        self.assertEqual(2, db.aggregate_daily_events(self.database, before))
+        with db.connect(self.database) as conn:
+            self.assertEqual([(19485, "nalax_events_20230508")], db.partitions(conn))
+            self.assertEqual(1, db.count_events(conn))
+            (free,) = conn.execute("pragma freelist_count").fetchone()
+            self.assertEqual(0, free)
+
+        # late events recreate a partition that was already aggregated
+        with db.Writer(self.database) as writer:
+            writer.insert_events([event(day + 30)])
+        self.assertEqual(1, db.aggregate_daily_events(self.database, before))
+        with db.connect(self.database) as conn:
+            query = "select count from nalax_daily_pages where day = 7"
+            self.assertEqual(2, conn.execute(query).fetchone()[0])
+
+    def test_aggregate_daily_events(self) -> None:
+        day = 1683417600  # 2023-05-07 00:00 UTC
+        events = [
+            event(day + 10),
+            event(day + 20, "/about"),
+            event(day + 30),
+            event(day + 86400 + 10),
+            event(day + 86400 * 3 + 10, host="other.com"),
+            event(day + 86400 * 4 + 10),
+        ]
+        with db.Writer(self.database) as writer:
+            writer.insert_events(events)
+
+        before = arrow.get(day + 86400 * 4)
+        count = db.aggregate_daily_events(self.database, before)
+        self.assertEqual(5, count)
+
+        with db.connect(self.database) as conn:
+            query = "select * from nalax_daily_pages order by day, host, path"
+            rows = [tuple(row) for row in conn.execute(query)]
+            self.assertEqual(
+                [
+                    (2023, 5, 7, "example.com", "/", "GET", 2),
+                    (2023, 5, 7, "example.com", "/about", "GET", 1),
+                    (2023, 5, 8, "example.com", "/", "GET", 1),
+                    (2023, 5, 10, "other.com", "/", "GET", 1),
+                ],
+                rows,
+            )
+
+            query = "select day, host, count from nalax_daily_users order by day"
+            rows = [tuple(row) for row in conn.execute(query)]
+            self.assertEqual(
+                [
+                    (7, "example.com", 3),
+                    (8, "example.com", 1),
+                    (10, "other.com", 1),
+                ],
+                rows,
+            )
+
+            remaining = db.count_events(conn)
+            self.assertEqual(1, remaining)
+
+        # aggregating again merges new events into the existing counts
+        with db.Writer(self.database) as writer:
+            writer.insert_events([event(day + 40)])
+        self.assertEqual(1, db.aggregate_daily_events(self.database, before))
+
+        with db.connect(self.database) as conn:
+            query = "select count from nalax_daily_pages where day = 7 and path = '/'"
+            self.assertEqual(3, conn.execute(query).fetchone()[0])
+
+    def test_sweep_dimensions(self) -> None:
+        day = 1683417600  # 2023-05-07 00:00 UTC
+        with db.Writer(self.database) as writer:
+            writer.insert_events(
+                [event(day + 10, "/a"), event(day + 20, "/b"), event(day + 86400 * 4)]
+            )
+            self.assertEqual({"/a": 1, "/b": 2, "/": 3}, writer.dimensions.ids["path"])
+
+            db.aggregate_daily_events(self.database, arrow.get(day + 86400))
+            with db.connect(self.database) as conn:
+                query = "select kind, id, value from nalax_dimensions where kind = ?"
+                rows = [tuple(row) for row in conn.execute(query, ("path",))]
+                self.assertEqual([("path", 3, "/")], rows)
+
+            # the writer notices the sweep, and doesn't reuse ids
+            writer.insert_events([event(day + 86400 * 4 + 10, "/a")])
+            self.assertEqual({"/": 3, "/a": 4}, writer.dimensions.ids["path"])
+
+        with db.connect(self.database) as conn:
+            query = """
+                select p.value from nalax_events_20230511 e
+                join nalax_dimensions p on p.kind = 'path' and p.id = e.path
+                order by e.timestamp
+            """
+            self.assertEqual(["/", "/a"], [row[0] for row in conn.execute(query)])
+
+        # the last id of each kind is kept, even when unused
+        db.aggregate_daily_events(self.database, arrow.get(day + 86400 * 5))
+        with db.connect(self.database) as conn:
+            query = "select kind, id, value from nalax_dimensions where kind = ?"
+            rows = [tuple(row) for row in conn.execute(query, ("path",))]
+            self.assertEqual([("path", 4, "/a")], rows)
+            self.assertEqual(0, db.sweep_dimensions(conn))
+
+    def test_merge_events(self) -> None:
+        day = 1683417600  # 2023-05-07 00:00 UTC
+        checkpoint = Checkpoint("/var/log/access.log", 1, 2, 300)
+        with db.Writer(self.database) as writer:
+            writer.merge_events([event(day + 10), event(day + 20, "/about")])
+            writer.merge_events([event(day + 30), event(day + 86400)], [checkpoint])
+
+        with db.connect(self.database) as conn:
+            count = db.count_events(conn)
+            self.assertEqual(0, count)
+
+            query = "select day, path, count from nalax_daily_pages order by day, path"
+            rows = [tuple(row) for row in conn.execute(query)]
+            self.assertEqual([(7, "/", 2), (7, "/about", 1), (8, "/", 1)], rows)
+
+            query = "select day, count from nalax_daily_users order by day"
+            rows = [tuple(row) for row in conn.execute(query)]
+            self.assertEqual([(7, 3), (8, 1)], rows)
+
+        path = Path(checkpoint.path)
+        self.assertEqual(checkpoint, db.get_checkpoint(self.database, path))
+
+    def test_rollups(self) -> None:
+        sunday = 1685232000  # 2023-05-28 00:00 UTC
+        with db.Writer(self.database) as writer:
+            writer.insert_events(
+                [
+                    event(sunday + 10),  # week of 05-22
+                    event(sunday + 86400 + 10),  # monday, week of 05-29
+                    event(sunday + 86400 * 4 + 10),  # thursday, 06-01
+                ]
+            )
+            # inline counts land in the same rollups
+            writer.merge_events([event(sunday + 20)])
+
+        before = arrow.get(sunday + 86400 * 5)
+        self.assertEqual(3, db.aggregate_daily_events(self.database, before))
+
+        with db.connect(self.database) as conn:
+            query = (
+                "select year, month, day, count from nalax_weekly_pages order by day"
+            )
+            rows = [tuple(row) for row in conn.execute(query)]
+            self.assertEqual([(2023, 5, 22, 2), (2023, 5, 29, 2)], rows)
+
+            query = "select year, month, count from nalax_monthly_users order by month"
+            rows = [tuple(row) for row in conn.execute(query)]
+            self.assertEqual([(2023, 5, 3), (2023, 6, 1)], rows)
+
+        # 2023-06-05, keeping one day of daily stats and one week of weekly stats
+        today = datetime.date(2023, 6, 5)
+        deleted = db.prune_rollups(self.database, 1, 1, today=today)
+        self.assertEqual(6 + 2, deleted)
+
+        with db.connect(self.database) as conn:
+            for table, expected in (
+                ("nalax_daily_pages", 0),
+                ("nalax_weekly_pages", 1),
+                ("nalax_monthly_pages", 2),
+            ):
+                (count,) = conn.execute(f"select count(*) from {table}").fetchone()
+                self.assertEqual(expected, count, table)
+
+            retention = Retention(datetime.date(2023, 6, 4), datetime.date(2023, 5, 29))
+            self.assertEqual(retention, db.get_retention(conn))
+
+        # pruning less doesn't bring pruned days back
+        self.assertEqual(0, db.prune_rollups(self.database, 30, 30, today=today))
+        with db.connect(self.database) as conn:
+            self.assertEqual(retention, db.get_retention(conn))
+
+    def test_week_start(self) -> None:
+        self.assertEqual((2023, 5, 1), db.week_start(2023, 5, 7))
+        self.assertEqual((2023, 5, 8), db.week_start(2023, 5, 8))
+        self.assertEqual((2023, 12, 25), db.week_start(2023, 12, 31))
+        self.assertEqual((2024, 1, 1), db.week_start(2024, 1, 1))
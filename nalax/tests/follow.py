@@ -0,0 +1,194 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+import os
+import threading
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Callable
+from unittest import TestCase
+
+from ..follow import Chunk, follow, Inotify
+from ..types import Position
+
+
+class FollowTest(TestCase):
+    def setUp(self) -> None:
+        self.td = TemporaryDirectory()
+        self.path = Path(self.td.name) / "access.log"
+        self.path.write_bytes(b"skipped\n")
+
+    def tearDown(self) -> None:
+        self.td.cleanup()
+
+    def append(self, data: bytes, path: Path | None = None) -> None:
+        with open(path or self.path, "ab") as f:
+            f.write(data)
+
+    def collect(
+        self,
+        count: int,
+        *steps: Callable[[], object],
+        position: Position | None = None,
+        grace: float = 0.2,
+        interval: float = 0.01,
+        inotify: Inotify | None = None,
+    ) -> list[bytes]:
+        chunks = follow(
+            self.path, position, interval=interval, grace=grace, inotify=inotify
+        )
+
+        def script() -> None:
+            for step in steps:
+                time.sleep(0.05)
+                step()
+
+        thread = threading.Thread(target=script, daemon=True)
+        lines: list[bytes] = []
+        offsets: list[int] = []
+        try:
+            thread.start()
+            for chunk in chunks:
+                offsets.extend(chunk.ends())
+                lines.extend(chunk.lines)
+                if len(lines) >= count:
+                    break
+        finally:
+            chunks.close()
+            thread.join()
+
+        self.offsets = offsets
+        return lines
+
+    def test_follow(self) -> None:
+        lines = self.collect(
+            3,
+            lambda: self.append(b"one\ntw"),
+            lambda: self.append(b"o\nthree\n"),
+        )
+        self.assertEqual([b"one", b"two", b"three"], lines)
+        self.assertEqual([12, 16, 22], self.offsets)
+
+    def test_rotation(self) -> None:
+        rotated = self.path.with_name("access.log.1")
+
+        def rotate() -> None:
+            os.rename(self.path, rotated)
+            self.path.write_bytes(b"")
+
+        lines = self.collect(
+            3,
+            lambda: self.append(b"one\n"),
+            rotate,
+            lambda: self.append(b"two\n", rotated),
+            lambda: self.append(b"three\n"),
+        )
+        self.assertEqual([b"one", b"two", b"three"], lines)
+        # late lines in the old file end at the current position in the new one
+        self.assertEqual([12, 0, 6], self.offsets)
+
+    def test_rotation_without_waiting(self) -> None:
+        rotated = self.path.with_name("access.log.1")
+
+        def rotate() -> None:
+            self.append(b"one\n")
+            os.rename(self.path, rotated)
+            self.path.write_bytes(b"two\n")
+
+        before = time.monotonic()
+        lines = self.collect(2, rotate, grace=5.0)
+        self.assertLess(time.monotonic() - before, 2.0)
+        self.assertEqual([b"one", b"two"], lines)
+        self.assertEqual([12, 4], self.offsets)
+
+    def test_truncation(self) -> None:
+        lines = self.collect(
+            2,
+            lambda: self.append(b"one\n"),
+            lambda: self.path.write_bytes(b""),
+            lambda: self.append(b"two\n"),
+        )
+        self.assertEqual([b"one", b"two"], lines)
+        self.assertEqual([12, 4], self.offsets)
+
+    def test_resume_rotated(self) -> None:
+        stat = self.path.stat()
+        position = Position(stat.st_dev, stat.st_ino, 8, 8)
+        rotated = self.path.with_name("access.log.1")
+
+        self.append(b"one\n")
+        os.rename(self.path, rotated)
+        os.utime(rotated, (0, 0))
+        self.path.write_bytes(b"two\n")
+
+        lines = self.collect(2, position=position)
+        self.assertEqual([b"one", b"two"], lines)
+        self.assertEqual([12, 4], self.offsets)
+
+    def test_resume_negative_offset(self) -> None:
+        # written by versions that could give late lines negative offsets
+        stat = self.path.stat()
+        position = Position(stat.st_dev, stat.st_ino, -8, 8)
+        with self.assertLogs("nalax.follow", "WARNING"):
+            lines = self.collect(1, position=position)
+        self.assertEqual([b"skipped"], lines)
+
+    def test_late_chunk(self) -> None:
+        chunk = Chunk(1, 2, 4, 10, [b"one", b"not json"], late=True)
+        self.assertEqual([4, 4], chunk.ends())
+        self.assertEqual(4, chunk.end)
+
+        chunk = chunk._replace(late=False)
+        self.assertEqual([8, 17], chunk.ends())
+        self.assertEqual(17, chunk.end)
+
+    def test_shared_inotify(self) -> None:
+        inotify = Inotify()
+        paths = [self.path.with_name(f"site{idx}.log") for idx in range(20)]
+        # created up front, so only the writes below wake anyone
+        paths[0].write_bytes(b"")
+        watchers = [inotify.watch(path) for path in paths]
+        try:
+            for _ in range(50):
+                self.append(b"line\n", paths[0])
+            self.assertTrue(watchers[0].changed.wait(2))
+            time.sleep(0.1)
+            # only the follower of the file that changed is woken
+            self.assertFalse(any(w.changed.is_set() for w in watchers[1:]))
+            self.assertLessEqual(inotify.wakeups, 50)
+
+            # including for late writes to its first rotation
+            watchers[0].changed.clear()
+            self.append(b"late\n", paths[0].with_name("site0.log.1"))
+            self.assertTrue(watchers[0].changed.wait(2))
+            self.assertFalse(any(w.changed.is_set() for w in watchers[1:]))
+        finally:
+            for watcher in watchers:
+                watcher.close()
+            inotify.close()
+
+    def test_follow_shared_inotify(self) -> None:
+        rotated = self.path.with_name("access.log.1")
+
+        def rotate() -> None:
+            os.rename(self.path, rotated)
+            self.path.write_bytes(b"")
+
+        inotify = Inotify()
+        try:
+            # a long interval, so only inotify events can keep this quick
+            before = time.monotonic()
+            lines = self.collect(
+                3,
+                lambda: self.append(b"one\n"),
+                rotate,
+                lambda: self.append(b"two\n", rotated),
+                lambda: self.append(b"three\n"),
+                interval=5.0,
+                inotify=inotify,
+            )
+            self.assertLess(time.monotonic() - before, 2.0)
+            self.assertEqual([b"one", b"two", b"three"], lines)
+        finally:
+            inotify.close()
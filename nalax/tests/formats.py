@@ -0,0 +1,102 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+import json
+from unittest import TestCase
+
+from .. import formats, metrics
+from ..formats import parse
+from ..tail import convert
+
+RECORD = {
+    "time": "2023-05-07T12:34:56+00:00",
+    "host": "example.com",
+    "method": "GET",
+    "uri": "/page?query",
+    "status": "200",
+    "remote": "127.0.0.1",
+    "agent": "Mozilla/5.0 (X11; Linux x86_64; rv:109) Gecko/20100101 Firefox/112.0",
+}
+COMBINED_LINE = (
+    b'127.0.0.1 - - [07/May/2023:12:34:56 +0000] "GET /page?query HTTP/1.1" 200 '
+    b'512 "https://example.com/" "Mozilla/5.0 (X11; Linux x86_64; rv:109) '
+    b'Gecko/20100101 Firefox/112.0"'
+)
+COMBINED = {**RECORD, "time": "07/May/2023:12:34:56 +0000", "host": ""}
+
+
+class FormatsTest(TestCase):
+    def tearDown(self) -> None:
+        formats.load_format()
+
+    def test_json(self) -> None:
+        lines = [json.dumps(RECORD).encode(), b"", b"not json", b"[1, 2]"]
+        for loads in (formats.JSONFormat().loads, json.loads):
+            with self.subTest(loads.__module__):
+                log_format = formats.JSONFormat()
+                log_format.loads = loads
+                with self.assertLogs("nalax.formats", "WARNING"):
+                    records = log_format.parse(lines)
+                self.assertEqual([RECORD, None, None, None], records)
+
+    def test_combined(self) -> None:
+        log_format = formats.get_format("combined")
+        (record,) = log_format.parse([COMBINED_LINE])
+        self.assertEqual(COMBINED, record)
+
+        assert record is not None
+        event, expected = convert(record), convert(RECORD)
+        assert event is not None and expected is not None
+        self.assertEqual(expected.timestamp, event.timestamp)
+        self.assertEqual(
+            ("/page", "GET", 200), (event.path, event.method, event.status)
+        )
+
+    def test_common(self) -> None:
+        line = COMBINED_LINE.rsplit(b' "', 2)[0]
+        (record,) = formats.get_format("common").parse([line])
+        self.assertEqual({**COMBINED, "agent": ""}, record)
+        assert record is not None
+        self.assertIsNotNone(convert(record))
+
+    def test_custom(self) -> None:
+        log_format = formats.get_format(
+            '$http_host $remote_addr [$time_iso8601] "$request_method ${request_uri}" '
+            '$status $request_time "$http_user_agent" $upstream_addr'
+        )
+        line = (
+            '{host} {remote} [{time}] "{method} {uri}" {status} 0.012 "{agent}" -'
+        ).format(**RECORD)
+        self.assertEqual([RECORD], log_format.parse([line.encode()]))
+        assert isinstance(log_format, formats.RegexFormat)
+        self.assertEqual(
+            ["host", "remote", "time", "method", "uri", "status", "agent"],
+            list(log_format.pattern.groupindex),
+        )
+
+    def test_no_match(self) -> None:
+        log_format = formats.get_format("combined")
+        failures = metrics.PARSE_FAILURES.values
+        before = failures.get(("no_match",), 0)
+        with self.assertLogs("nalax.formats", "WARNING"):
+            records = log_format.parse([json.dumps(RECORD).encode(), b"  "])
+        self.assertEqual([None, None], records)
+        self.assertEqual(1, failures[("no_match",)] - before)
+
+    def test_get_format(self) -> None:
+        for name in formats.FORMATS:
+            with self.subTest(name):
+                self.assertEqual(name, formats.get_format(name).name)
+
+        with self.assertRaisesRegex(ValueError, "unknown log format"):
+            formats.get_format("apache")
+        with self.assertRaisesRegex(ValueError, "no variable for time, status"):
+            formats.get_format('"$request"')
+        with self.assertRaises(TypeError):
+            formats.LogFormat()  # type: ignore[abstract]
+
+    def test_load_format(self) -> None:
+        formats.load_format("combined")
+        self.assertEqual([COMBINED], parse([COMBINED_LINE]))
+        formats.load_format()
+        self.assertEqual("json", formats.FORMAT.name)
@@ -0,0 +1,51 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+import gzip
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from .. import db
+from ..ingest import blocks, ingest
+from .pipeline import line
+
+
+class IngestTest(TestCase):
+    def test_blocks(self) -> None:
+        content = b"".join(b"line %d\n" % i for i in range(100)) + b"partial"
+        with TemporaryDirectory() as td:
+            plain = Path(td) / "access.log"
+            plain.write_bytes(content)
+            compressed = Path(td) / "access.log.1.gz"
+            compressed.write_bytes(gzip.compress(content))
+
+            for path in (plain, compressed):
+                with self.subTest(path.name):
+                    result = list(blocks(path, block_size=64))
+                    self.assertEqual(content, b"".join(result))
+                    for block in result[:-1]:
+                        self.assertTrue(block.endswith(b"\n"))
+                    self.assertEqual(b"partial", result[-1])
+
+    def test_ingest(self) -> None:
+        with TemporaryDirectory() as td:
+            database = Path(td) / "nalax.db"
+            db.update_schema(database)
+            plain = Path(td) / "access.log"
+            plain.write_bytes(
+                b"".join(line(idx) for idx in range(10)) + b"not json\n\n[1, 2]\n"
+            )
+            compressed = Path(td) / "access.log.1.gz"
+            compressed.write_bytes(
+                gzip.compress(b"".join(line(idx) for idx in range(10, 15)))
+            )
+
+            stats = ingest(database, [plain, compressed], jobs=2, batch_size=4)
+            self.assertEqual(2, stats.files)
+            self.assertEqual(17, stats.lines)  # blank lines aren't counted
+            self.assertEqual(15, stats.events)
+            self.assertEqual(2, stats.bad)
+
+            with db.connect(database) as conn:
+                self.assertEqual(15, db.count_events(conn))
@@ -1,19 +1,24 @@
 # Copyright Amethyst Reese
 # Licensed under the MIT license
 
-from unittest import TestCase
+import os
+from array import array
 from ipaddress import ip_address
+from pathlib import Path
 from random import randint
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
 
 from .. import iplookup
 
 
 class IPLookupTest(TestCase):
     @classmethod
-    def setUpClass(cls):
+    def setUpClass(cls) -> None:
         iplookup.load()
 
-    def test_lookup(self):
+    def test_lookup(self) -> None:
         for value, expected in (
             ("127.0.0.1", ("None", "ipv4")),
             ("192.168.0.1", ("None", "ipv4")),
@@ -24,7 +29,31 @@ class IPLookupTest(TestCase):
             with self.subTest(value):
                 self.assertEqual(expected, iplookup.lookup(value))
 
-    def test_random_ipv4_lookups(self):
+    def test_lazy_load(self) -> None:
+        with patch.object(iplookup, "IP2COUNTRY_V4", None):
+            iplookup.lookup.cache_clear()
+            self.assertEqual(("None", "ipv4"), iplookup.lookup("127.0.0.1"))
+            self.assertIsNotNone(iplookup.IP2COUNTRY_V4)
+        iplookup.lookup.cache_clear()
+
+    def test_lookup_many(self) -> None:
+        values = [
+            "127.0.0.1",
+            "192.168.0.1",
+            "::",
+            "not an address",
+            "127.0.0.1",
+        ]
+        values += [str(ip_address(randint(0, 2**32 - 1))) for _ in range(100)]
+        expected = [iplookup.lookup(value) for value in values]
+
+        with self.subTest("default"):
+            self.assertEqual(expected, iplookup.lookup_many(values))
+
+        with self.subTest("pure python"), patch.object(iplookup, "numpy", None):
+            self.assertEqual(expected, iplookup.lookup_many(values))
+
+    def test_random_ipv4_lookups(self) -> None:
         # may need to be updated if ip2country dataset is updated
         for idx, expected in (
             (24, "TH"),
@@ -34,8 +63,46 @@ class IPLookupTest(TestCase):
             (8350, "US"),
             (467868, "JP"),
         ):
-            rng = iplookup.IP2COUNTRY_V4[idx]
+            rng = iplookup.index()[idx]
             for ip32 in (rng.start, randint(rng.start, rng.end), rng.end):
                 ips = str(ip_address(ip32))
                 with self.subTest((idx, expected, ips)):
-                    self.assertEqual((expected, "ipv4"), iplookup.lookup(ips))
\ No newline at end of file
+                    self.assertEqual((expected, "ipv4"), iplookup.lookup(ips))
+
+    def test_index_roundtrip(self) -> None:
+        index = iplookup.IPv4Index(
+            array("I", [16, 64, 256]),
+            array("I", [31, 127, 511]),
+            array("H", [0, 1, 0]),
+            ("US", "None"),
+        )
+        with TemporaryDirectory() as td:
+            source = Path(td) / "source.tsv"
+            source.write_text("placeholder")
+            stat = source.stat()
+            target = Path(td) / "index.idx"
+
+            iplookup.write_index(target, index, stat)
+            result = iplookup.open_index(target, stat)
+            assert result is not None
+            self.assertEqual(
+                [index[i] for i in range(len(index))],
+                [result[i] for i in range(len(result))],
+            )
+
+            for ip32, expected in (
+                (15, "Unknown"),
+                (16, "US"),
+                (31, "US"),
+                (32, "Unknown"),
+                (100, "None"),
+                (511, "US"),
+                (512, "Unknown"),
+            ):
+                with self.subTest(ip32):
+                    self.assertEqual(expected, result.region(ip32))
+
+            with self.subTest("stale"):
+                source.write_text("updated source")
+                os.utime(source, ns=(0, 0))
+                self.assertIsNone(iplookup.open_index(target, source.stat()))
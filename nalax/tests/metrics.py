@@ -0,0 +1,86 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+import asyncio
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import IsolatedAsyncioTestCase
+
+from .. import metrics
+from ..formats import parse
+from ..tail import convert
+
+
+class MetricsTest(IsolatedAsyncioTestCase):
+    def test_render(self) -> None:
+        counter = metrics.Counter("test_counter_total", "A counter", ("kind",))
+        counter.inc(kind="a")
+        counter.inc(2, kind='quoted "b"\n')
+        gauge = metrics.Gauge("test_gauge", "A gauge")
+        gauge.set(1.5)
+        histogram = metrics.Histogram("test_histogram", "A histogram", (1, 10))
+        for value in (0.5, 1, 5, 50):
+            histogram.observe(value)
+        metrics.Counter(
+            "test_collected_total",
+            "Collected",
+            ("result",),
+            collect=lambda: {("hit",): 3},
+        )
+
+        text = metrics.REGISTRY.render()
+        for line in (
+            "# HELP test_counter_total A counter",
+            "# TYPE test_counter_total counter",
+            'test_counter_total{kind="a"} 1',
+            'test_counter_total{kind="quoted \\"b\\"\\n"} 2',
+            "# TYPE test_gauge gauge",
+            "test_gauge 1.5",
+            "# TYPE test_histogram histogram",
+            'test_histogram_bucket{le="1"} 2',
+            'test_histogram_bucket{le="10"} 3',
+            'test_histogram_bucket{le="+Inf"} 4',
+            "test_histogram_sum 56.5",
+            "test_histogram_count 4",
+            'test_collected_total{result="hit"} 3',
+        ):
+            with self.subTest(line):
+                self.assertIn(line, text.splitlines())
+
+        with self.assertRaisesRegex(ValueError, "already registered"):
+            metrics.Gauge("test_gauge", "Again")
+
+    def test_parse_failures(self) -> None:
+        failures = metrics.PARSE_FAILURES.values
+        before = dict(failures)
+        parse([b"not json", b"[1, 2]"])
+        convert({"time": "yesterday"})
+        convert({"time": "2024-01-01T00:00:00+00:00"})
+        for cause in ("invalid_json", "not_object", "invalid_time", "missing_uri"):
+            with self.subTest(cause):
+                key = (cause,)
+                self.assertEqual(1, failures.get(key, 0) - before.get(key, 0))
+
+    def test_write_stats(self) -> None:
+        with TemporaryDirectory() as td:
+            path = Path(td) / "nalax.prom"
+            metrics.write_stats(path)
+            self.assertIn("# TYPE nalax_lines_read_total counter", path.read_text())
+            self.assertEqual(["nalax.prom"], [p.name for p in Path(td).iterdir()])
+
+    async def test_serve(self) -> None:
+        server = await metrics.serve("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            for target, status in (("/metrics", b"200"), ("/other", b"404")):
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(f"GET {target} HTTP/1.1\r\nHost: x\r\n\r\n".encode())
+                response = await reader.read()
+                writer.close()
+                with self.subTest(target):
+                    self.assertEqual(status, response.split(b" ")[1])
+                    if status == b"200":
+                        self.assertIn(b"nalax_events_written_total", response)
+        finally:
+            server.close()
+            await server.wait_closed()
@@ -0,0 +1,282 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+import asyncio
+import json
+import threading
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import IsolatedAsyncioTestCase
+
+from .. import db, metrics
+from ..follow import Chunk
+from ..pipeline import Pipeline, Source
+
+
+def line(idx: int) -> bytes:
+    data = {
+        "time": f"2023-05-07T12:00:{idx % 60:02}+00:00",
+        "host": "example.com",
+        "method": "GET",
+        "uri": f"/page/{idx}?query",
+        "status": "200",
+        "remote": "127.0.0.1",
+        "agent": "Mozilla/5.0 (X11; Linux x86_64; rv:109) Gecko/20100101 Firefox/112.0",
+    }
+    return json.dumps(data).encode() + b"\n"
+
+
+class PipelineTest(IsolatedAsyncioTestCase):
+    async def test_pipeline(self) -> None:
+        with TemporaryDirectory() as td:
+            database = Path(td) / "nalax.db"
+            path = Path(td) / "access.log"
+            db.update_schema(database)
+            path.write_bytes(line(0))
+
+            pipeline = Pipeline(database, [path], buffer_size=10, buffer_time=0.05)
+            task = asyncio.create_task(pipeline.run())
+            await asyncio.sleep(0.1)
+
+            with self.assertLogs("nalax.formats", "WARNING"):
+                with open(path, "ab") as f:
+                    for idx in range(1, 26):
+                        f.write(line(idx))
+                    f.write(b"not json\n")
+                await asyncio.sleep(0.5)
+
+                pipeline.stop()
+                await asyncio.wait_for(task, 5)
+
+            with db.connect(database) as conn:
+                count = db.count_events(conn)
+            self.assertEqual(25, count)
+
+            checkpoint = db.get_checkpoint(database, path)
+
+            assert checkpoint is not None
+            # past the line that didn't parse
+            self.assertEqual(path.stat().st_size, checkpoint.offset)
+
+    async def test_trailing_bad_line(self) -> None:
+        with TemporaryDirectory() as td:
+            database = Path(td) / "nalax.db"
+            path = Path(td) / "access.log"
+            db.update_schema(database)
+            path.write_bytes(b"")
+
+            # unbuffered, so only catching up to the end of the file flushes
+            pipeline = Pipeline(database, [path])
+            task = asyncio.create_task(pipeline.run())
+            try:
+                await asyncio.sleep(0.1)
+                with self.assertLogs("nalax.formats", "WARNING"):
+                    with open(path, "ab") as f:
+                        f.write(line(0) + b"not json\n")
+                    await asyncio.sleep(0.5)
+
+                with db.connect(database) as conn:
+                    count = db.count_events(conn)
+                self.assertEqual(1, count)
+
+            finally:
+                pipeline.stop()
+                await asyncio.wait_for(task, 5)
+
+            checkpoint = db.get_checkpoint(database, path)
+
+            assert checkpoint is not None
+            self.assertEqual(path.stat().st_size, checkpoint.offset)
+
+    async def test_deadline_flush(self) -> None:
+        with TemporaryDirectory() as td:
+            database = Path(td) / "nalax.db"
+            path = Path(td) / "access.log"
+            db.update_schema(database)
+            path.write_bytes(b"")
+
+            pipeline = Pipeline(database, [path], buffer_size=1000, buffer_time=0.1)
+            task = asyncio.create_task(pipeline.run())
+            try:
+                await asyncio.sleep(0.1)
+                with open(path, "ab") as f:
+                    for idx in range(5):
+                        f.write(line(idx))
+                await asyncio.sleep(0.5)
+
+                # flushed by time, well before the batch is full or the pipeline stops
+                with db.connect(database) as conn:
+                    count = db.count_events(conn)
+                self.assertEqual(5, count)
+
+                # backpressure is visible in the exported metrics
+                text = metrics.REGISTRY.render()
+                for sample in (
+                    'nalax_queue_depth{queue="chunks"} 0\n',
+                    'nalax_stage_items_total{stage="write"} 1\n',
+                    'nalax_stage_average_seconds{stage="parse"} ',
+                    f'nalax_file_blocked_seconds_total{{path="{path}"}} ',
+                ):
+                    with self.subTest(sample):
+                        self.assertIn(sample, text)
+
+            finally:
+                pipeline.stop()
+                await asyncio.wait_for(task, 5)
+
+    async def test_aggregate_inline(self) -> None:
+        with TemporaryDirectory() as td:
+            database = Path(td) / "nalax.db"
+            path = Path(td) / "access.log"
+            db.update_schema(database)
+            path.write_bytes(b"")
+
+            pipeline = Pipeline(database, [path], aggregate_inline=True)
+            task = asyncio.create_task(pipeline.run())
+            await asyncio.sleep(0.1)
+            with open(path, "ab") as f:
+                for idx in range(12):
+                    f.write(line(idx % 3))
+            await asyncio.sleep(0.5)
+            pipeline.stop()
+            await asyncio.wait_for(task, 5)
+
+            with db.connect(database) as conn:
+                count = db.count_events(conn)
+                self.assertEqual(0, count)
+
+                query = "select path, count from nalax_daily_pages order by path"
+                rows = [tuple(row) for row in conn.execute(query)]
+                self.assertEqual([("/page/0", 4), ("/page/1", 4), ("/page/2", 4)], rows)
+
+            checkpoint = db.get_checkpoint(database, path)
+
+            assert checkpoint is not None
+            self.assertEqual(path.stat().st_size, checkpoint.offset)
+
+    async def test_multiple_files(self) -> None:
+        with TemporaryDirectory() as td:
+            database = Path(td) / "nalax.db"
+            logs = Path(td) / "logs"
+            logs.mkdir()
+            db.update_schema(database)
+            first = logs / "first.log"
+            second = logs / "second.log"
+            third = logs / "third.log"
+            for path in (first, second, logs / "first.log.1"):
+                path.write_bytes(b"")
+
+            pipeline = Pipeline(
+                database,
+                [logs / "*.log*"],
+                buffer_size=1000,
+                buffer_time=0.05,
+                rescan_interval=0.05,
+            )
+            task = asyncio.create_task(pipeline.run())
+            await asyncio.sleep(0.1)
+            with open(first, "ab") as f:
+                for idx in range(5):
+                    f.write(line(idx))
+            with open(second, "ab") as f:
+                for idx in range(3):
+                    f.write(line(idx))
+            # new files are read from the beginning
+            third.write_bytes(line(0) + line(1))
+            await asyncio.sleep(0.5)
+            pipeline.stop()
+            await asyncio.wait_for(task, 5)
+
+            with db.connect(database) as conn:
+                count = db.count_events(conn)
+            self.assertEqual(10, count)
+
+            files = pipeline.stats()["files"]
+            self.assertEqual(
+                [first.as_posix(), second.as_posix(), third.as_posix()], sorted(files)
+            )
+            for path, events in ((first, 5), (second, 3), (third, 2)):
+                with self.subTest(path.name):
+                    self.assertEqual(events, files[path.as_posix()]["events"])
+                    checkpoint = db.get_checkpoint(database, path)
+                    assert checkpoint is not None
+                    self.assertEqual(path.stat().st_size, checkpoint.offset)
+
+    async def test_retire_deleted(self) -> None:
+        with TemporaryDirectory() as td:
+            database = Path(td) / "nalax.db"
+            logs = Path(td) / "logs"
+            logs.mkdir()
+            db.update_schema(database)
+            kept = logs / "kept.log"
+            deleted = logs / "deleted.log"
+            for path in (kept, deleted):
+                path.write_bytes(b"")
+
+            pipeline = Pipeline(
+                database, [logs / "*.log"], rescan_interval=0.05, grace=0.2
+            )
+            task = asyncio.create_task(pipeline.run())
+            try:
+                await asyncio.sleep(0.2)
+                self.assertEqual({kept, deleted}, set(pipeline.sources))
+                threads = [t.name for t in threading.enumerate()]
+                self.assertEqual(2, sum("nalax-follow" in n for n in threads))
+
+                with open(deleted, "ab") as f:
+                    f.write(line(0))
+                await asyncio.sleep(0.2)
+                deleted.unlink()
+                for _ in range(50):
+                    await asyncio.sleep(0.1)
+                    if deleted not in pipeline.sources:
+                        break
+                self.assertEqual({kept}, set(pipeline.sources))
+
+                # its thread and its watch are gone with it
+                await asyncio.sleep(0.1)
+                threads = [t.name for t in threading.enumerate()]
+                self.assertEqual(1, sum("nalax-follow" in n for n in threads))
+                if pipeline.inotify is not None:
+                    watched = {name for _, name in pipeline.inotify.watchers}
+                    self.assertEqual({"kept.log", "kept.log.1"}, watched)
+
+                # new events from the remaining file still come through
+                with open(kept, "ab") as f:
+                    f.write(line(1))
+                await asyncio.sleep(0.3)
+            finally:
+                pipeline.stop()
+                await asyncio.wait_for(task, 5)
+
+            with db.connect(database) as conn:
+                count = db.count_events(conn)
+            self.assertEqual(2, count)
+
+    async def test_round_robin(self) -> None:
+        pipeline = Pipeline(Path("nalax.db"), [])
+        hot = Source(Path("/hot.log"), None)
+        quiet = Source(Path("/quiet.log"), None)
+        for source, count in ((hot, 4), (quiet, 2)):
+            source.chunks = asyncio.Queue()
+            for idx in range(count):
+                source.chunks.put_nowait(Chunk(1, 2, idx, 0, [], 0.0))
+            source.chunks.put_nowait(None)
+            pipeline.sources[source.path] = source
+
+        pipeline.stopped.set()
+        await pipeline.schedule()
+
+        order = []
+        while (item := pipeline.chunks.get_nowait()) is not None:
+            source, chunk = item
+            order.append((source.path.name, chunk.offset))
+        expected = [
+            ("hot.log", 0),
+            ("quiet.log", 0),
+            ("hot.log", 1),
+            ("quiet.log", 1),
+            ("hot.log", 2),
+            ("hot.log", 3),
+        ]
+        self.assertEqual(expected, order)
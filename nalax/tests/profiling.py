@@ -0,0 +1,47 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+import pstats
+import tracemalloc
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from .. import profiling
+
+
+class ProfilingTest(TestCase):
+    def test_span_disabled(self) -> None:
+        self.assertFalse(profiling.ENABLED)
+        self.assertIs(profiling.NULL_SPAN, profiling.span("test.disabled"))
+        with profiling.span("test.disabled"):
+            pass
+        self.assertNotIn("test.disabled", profiling.SPANS)
+
+    def test_profiler(self) -> None:
+        for mode in profiling.MODES:
+            with self.subTest(mode), TemporaryDirectory() as td:
+                output = Path(td) / f"profile{profiling.SUFFIXES[mode]}"
+                profiler = profiling.Profiler(mode, output)
+                profiler.start()
+                try:
+                    for _ in range(3):
+                        with profiling.span("test.enabled"):
+                            sorted(range(1000), reverse=True)
+                finally:
+                    profiler.stop()
+
+                self.assertFalse(profiling.ENABLED)
+                self.assertEqual(3, profiling.SPANS["test.enabled"].calls)
+                self.assertIn("test.enabled", profiling.summary())
+
+                if mode == "cprofile":
+                    stats = pstats.Stats(str(output))
+                    self.assertTrue(stats.get_stats_profile().func_profiles)
+                else:
+                    self.assertFalse(tracemalloc.is_tracing())
+                    snapshot = tracemalloc.Snapshot.load(str(output))
+                    self.assertTrue(snapshot.traces)
+
+        with self.assertRaisesRegex(ValueError, "unknown profile mode"):
+            profiling.Profiler("perf", Path("nalax.perf"))
@@ -0,0 +1,275 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+import json
+from datetime import date
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import arrow
+
+from .. import db, report
+from ..report import Segment
+from ..types import Retention
+from .db import event
+
+
+class ReportTest(TestCase):
+    def test_segments(self) -> None:
+        for since, until, expected in (
+            (
+                date(2023, 5, 3),
+                date(2023, 5, 20),
+                [Segment("daily", (2023, 5, 3), (2023, 5, 20))],
+            ),
+            (
+                date(2023, 5, 1),
+                date(2023, 5, 31),
+                [Segment("monthly", (2023, 5), (2023, 5))],
+            ),
+            (
+                date(2023, 5, 1),
+                date(2023, 5, 20),
+                [Segment("daily", (2023, 5, 1), (2023, 5, 20))],
+            ),
+            (
+                date(2023, 1, 15),
+                date(2023, 5, 20),
+                [
+                    Segment("daily", (2023, 1, 15), (2023, 1, 31)),
+                    Segment("monthly", (2023, 2), (2023, 4)),
+                    Segment("daily", (2023, 5, 1), (2023, 5, 20)),
+                ],
+            ),
+            (
+                date(2023, 1, 15),
+                date(2023, 2, 10),
+                [
+                    Segment("daily", (2023, 1, 15), (2023, 1, 31)),
+                    Segment("daily", (2023, 2, 1), (2023, 2, 10)),
+                ],
+            ),
+            (
+                None,
+                date(2023, 5, 20),
+                [
+                    Segment("monthly", (0, 0), (2023, 4)),
+                    Segment("daily", (2023, 5, 1), (2023, 5, 20)),
+                ],
+            ),
+        ):
+            with self.subTest(since=since, until=until):
+                self.assertEqual(expected, report.segments(since, until))
+
+        # daily stats kept from 2023-05-10, and weekly stats from 2023-05-01
+        retention = Retention(date(2023, 5, 10), date(2023, 5, 1))
+        for since, until, expected in (
+            (
+                date(2023, 5, 15),
+                date(2023, 5, 20),
+                [Segment("daily", (2023, 5, 15), (2023, 5, 20))],
+            ),
+            (
+                # widened back to monday 05-01 and on to sunday 05-14
+                date(2023, 5, 3),
+                date(2023, 5, 20),
+                [
+                    Segment("weekly", (2023, 5, 1), (2023, 5, 8)),
+                    Segment("daily", (2023, 5, 15), (2023, 5, 20)),
+                ],
+            ),
+            (
+                # too few weeks kept, so the whole month
+                date(2023, 4, 29),
+                date(2023, 5, 20),
+                [
+                    Segment("monthly", (2023, 4), (2023, 4)),
+                    Segment("weekly", (2023, 5, 1), (2023, 5, 8)),
+                    Segment("daily", (2023, 5, 15), (2023, 5, 20)),
+                ],
+            ),
+            (
+                # widened on to sunday 05-14
+                None,
+                date(2023, 5, 9),
+                [
+                    Segment("monthly", (0, 0), (2023, 4)),
+                    Segment("weekly", (2023, 5, 1), (2023, 5, 8)),
+                ],
+            ),
+        ):
+            with self.subTest(since=since, until=until, retention=retention):
+                self.assertEqual(expected, report.segments(since, until, retention))
+
+        # weeks can't reach past the end of may into days read from june
+        retention = Retention(date(2023, 6, 1))
+        self.assertEqual(
+            [
+                Segment("monthly", (2023, 5), (2023, 5)),
+                Segment("daily", (2023, 6, 1), (2023, 6, 10)),
+            ],
+            report.segments(date(2023, 5, 3), date(2023, 6, 10), retention),
+        )
+
+    def test_report(self) -> None:
+        day = 1680307200  # 2023-04-01 00:00 UTC
+        events = [
+            event(day + 86400 * offset + idx, path, host)
+            for offset in range(0, 90, 3)  # 2023-04-01 through 2023-06-27
+            for idx, (path, host) in enumerate(
+                (
+                    ("/", "example.com"),
+                    ("/", "example.com"),
+                    ("/about", "example.com"),
+                    ("/", "other.com"),
+                )
+            )
+        ]
+
+        with TemporaryDirectory() as td:
+            database = Path(td) / "nalax.db"
+            db.update_schema(database)
+            with db.Writer(database) as writer:
+                writer.insert_events(events)
+            db.aggregate_daily_events(database, arrow.get(day + 86400 * 100))
+
+            def expected(
+                since: date | None, until: date, host: str | None = None
+            ) -> list[tuple[str, int]]:
+                counts: dict[str, int] = {}
+                for e in events:
+                    day = date(*e.day)
+                    if since is not None and day < since:
+                        continue
+                    if day <= until and host in (None, e.host):
+                        counts[e.path] = counts.get(e.path, 0) + 1
+                return sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))
+
+            for since, until, host in (
+                (date(2023, 4, 10), date(2023, 6, 5), None),
+                (date(2023, 4, 10), date(2023, 6, 5), "example.com"),
+                (date(2023, 4, 1), date(2023, 5, 31), "other.com"),
+                (date(2023, 5, 2), date(2023, 5, 2), None),
+            ):
+                with self.subTest(since=since, until=until, host=host):
+                    query = report.build_query("path", host, since, until)
+                    rows = report.run(database, query)
+                    self.assertEqual(expected(since, until, host), rows)
+
+            query = report.build_query("browser", top=1, until=date(2023, 7, 1))
+            rows = report.run(database, query)
+            self.assertEqual([("firefox", len(events))], rows)
+
+            query = report.build_query("os", "example.com", date(2023, 4, 10))
+            with db.connect(database) as conn:
+                plan = report.explain(conn, query)
+            self.assertTrue(any("COVERING INDEX" in line for line in plan), plan)
+
+            # daily stats before 2023-05-05 and weekly before 2023-04-17 pruned
+            db.prune_rollups(database, 55, 10, today=date(2023, 6, 29))
+            with db.connect(database) as conn:
+                retention = db.get_retention(conn)
+            self.assertEqual(Retention(date(2023, 5, 5), date(2023, 4, 17)), retention)
+
+            for since, until, host, covered in (
+                (date(2023, 5, 2), date(2023, 6, 5), None, date(2023, 5, 1)),
+                (date(2023, 4, 10), date(2023, 5, 3), None, date(2023, 5, 7)),
+                (date(2023, 5, 2), date(2023, 5, 2), "example.com", date(2023, 5, 7)),
+            ):
+                with self.subTest(since=since, until=until, host=host):
+                    with self.assertLogs("nalax.report", "WARNING"):
+                        query = report.build_query(
+                            "path", host, since, until, retention=retention
+                        )
+                    self.assertIn(covered, (query.since, query.until))
+                    widened = expected(query.since, query.until, host)
+                    self.assertEqual(widened, report.run(database, query))
+                    self.assertNotEqual(expected(since, until, host), widened)
+                    with self.assertLogs("nalax.report", "WARNING"):
+                        rows = report.report(database, "path", host, since, until)
+                    self.assertEqual(widened, rows)
+
+            # weeks are read from covering indexes too
+            since, until = date(2023, 5, 2), date(2023, 6, 5)
+            for by, index in (
+                ("path", "idx_nalax_weekly_pages_report_path"),
+                ("os", "idx_nalax_weekly_users_report_os"),
+            ):
+                with self.subTest(by=by), self.assertLogs("nalax.report", "WARNING"):
+                    query = report.build_query(
+                        by, "example.com", since, until, retention=retention
+                    )
+                    with db.connect(database) as conn:
+                        plan = report.explain(conn, query)
+                    weekly = [line for line in plan if "nalax_weekly" in line]
+                    self.assertTrue(weekly, plan)
+                    for line in weekly:
+                        self.assertIn(f"COVERING INDEX {index}", line)
+
+            # ranges of days that are still kept aren't widened
+            since, until = date(2023, 5, 10), date(2023, 6, 5)
+            query = report.build_query("path", None, since, until, retention=retention)
+            self.assertEqual((since, until), (query.since, query.until))
+            self.assertEqual(expected(since, until), report.run(database, query))
+
+    def test_render(self) -> None:
+        rows = [("/", 12), ("/about", 3)]
+        self.assertEqual(
+            [{"path": "/", "count": 12}, {"path": "/about", "count": 3}],
+            json.loads(report.render(rows, "path", "json")),
+        )
+        self.assertEqual(
+            "path,count\n/,12\n/about,3", report.render(rows, "path", "csv")
+        )
+        self.assertEqual(
+            "count  path\n   12  /\n    3  /about",
+            report.render(rows, "path", "table"),
+        )
+
+    def test_invalid(self) -> None:
+        with self.assertRaises(ValueError):
+            report.build_query("referrer")
+        with self.assertRaises(ValueError):
+            report.build_query("path", since=date(2023, 5, 2), until=date(2023, 5, 1))
+
+    def test_cache(self) -> None:
+        day = 1683417600  # 2023-05-07 00:00 UTC
+        since = date(2023, 5, 7)
+        until = date(2023, 5, 8)
+
+        with TemporaryDirectory() as td:
+            database = Path(td) / "nalax.db"
+            db.update_schema(database)
+            with db.Writer(database) as writer:
+                writer.insert_events([event(day), event(day + 1, "/about")])
+            db.aggregate_daily_events(database, arrow.get(day + 86400))
+
+            def run() -> list[tuple[str, int]]:
+                return report.report(database, "path", "example.com", since, until)
+
+            self.assertEqual([("/", 1), ("/about", 1)], run())
+
+            # cache hits never read the stats tables, so this goes unnoticed
+            with db.connect(database) as conn:
+                conn.execute("update nalax_daily_pages set count = 10")
+            self.assertEqual([("/", 1), ("/about", 1)], run())
+
+            # other hosts and days don't invalidate the cached report
+            with db.Writer(database) as writer:
+                writer.insert_events(
+                    [event(day + 86400 * 5), event(day + 10, host="other.com")]
+                )
+            db.aggregate_daily_events(database, arrow.get(day + 86400 * 6))
+            self.assertEqual([("/", 1), ("/about", 1)], run())
+
+            # inline counts for a covered day do
+            with db.Writer(database) as writer:
+                writer.merge_events([event(day + 86400 + 10)])
+            self.assertEqual([("/", 11), ("/about", 10)], run())
+            self.assertEqual(
+                [("/", 11), ("/about", 10)],
+                report.report(
+                    database, "path", "example.com", since, until, cache=False
+                ),
+            )
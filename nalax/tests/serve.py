@@ -0,0 +1,89 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+import asyncio
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any
+from unittest import IsolatedAsyncioTestCase
+
+import arrow
+
+from .. import db
+from ..serve import Server
+from .db import event
+
+
+class ServeTest(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.td = TemporaryDirectory()
+        self.database = Path(self.td.name) / "nalax.db"
+        db.update_schema(self.database)
+
+        day = 1683417600  # 2023-05-07 00:00 UTC
+        with db.Writer(self.database) as writer:
+            writer.insert_events([event(day), event(day + 1), event(day + 2, "/a")])
+        db.aggregate_daily_events(self.database, arrow.get(day + 86400))
+
+        self.server = Server(self.database, port=0, workers=2)
+        await self.server.start()
+
+    async def asyncTearDown(self) -> None:
+        await self.server.close()
+        self.td.cleanup()
+
+    async def get(self, *targets: str) -> list[tuple[int, Any]]:
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.server.port)
+        responses = []
+        try:
+            for target in targets:
+                writer.write(f"GET {target} HTTP/1.1\r\nHost: x\r\n\r\n".encode())
+                head = await reader.readuntil(b"\r\n\r\n")
+                status = int(head.split(b" ")[1])
+                length = next(
+                    int(line.split(b":")[1])
+                    for line in head.split(b"\r\n")
+                    if line.lower().startswith(b"content-length:")
+                )
+                responses.append((status, json.loads(await reader.readexactly(length))))
+        finally:
+            writer.close()
+        return responses
+
+    async def test_report(self) -> None:
+        # several requests on one keep-alive connection
+        responses = await self.get(
+            "/health",
+            "/report?by=path&host=example.com&since=2023-05-01&until=2023-05-31",
+            "/report?by=browser&until=2023-05-31&top=1",
+        )
+        self.assertEqual((200, {"ok": True}), responses[0])
+
+        status, body = responses[1]
+        self.assertEqual(200, status)
+        self.assertEqual(
+            [{"path": "/", "count": 2}, {"path": "/a", "count": 1}], body["rows"]
+        )
+
+        status, body = responses[2]
+        self.assertEqual([{"browser": "firefox", "count": 3}], body["rows"])
+
+    async def test_concurrent(self) -> None:
+        target = "/report?by=os&since=2023-05-07&until=2023-05-07"
+        results = await asyncio.gather(*(self.get(target) for _ in range(20)))
+        for ((status, body),) in results:
+            self.assertEqual(200, status)
+            self.assertEqual([{"os": "linux", "count": 3}], body["rows"])
+
+    async def test_errors(self) -> None:
+        for target, expected in (
+            ("/nope", 404),
+            ("/report?by=referrer", 400),
+            ("/report?since=yesterday", 400),
+            ("/report?top=many", 400),
+        ):
+            with self.subTest(target):
+                ((status, body),) = await self.get(target)
+                self.assertEqual(expected, status)
+                self.assertIn("error", body)
@@ -0,0 +1,46 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+from unittest import TestCase
+
+import arrow
+
+from .. import timestamps
+
+
+class TimestampsTest(TestCase):
+    def test_parse(self) -> None:
+        for value in (
+            "2023-05-07T12:34:56+00:00",
+            "2023-05-07T12:34:57+00:00",
+            "2023-05-07T05:34:56-07:00",
+            "2023-05-08T01:04:56+12:30",
+            "2024-02-29T23:59:59+00:00",
+            "1999-12-31T23:59:59-01:00",
+            "2023-05-07T12:34:56Z",
+            "2023-05-07 12:34:56",
+        ):
+            with self.subTest(value):
+                expected = arrow.get(value).int_timestamp
+                self.assertEqual(expected, timestamps.parse(value))
+
+    def test_parse_msec(self) -> None:
+        for value, expected in (
+            ("1683462896.123", 1683462896),
+            ("1683462896.999", 1683462896),
+            ("1683462896", 1683462896),
+        ):
+            with self.subTest(value):
+                self.assertEqual(expected, timestamps.parse(value))
+
+    def test_parse_time_local(self) -> None:
+        for value in (
+            "07/May/2023:12:34:56 +0000",
+            "07/May/2023:05:34:56 -0700",
+            "08/May/2023:01:04:56 +1230",
+            "29/Feb/2024:23:59:59 +0000",
+            "31/Dec/1999:23:59:59 -0100",
+        ):
+            with self.subTest(value):
+                expected = arrow.get(value, "DD/MMM/YYYY:HH:mm:ss Z").int_timestamp
+                self.assertEqual(expected, timestamps.parse(value))
@@ -0,0 +1,62 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+from unittest import TestCase
+
+import click
+
+from ..main import Duration
+from ..units import is_bare, parse_duration, parse_size
+
+
+class UnitsTest(TestCase):
+    def test_parse_duration(self) -> None:
+        for value, expected in (
+            ("0", 0.0),
+            ("2", 2.0),
+            ("500ms", 0.5),
+            ("1.5s", 1.5),
+            ("2m", 120.0),
+            ("1h", 3600.0),
+            ("250000000ns", 0.25),
+            (" 10 MS ", 0.01),
+        ):
+            with self.subTest(value):
+                self.assertAlmostEqual(expected, parse_duration(value))
+
+        for value in ("", "ms", "5 parsecs", "-1s", "1.2.3s"):
+            with self.subTest(value), self.assertRaises(ValueError):
+                parse_duration(value)
+
+        self.assertAlmostEqual(1.0, parse_duration("1000000000", bare_unit="ns"))
+        self.assertAlmostEqual(0.5, parse_duration("500ms", bare_unit="ns"))
+        self.assertTrue(is_bare(" 12.5 "))
+        self.assertFalse(is_bare("12ms"))
+
+    def test_duration_option(self) -> None:
+        option = click.Option(["--buffer-time"])
+        legacy = Duration(bare_nanoseconds=True)
+        with self.assertLogs("nalax.main", "WARNING"):
+            self.assertAlmostEqual(1.0, legacy.convert("1000000000", option, None))
+        self.assertAlmostEqual(0.5, legacy.convert("500ms", option, None))
+        self.assertEqual(0.0, legacy.convert(0, option, None))
+        with self.assertRaisesRegex(click.BadParameter, "needs a unit"):
+            legacy.convert("0.5", option, None)
+
+        self.assertAlmostEqual(2.0, Duration().convert("2", option, None))
+
+    def test_parse_size(self) -> None:
+        for value, expected in (
+            ("0", 0),
+            ("4096", 4096),
+            ("512KB", 512 << 10),
+            ("16MiB", 16 << 20),
+            ("1.5m", 3 << 19),
+            ("2g", 2 << 30),
+        ):
+            with self.subTest(value):
+                self.assertEqual(expected, parse_size(value))
+
+        for value in ("", "KB", "12 bits", "-1MB"):
+            with self.subTest(value), self.assertRaises(ValueError):
+                parse_size(value)
@@ -1,16 +1,30 @@
 # Copyright Amethyst Reese
 # Licensed under the MIT license
 
+import datetime
+import time
 from dataclasses import dataclass
 from pathlib import Path
 from typing import NamedTuple
 
-import arrow
-
 
 @dataclass
 class Options:
     database: Path
+    agent_rules: Path | None = None
+    log_format: str | None = None
+
+
+@dataclass
+class IngestStats:
+    files: int = 0
+    lines: int = 0
+    events: int = 0
+    seconds: float = 0.0
+
+    @property
+    def bad(self) -> int:
+        return self.lines - self.events
 
 
 class Agent(NamedTuple):
@@ -19,6 +33,29 @@ class Agent(NamedTuple):
     browser: str
 
 
+class Position(NamedTuple):
+    # offset is just past the end of the event's line, size is the length of
+    # complete lines in the file as of when that line was read
+    device: int
+    inode: int
+    offset: int
+    size: int
+
+
+class Retention(NamedTuple):
+    # first day still in the daily tables, and first week start still in the
+    # weekly tables, or None if they have never been pruned
+    daily: datetime.date | None = None
+    weekly: datetime.date | None = None
+
+
+class Checkpoint(NamedTuple):
+    path: str
+    device: int
+    inode: int
+    offset: int
+
+
 class EventRow(NamedTuple):
     timestamp: int
     host: str
@@ -34,7 +71,7 @@ class EventRow(NamedTuple):
 
 @dataclass
 class Event:
-    timestamp: arrow.Arrow
+    timestamp: int
     host: str
     path: str
     method: str
@@ -42,11 +79,12 @@ class Event:
     region: str
     network: str
     agent: Agent
+    position: Position | None = None
 
     @classmethod
     def row_factory(cls, cursor, row) -> "Event":
         return Event(
-            timestamp=arrow.get(row[0]),
+            timestamp=row[0],
             host=row[1],
             path=row[2],
             method=row[3],
@@ -56,9 +94,14 @@ class Event:
             agent=Agent(row[7], row[8], row[9]),
         )
 
+    @property
+    def day(self) -> tuple[int, int, int]:
+        t = time.gmtime(self.timestamp)
+        return t.tm_year, t.tm_mon, t.tm_mday
+
     def as_row(self) -> EventRow:
         return EventRow(
-            timestamp=self.timestamp.int_timestamp,
+            timestamp=self.timestamp,
             host=self.host,
             path=self.path,
             method=self.method,
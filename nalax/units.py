@@ -0,0 +1,60 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT license
+
+import re
+
+DURATION_UNITS = {
+    "ns": 1e-9,
+    "us": 1e-6,
+    "ms": 1e-3,
+    "s": 1.0,
+    "m": 60.0,
+    "h": 3600.0,
+}
+
+SIZE_UNITS = {
+    "b": 1,
+    "k": 1 << 10,
+    "kb": 1 << 10,
+    "kib": 1 << 10,
+    "m": 1 << 20,
+    "mb": 1 << 20,
+    "mib": 1 << 20,
+    "g": 1 << 30,
+    "gb": 1 << 30,
+    "gib": 1 << 30,
+}
+
+VALUE_RE = re.compile(r"\s*(\d+(?:\.\d*)?|\.\d+)\s*([a-z]*)\s*", re.ASCII)
+
+
+def is_bare(value: str) -> bool:
+    """
+    Whether a value is a plain number without a unit.
+    """
+    match = VALUE_RE.fullmatch(value.lower())
+    return match is not None and not match.group(2)
+
+
+def parse_duration(value: str, bare_unit: str = "s") -> float:
+    """
+    Parse a human duration like "500ms", "2s", or "1.5m" into seconds.
+    Bare numbers are in `bare_unit`, seconds by default.
+    """
+    match = VALUE_RE.fullmatch(value.lower())
+    if not match or match.group(2) not in ("", *DURATION_UNITS):
+        raise ValueError(f"invalid duration {value!r}")
+    number, unit = match.groups()
+    return float(number) * DURATION_UNITS[unit or bare_unit]
+
+
+def parse_size(value: str) -> int:
+    """
+    Parse a human byte size like "512KB" or "16MiB" into bytes, using binary
+    multiples. Bare numbers are bytes.
+    """
+    match = VALUE_RE.fullmatch(value.lower())
+    if not match or match.group(2) not in ("", *SIZE_UNITS):
+        raise ValueError(f"invalid size {value!r}")
+    number, unit = match.groups()
+    return int(float(number) * SIZE_UNITS[unit or "b"])